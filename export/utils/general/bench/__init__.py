@@ -0,0 +1,13 @@
+"""Scaling benchmarks for cleanRefs, the balanced-delimiter scanner and the pas-bib DocList.
+
+    corpus builds synthetic bib and aux files of any size; scenarios times the processing steps on them.
+    The baseline stores the timings in units of a calibration loop run alongside, so it holds on other machines.
+    Run from export/utils/general:
+
+        python -m bench generate -n 10000 -o /tmp/corpus    # write a corpus to look at
+        python -m bench run -n 100,1000,10000,100000        # time all scenarios (the quadratic getDocInfoFromBib up to 10000)
+        python -m bench run --save                          # ... and store the timings as the baseline
+        python -m bench check --threshold 1.0               # exit with status 1 if a scenario is more than twice as slow as its baseline
+        python -m bench run -s getRefs,legacyGetRefs        # compare with the replaced (quadratic) implementations
+        python -m bench memory                              # memory of the parsed shipped bib files, compact and as dicts
+    """
@@ -0,0 +1,126 @@
+"""Command line for the benchmarks: python -m bench {generate,run,check,memory} [options] (see bench/__init__.py)"""
+
+import io
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+from bench.corpus import makeCorpus
+from bench.scenarios import scenarios, legacyScenarios, maxSizes, runScenario, calibrate
+from bench.memory import printMemory
+
+_baselineFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+def runAll(sizes, names, repeat, seed):
+    """ Time the scenarios on a fresh corpus of each size
+
+    :return: dictionary of scenario: {size (as a string): seconds}, without the sizes above the scenario's maxSizes
+    """
+    timings = dict((name, {}) for name in names)
+    for n in sizes:
+        work = tempfile.mkdtemp(prefix='bench-corpus-')
+        try:
+            makeCorpus(work, n, seed)
+            for name in names:
+                if n > maxSizes.get(name, n):
+                    continue
+                timings[name][str(n)] = round(runScenario(name, work, repeat), 6)
+        finally:
+            shutil.rmtree(work)
+    return timings
+
+def normalize(timings, unit):
+    """ Timings in units of the calibration loop """
+    return dict((name, dict((n, round(t/unit, 4)) for n, t in bySize.items())) for name, bySize in timings.items())
+
+def printTimings(timings, sizes, unit, baseline=None):
+    """ Print the timings [s], in calibration units, and compared with the baseline (also in calibration units) """
+    print("Calibration loop: {0:.4f} s".format(unit))
+    print("{0:>18} {1:>8} {2:>12} {3:>10} {4:>10}".format('scenario', 'entries', 'time [s]', 'us/entry', 'units') + ("{0:>10} {1:>8}".format('baseline', 'ratio') if baseline else ''))
+    for name, bySize in timings.items():
+        for n in sizes:
+            if not str(n) in bySize:
+                continue
+            t = bySize[str(n)]
+            line = "{0:>18} {1:>8} {2:>12.4f} {3:>10.2f} {4:>10.3f}".format(name, n, t, 1e6*t/n, t/unit)
+            if baseline and str(n) in baseline.get(name, {}):
+                b = baseline[name][str(n)]
+                line += "{0:>10.3f} {1:>8.2f}".format(b, t/unit/b)
+            print(line)
+
+def main(argv):
+    from optparse import OptionParser
+
+    usage = "Usage: python -m bench [options] generate|run|check|memory"
+    parser = OptionParser(usage=usage)
+    parser.add_option("-n", "--sizes", action="store", dest="sizes", default=None,
+                        help="comma separated list of entry counts [default: 100,1000,10000,100000; for check, the sizes in the baseline]")
+    parser.add_option("-s", "--scenarios", action="store", dest="scenarios", default=','.join(scenarios),
+                        help="comma separated list of scenarios [default: all of {0}; also {1}]".format(', '.join(scenarios), ', '.join(legacyScenarios)))
+    parser.add_option("--repeat", action="store", type="int", dest="repeat", default=3, help="timings per scenario and size (best is kept)")
+    parser.add_option("--seed", action="store", type="int", dest="seed", default=1, help="random seed of the corpus")
+    parser.add_option("-o", "--output", action="store", dest="output", default="bench-corpus", help="output directory for generate")
+    parser.add_option("-b", "--baseline", action="store", dest="baseline", default=_baselineFile, help="baseline timings file [default: bench/baseline.json]")
+    parser.add_option("--save", action="store_true", dest="save", default=False, help="with run, store the timings as the baseline")
+    parser.add_option("-t", "--threshold", action="store", type="float", dest="threshold", default=1.0,
+                        help="with check, fail if a scenario takes more than (1 + threshold) times its baseline, both in calibration units [default: 1.0]")
+    parser.add_option("--floor", action="store", type="float", dest="floor", default=0.002,
+                        help="with check, ignore slowdowns of less than this many seconds, which are timing noise [default: 0.002]")
+    (opts, args) = parser.parse_args(argv)
+    if len(args) != 1 or not args[0] in ('generate', 'run', 'check', 'memory'):
+        parser.error("expected one command: generate, run, check or memory")
+    command = args[0]
+    names = [name for name in opts.scenarios.split(',') if name]
+    for name in names:
+        if not name in scenarios and not name in legacyScenarios:
+            parser.error("unknown scenario {0}".format(name))
+    sizes = [int(x) for x in opts.sizes.split(',')] if opts.sizes else None
+
+    if command == 'generate':
+        for n in sizes or [1000]:
+            directory = opts.output if sizes is None or len(sizes) == 1 else os.path.join(opts.output, str(n))
+            makeCorpus(directory, n, opts.seed)
+            print("Wrote a corpus of {0} entries to {1}".format(n, directory))
+        return 0
+    if command == 'memory':
+        printMemory()
+        return 0
+
+    baseline = None
+    if command == 'check' or not opts.save:
+        if os.path.exists(opts.baseline):
+            with io.open(opts.baseline, 'r') as f:
+                baseline = json.load(f)['timings']
+        elif command == 'check':
+            print("No baseline file {0}: make one with run --save".format(opts.baseline))
+            return 2
+    if sizes is None:
+        sizes = sorted(set(int(n) for t in baseline.values() for n in t)) if command == 'check' else [100, 1000, 10000, 100000]
+    unit = calibrate()
+    timings = runAll(sizes, names, opts.repeat, opts.seed)
+    unit = min(unit, calibrate()) # the best of before and after the scenarios
+    printTimings(timings, sizes, unit, baseline)
+
+    if command == 'run' and opts.save:
+        with io.open(opts.baseline, 'w') as f:
+            json.dump({'seed': opts.seed, 'repeat': opts.repeat, 'calibration': round(unit, 6), 'timings': normalize(timings, unit)}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print("Saved the timings as the baseline in {0}".format(opts.baseline))
+    if command == 'check':
+        regressions = []
+        for name, bySize in normalize(timings, unit).items():
+            for n, t in bySize.items():
+                b = baseline.get(name, {}).get(n)
+                if b is not None and t > b*(1 + opts.threshold) and (t - b)*unit > opts.floor:
+                    regressions.append((name, n, t, b))
+        for name, n, t, b in regressions:
+            print("REGRESSION: {0} with {1} entries took {2:.3f} units, {3:.2f} times the baseline {4:.3f} units".format(name, n, t, t/b, b))
+        if regressions:
+            return 1
+        print("No scenario slower than {0:.2f} times its baseline".format(1 + opts.threshold))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
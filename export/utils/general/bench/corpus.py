@@ -0,0 +1,234 @@
+"""Synthetic bib and aux files for the benchmarks.
+
+    The entries mimic the shipped bib files: collaboration and personal author lists, nested braces and math in titles,
+    escaped braces and TeX accents, a sprinkling of UTF-8 characters, and some duplicated keys and DOIs.
+    Everything is drawn from a seeded random generator, so a given size and seed always gives the same files.
+    """
+
+import io
+import os
+import random
+
+tag = 'BENCH' # document tag: the aux file is BENCH_temp.aux
+
+_groups = ('B2G', 'BPH', 'EXO', 'HIG', 'HIN', 'JME', 'SMP', 'SUS', 'TOP', 'FSQ')
+_surnames = ('Sirunyan', 'Tumasyan', 'Khachatryan', 'Chatrchyan', 'Alwall', 'Frixione', 'Nason', 'Sj{\\"o}strand',
+             'Cacciari', 'Salam', 'Soyez', 'Butterworth', 'Ball', 'M{\\"u}ller', 'Fileviez P{\\\'e}rez', 'Kr{\\"a}mer')
+_unicodeSurnames = ('Müller', 'Sjöstrand', 'Pérez', 'Backović') # not allowed with plain BibTeX, but found in real files
+_initials = ('A.', 'M.', 'V.', 'S.', 'J.', 'T.', 'G. P.', 'R. D.')
+_titleParts = ('Measurement of the', 'Search for', 'Observation of', 'Evidence for', 'Study of')
+_titleWords = ('boson', 'quark', 'lepton', 'jet', 'jets', 'resonance', 'resonances', 'heavy', 'light', 'neutral', 'charged',
+               'vector', 'scalar', 'pseudoscalar', 'dark', 'matter', 'photon', 'photons', 'top', 'bottom', 'tau', 'muon', 'electron',
+               'pairs', 'production', 'decays', 'cross', 'section', 'differential', 'inclusive', 'associated', 'single', 'double',
+               'rare', 'exotic', 'long-lived', 'displaced', 'vertices', 'missing', 'transverse', 'momentum', 'energy', 'mass',
+               'width', 'coupling', 'couplings', 'asymmetry', 'polarization', 'spectrum', 'final', 'states', 'channel', 'events',
+               'invariant', 'forward', 'central', 'boosted', 'hadronic', 'leptonic', 'semileptonic', 'multijet', 'diboson')
+_titleMath = ('{$\\mathrm{t}\\overline{\\mathrm{t}}$}', '{$\\mathrm{b}\\overline{\\mathrm{b}}$}', '{$W^{\\pm}$}',
+              '{$\\mathrm{Z}\\mathrm{Z}$}', '{$\\ell\\ell\\nu\\nu$}', '{$\\tau$}', '{Higgs}', '{$\\PH_{\\text{D}}$}')
+_titleEnds = ('in proton-proton collisions at {$\\sqrt{s} = $} 13 {TeV}', 'at {$\\sqrt{s_{\\mathrm{NN}}} = 5.02\\,\\text{TeV}$}',
+              'with the {CMS} detector', 'using {\\{escaped\\}} braces', '')
+_journals = (('JHEP', 'JHEP'), ('Phys. Lett. B', 'j.physletb'), ('Eur. Phys. J. C', 'epjc'), ('Phys. Rev. D', 'PhysRevD'),
+             ('Phys. Rev. Lett.', 'PhysRevLett'), ('JINST', 'JINST'))
+
+def _authors(rng):
+    r = rng.random()
+    if r < 0.45:
+        return '{CMS Collaboration}'
+    if r < 0.5:
+        return '{CMS and TOTEM Collaborations}'
+    n = rng.choice((1, 2, 3, 5, 8, 20))
+    names = []
+    for i in range(n):
+        surname = rng.choice(_unicodeSurnames) if rng.random() < 0.02 else rng.choice(_surnames)
+        names.append('{0}, {1}'.format(surname, rng.choice(_initials)))
+    if rng.random() < 0.3:
+        names = names[:1] + ['others']
+    return ' and '.join(names)
+
+def _title(rng):
+    words = rng.sample(_titleWords, 8)
+    title = ' '.join([rng.choice(_titleParts)] + words[:4] + [rng.choice(_titleMath)] + words[4:] + [rng.choice(_titleEnds)]).strip()
+    if rng.random() < 0.02:
+        title = title.replace('Search', '“Search”', 1)
+    return '{' + title + '}'
+
+def _field(name, value, rng):
+    """ One field, brace or quote delimited (quotes only if the value can be quoted) """
+    if '"' in value or rng.random() < 0.6:
+        return '      {0:<11} = {{{1}}},\n'.format(name, value)
+    return '      {0:<11} = "{1}",\n'.format(name, value)
+
+def makeEntry(i, rng, doi=None):
+    """ One synthetic bib entry
+
+    :param i: entry number (makes the key, DOI, eprint and record number unique)
+    :param rng: random generator
+    :param doi: DOI to use instead of a unique one (to make duplicate DOIs)
+    :return: (key, entry text)
+    """
+    year = 2010 + i % 14
+    r = rng.random()
+    fields = []
+    if r < 0.75:
+        artType = 'ARTICLE'
+        key = '{0}:{1}{2:05d}'.format(rng.choice(('CMS', 'Sirunyan', 'Tumasyan')), year, i)
+        journal, prefix = rng.choice(_journals)
+        fields.append(('AUTHOR', _authors(rng)))
+        if rng.random() < 0.3:
+            fields.append(('COLLABORATION', 'CMS'))
+        fields.append(('TITLE', _title(rng)))
+        fields.append(('JOURNAL', journal))
+        fields.append(('VOLUME', '{0:02d}'.format(i % 12 + 1) if journal == 'JHEP' else str(700 + i % 300)))
+        fields.append(('PAGES', str(100000 + i)))
+        fields.append(('YEAR', str(year)))
+        fields.append(('DOI', doi or '10.1007/{0}{1:05d}'.format(prefix, i)))
+        if rng.random() < 0.9:
+            fields.append(('EPRINT', '{0:02d}{1:02d}.{2:05d}'.format(year % 100, i % 12 + 1, i)))
+            fields.append(('ARCHIVEPREFIX', 'arXiv'))
+    elif r < 0.9:
+        artType = 'TECHREPORT'
+        number = 'CMS-PAS-{0}-{1:02d}-{2:03d}'.format(rng.choice(_groups), year % 100, i % 1000)
+        key = '{0}-{1}'.format(number, i)
+        fields.append(('AUTHOR', '{CMS Collaboration}'))
+        fields.append(('TITLE', _title(rng)))
+        fields.append(('INSTITUTION', 'CERN'))
+        fields.append(('TYPE', 'CMS Physics Analysis Summary'))
+        fields.append(('NUMBER', number))
+        fields.append(('YEAR', str(year)))
+        if rng.random() < 0.9:
+            fields.append(('URL', 'http://cds.cern.ch/record/{0}'.format(1000000 + i)))
+    else:
+        artType = rng.choice(('MISC', 'BOOK', 'INPROCEEDINGS'))
+        key = 'misc{0}'.format(i)
+        fields.append(('AUTHOR', _authors(rng)))
+        fields.append(('TITLE', _title(rng)))
+        fields.append(('HOWPUBLISHED', '\\url{{https://example.org/{0}}}'.format(i)))
+        fields.append(('NOTE', 'Version {0}, with an escaped \\}} brace'.format(i % 7)))
+        fields.append(('YEAR', str(year)))
+    text = '@{0}{{{1},\n'.format(artType, key) + ''.join(_field(name, value, rng) for name, value in fields) + '}\n\n'
+    return key, text
+
+def makeBib(nentries, seed=1):
+    """ Synthetic bib text: about 1% of the entries repeat an earlier key, and 2% an earlier DOI
+
+    :param nentries: number of entries
+    :param seed: random seed
+    :return: (list of keys in file order, bib text)
+    """
+    rng = random.Random(seed)
+    keys = []
+    texts = []
+    dois = []
+    for i in range(nentries):
+        r = rng.random()
+        if keys and r < 0.01:
+            j = rng.randrange(len(texts))
+            key, text = keys[j], texts[j] # duplicate entry: same key
+        else:
+            key, text = makeEntry(i, rng, rng.choice(dois) if dois and r < 0.03 else None)
+            if text.startswith('@ARTICLE'):
+                dois.append(text.split('DOI')[1].split('\n')[0].strip(' =,{}"'))
+        keys.append(key)
+        texts.append(text)
+    return keys, '% synthetic bib file for the benchmarks\n' + ''.join(texts)
+
+def makeAux(keys, seed=1):
+    """ Synthetic aux files citing about 80% of the keys (plus one missing key), in \\citation groups of 1-4 keys,
+    with the second half of the citations in an \\@input aux file, as from an \\include
+
+    :param keys: bib keys
+    :param seed: random seed
+    :return: (main aux text, included aux text)
+    """
+    rng = random.Random(seed)
+    cited = [key for key in dict.fromkeys(keys) if rng.random() < 0.8] + ['missing:2000xx']
+    lines = []
+    i = 0
+    while i < len(cited):
+        n = rng.randint(1, 4)
+        lines.append('\\citation{{{0}}}\n'.format(','.join(cited[i:i+n])))
+        if rng.random() < 0.2:
+            lines.append('\\newlabel{{fig:{0}}}{{{{{0}}}{{1}}{{A caption with {{nested}} braces}}{{figure.{0}}}{{}}}}\n'.format(i))
+        i += n
+    half = len(lines) // 2
+    bibcites = ['\\bibcite{{{0}}}{{{1}}}\n'.format(key, n+1) for n, key in enumerate(cited[:-1])]
+    main = '\\relax \n\\bibstyle{cms_unsrt}\n' + ''.join(lines[:half]) + '\\@input{' + tag + '_chapter.aux}\n' + '\\bibdata{auto_generated}\n' + ''.join(bibcites)
+    return main, '\\relax \n' + ''.join(lines[half:])
+
+def makeDocListBib(nentries, seed=1):
+    """ Synthetic bib text in the format written by pas-bib (DocList.generateBib) """
+    rng = random.Random(seed)
+    out = ['BibFile generated by pas-bib version 0, 2024-01-01 00:00 UTC\n']
+    for i in range(nentries):
+        doc = '{0}-{1:02d}-{2:03d}'.format(_groups[i % len(_groups)], 10 + (i // 1000) % 90, i % 1000)
+        out.append('@ARTICLE{{CMS-PAS-{0},\n'.format(doc))
+        out.append('      COLLABORATION = {CMS},\n')
+        out.append('      TITLE       = "{0}",\n'.format(_title(rng)[1:-1]))
+        out.append('      AUTHOR      = "{CMS Collaboration}",\n')
+        out.append('      URL         = "http://cdsweb.cern.ch/record/{0}",\n'.format(1000000 + i))
+        out.append('      JOURNAL     = "CMS Physics Analysis Summary",\n')
+        out.append('      VOLUME      =  "CMS-PAS-{0}",\n'.format(doc))
+        out.append('      YEAR        = "{0}"\n}}\n'.format(2010 + i % 14))
+    return ''.join(out)
+
+def makeMarcXml(nrecords, seed=1):
+    """ Synthetic CDS MARCXML search result (CMS Papers), as read by DocList.getDocInfoFromMarc.
+    As for real papers, one record in ten has a full author list (100 and 700 datafields) of 500 to 2500 authors,
+    and the others a few authors, so the cost of a record is dominated by its size.
+
+    :param nrecords: number of records
+    :param seed: random seed
+    :return: MARCXML text
+    """
+    rng = random.Random(seed)
+    out = ['<?xml version="1.0" encoding="UTF-8"?>\n<!-- Search-Engine-Total-Number-Of-Results: {0} -->\n'.format(nrecords),
+           '<collection xmlns="http://www.loc.gov/MARC21/slim">\n']
+    for i in range(nrecords):
+        year = 2010 + i % 14
+        doc = '{0}-{1:02d}-{2:03d}'.format(_groups[i % len(_groups)], year % 100, i % 1000)
+        journal, prefix = rng.choice(_journals)
+        nauthors = rng.randint(500, 2500) if rng.random() < 0.1 else rng.randint(1, 5)
+        fields = [('037', (('a', 'arXiv:{0:02d}{1:02d}.{2:05d}'.format(year % 100, i % 12 + 1, i)),)),
+                  ('088', (('a', 'CERN-EP-{0}-{1:03d}'.format(year, i % 1000)),)),
+                  ('088', (('a', 'CMS-{0}'.format(doc)),))]
+        for n in range(nauthors):
+            fields.append(('100' if n == 0 else '700', (('a', '{0}, {1}'.format(rng.choice(_surnames), rng.choice(_initials))), ('u', 'CERN'))))
+        fields += [('245', (('a', _title(rng)[1:-1].replace('&', '&amp;').replace('<', '&lt;')),)),
+                   ('269', (('c', '{0}-{1:02d}-{2:02d}'.format(year, i % 12 + 1, i % 28 + 1)),)),
+                   ('773', (('a', '10.1007/{0}{1:05d}'.format(prefix, i)), ('p', journal), ('v', str(700 + i % 300)),
+                            ('y', str(year)), ('c', str(100000 + i))))]
+        out.append('<record>\n  <controlfield tag="001">{0}</controlfield>\n'.format(2000000 + i))
+        for tag, subfields in fields:
+            out.append('  <datafield tag="{0}" ind1=" " ind2=" ">'.format(tag) +
+                       ''.join('<subfield code="{0}">{1}</subfield>'.format(code, value) for code, value in subfields) + '</datafield>\n')
+        out.append('</record>\n')
+    out.append('</collection>\n')
+    return ''.join(out)
+
+def makeNested(depth):
+    """ A brace-delimited section nested depth levels deep, with an escaped brace at each level """
+    return '{' + 'a \\{ {' * depth + 'x' + ' b \\}}' * depth + '}, trailing text'
+
+def makeLong(length):
+    """ A single brace-delimited section of about length characters, mostly plain text """
+    chunk = 'Measurement of the cross section in $pp$ collisions at \\sqrt{s} = 13\\,TeV with \\{escaped\\} braces. '
+    return '{' + chunk * (length // len(chunk) + 1) + '}, trailing text'
+
+def makeCorpus(directory, nentries, seed=1):
+    """ Write a corpus: auto_generated.bib and the aux files for cleanRefs (document tag BENCH), pasBib.bib for DocList,
+    cds.xml, a CDS search result of nentries/10 records for DocList.getDocInfoFromMarc, and for the balanced-delimiter
+    scanner nested.txt, a section nested nentries deep, and long.txt, a section of 100*nentries characters
+
+    :param directory: output directory (created if needed)
+    :param nentries: number of bib entries
+    :param seed: random seed
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    keys, bib = makeBib(nentries, seed)
+    main, chapter = makeAux(keys, seed)
+    for name, text in (('auto_generated.bib', bib), (tag + '_temp.aux', main), (tag + '_chapter.aux', chapter),
+                       ('pasBib.bib', makeDocListBib(nentries, seed)), ('cds.xml', makeMarcXml(max(10, nentries // 10), seed)),
+                       ('nested.txt', makeNested(nentries)), ('long.txt', makeLong(100*nentries))):
+        with io.open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+            f.write(text)
@@ -0,0 +1,60 @@
+"""The original character-by-character scanner and slice-based bib parser, timed by the legacy scenarios for comparison
+    with bibParse.extractBalanced and cleanRefs.getRefs (both are quadratic on large inputs, so they are not run by default).
+    """
+
+import re
+
+def legacyExtractBalanced(text, delim):
+    """ The original (character-by-character) extractBalanced, for comparison.
+
+    :param text: text to search
+    :param delim: delimiter to match: '{', '"', or '<'
+    :return: [pout, value]
+    """
+    delims = {"{":"}", '"':'"', "<":">"} # matching closing delims
+    if not(delim in delims.keys()):
+        pout = text.find(',')+1
+        pin = 0
+    else:
+        pin = text.find(delim) + 1
+        nbraces = 1
+        pout = pin
+        while nbraces > 0:
+            if pout > len(text):
+                return [0, None]
+            if text[pout:pout+2] == '\\'+delim: # look for escaped delim
+                pout += 2
+            else:
+                if text[pout:pout+2] == '\\'+delims[delim]:
+                    pout += 2
+                else:
+                    if text[pout:pout+1] == delims[delim]:
+                        nbraces -= 1
+                    elif text[pout:pout+1] == delim:
+                        nbraces += 1
+                    pout += 1
+    return [pout, text[pin:pout-1]]
+
+def legacyGetRefs(bibs):
+    """ The original (slice-based) parsing loop of cleanRefs.getRefs, for comparison.
+
+    :param bibs: bib file text
+    :return: number of entries found
+    """
+    bibparse = re.compile(r'^\s*@(\S*)\s*\{',re.MULTILINE)
+    fieldparse = re.compile(r'\s*(\S*)\s*=\s*(\S)',re.MULTILINE)
+    nentries = 0
+    p = 0
+    m = bibparse.search(bibs[p:])
+    while m:
+        [pout, body] = legacyExtractBalanced(bibs[p+m.end(0)-1:],'{')
+        q = 0
+        f = fieldparse.search(body[q:])
+        while f:
+            [qout, value] = legacyExtractBalanced(body[q+f.end(0)-1:],f.group(2))
+            q = q + f.end(0) -1 + qout
+            f = fieldparse.search(body[q:])
+        nentries += 1
+        p = p + m.end(0) -1 + pout
+        m = bibparse.search(bibs[p:])
+    return nentries
@@ -0,0 +1,54 @@
+"""Memory held by parsed bib files, as compact bibParse.bibFields entries and as the plain dicts they replace."""
+
+import io
+import os
+import shutil
+import tempfile
+import contextlib
+import tracemalloc
+
+import cleanRefs
+import bibParse
+
+def tracedSize(build):
+    """ Memory still allocated after build() returns, as measured by tracemalloc (the result is kept alive meanwhile) """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return size
+
+_shippedBibs = ('CMSPapersBib.bib', 'pasBib.bib', 'pasBib-tech.bib', 'gen.bib')
+
+def printMemory(files=_shippedBibs):
+    """ Print the memory held by the parsed bib files, in the compact store and as (artType, dict) entries
+
+    :param files: bib files, relative to the utils directory (where cleanRefs is)
+    """
+    here = os.path.dirname(os.path.abspath(cleanRefs.__file__))
+    print("{0:>18} {1:>8} {2:>12} {3:>12} {4:>8}".format('bib file', 'entries', 'dict [kB]', 'compact [kB]', 'saving'))
+    workDir = tempfile.mkdtemp(prefix='bibbench-')
+    bibs = []
+    try:
+        for name in files:
+            shutil.copy(os.path.join(here, name), os.path.join(workDir, 'auto_generated.bib'))
+            refs = cleanRefs.cleanRefs('BENCH', workDir, 0, True, False)
+            with contextlib.redirect_stdout(io.StringIO()):
+                refs.getRefs()
+            bibs.append((name, refs._bib))
+    finally:
+        shutil.rmtree(workDir)
+    # the dict store gets fresh copies of the type and field name strings, as each parse of the original made them
+    asDicts = lambda bib: dict((key, (artType.upper(), dict((name.upper(), value) for name, value in fields.items()))) for key, (artType, fields) in bib.items())
+    asCompact = lambda bib: dict((key, (artType, bibParse.bibFields(fields.items()))) for key, (artType, fields) in bib.items())
+    totals = [0, 0, 0]
+    for name, bib in bibs + [('all', None)]:
+        if bib is None:
+            entries, plain, compact = totals
+        else:
+            bibParse._fieldLayouts.clear() # count the shared field layouts too
+            entries, plain, compact = len(bib), tracedSize(lambda: asDicts(bib)), tracedSize(lambda: asCompact(bib))
+            totals = [totals[0] + entries, totals[1] + plain, totals[2] + compact]
+        print("{0:>18} {1:>8} {2:>12.1f} {3:>12.1f} {4:>7.0f}%".format(name, entries, plain/1024., compact/1024., 100.*(plain - compact)/plain))
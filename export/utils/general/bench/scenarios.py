@@ -0,0 +1,211 @@
+"""Timed scenarios: each processing step of cleanRefs, the balanced-delimiter scanner, and DocList.getDocInfoFromBib
+    and getDocInfoFromMarc, on a corpus directory.
+
+    Each scenario function takes the corpus directory and returns the elapsed time of the step alone,
+    with the setup (earlier steps, file copies) outside the timing and the printed output discarded.
+    calibrate times a fixed pure-Python workload, the unit in which the timings are compared with the baseline.
+    """
+
+import gc
+import io
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import contextlib
+import collections
+import importlib.util
+
+import cleanRefs
+import bibParse
+from bench.corpus import tag
+from bench import legacy
+
+def _quiet():
+    return contextlib.redirect_stdout(io.StringIO())
+
+def _refs(directory):
+    """ A cleanRefs for the corpus, without caches so every step does its full work """
+    return cleanRefs.cleanRefs(tag, directory, 0, True, False)
+
+def timeGetRefList(directory):
+    refs = _refs(directory)
+    start = time.perf_counter()
+    with _quiet():
+        refs.getRefList()
+    return time.perf_counter() - start
+
+def timeGetRefs(directory):
+    refs = _refs(directory)
+    start = time.perf_counter()
+    with _quiet():
+        refs.getRefs()
+    return time.perf_counter() - start
+
+def timeGetRefsCached(directory):
+    """ getRefs served from the parse cache (filled by an untimed run first) """
+    work = tempfile.mkdtemp(prefix='bench-')
+    try:
+        shutil.copy(os.path.join(directory, 'auto_generated.bib'), work)
+        with _quiet():
+            cleanRefs.cleanRefs(tag, work, 0, True, True).getRefs()
+            refs = cleanRefs.cleanRefs(tag, work, 0, True, True)
+            start = time.perf_counter()
+            refs.getRefs()
+        return time.perf_counter() - start
+    finally:
+        shutil.rmtree(work)
+
+def _read(directory, name):
+    with io.open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+def _timeScan(extract, directory, name):
+    text = _read(directory, name)
+    start = time.perf_counter()
+    extract(text, '{')
+    return time.perf_counter() - start
+
+def timeScanNested(directory):
+    return _timeScan(bibParse.extractBalanced, directory, 'nested.txt')
+
+def timeScanLong(directory):
+    return _timeScan(bibParse.extractBalanced, directory, 'long.txt')
+
+def timeLegacyScanNested(directory):
+    return _timeScan(legacy.legacyExtractBalanced, directory, 'nested.txt')
+
+def timeLegacyScanLong(directory):
+    return _timeScan(legacy.legacyExtractBalanced, directory, 'long.txt')
+
+def timeLegacyGetRefs(directory):
+    text = _read(directory, 'auto_generated.bib')
+    start = time.perf_counter()
+    legacy.legacyGetRefs(text)
+    return time.perf_counter() - start
+
+def timeParseBody(directory):
+    refs = _refs(directory)
+    with io.open(os.path.join(directory, 'auto_generated.bib'), 'r', encoding='utf-8') as f:
+        text = f.read()
+    bodies = []
+    for entry in bibParse.parseBib(text, lambda key, text, pos, endpos: bodies.append((key, pos, endpos))):
+        pass
+    start = time.perf_counter()
+    for key, pos, endpos in bodies:
+        refs.parseBody(key, text, pos, endpos)
+    return time.perf_counter() - start
+
+def timeCheckRefs(directory):
+    refs = _refs(directory)
+    with _quiet():
+        refs.getRefList()
+        refs.getRefs()
+        start = time.perf_counter()
+        refs.checkRefs()
+    return time.perf_counter() - start
+
+def timeRewrite(directory):
+    work = tempfile.mkdtemp(prefix='bench-')
+    try:
+        shutil.copy(os.path.join(directory, 'auto_generated.bib'), work)
+        for name in os.listdir(directory):
+            if name.endswith('.aux'):
+                shutil.copy(os.path.join(directory, name), work)
+        refs = _refs(work)
+        with _quiet():
+            refs.getRefList()
+            refs.getRefs()
+            start = time.perf_counter()
+            refs.rewrite()
+        return time.perf_counter() - start
+    finally:
+        shutil.rmtree(work)
+
+def _docList():
+    """ The DocList class from pas-bib.py (which cannot be imported by name) """
+    if not 'pasbib' in sys.modules:
+        spec = importlib.util.spec_from_file_location('pasbib', os.path.join(os.path.dirname(os.path.abspath(cleanRefs.__file__)), 'pas-bib.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules['pasbib'] = module
+    return sys.modules['pasbib'].DocList
+
+def timeGetDocInfoFromBib(directory):
+    docs = _docList()(0, None, 'notes', False)
+    docs._bibFilename = os.path.join(directory, 'pasBib.bib')
+    start = time.perf_counter()
+    with _quiet():
+        docs.getDocInfoFromBib()
+    return time.perf_counter() - start
+
+def timeGetDocInfoFromMarc(directory):
+    docs = _docList()(0, None, 'papers', False)
+    records = sys.modules['pasbib'].marcRecords(os.path.join(directory, 'cds.xml'))
+    start = time.perf_counter()
+    with _quiet():
+        docs.getDocInfoFromMarc(records)
+    return time.perf_counter() - start
+
+scenarios = collections.OrderedDict([
+    ('getRefList', timeGetRefList),
+    ('getRefs', timeGetRefs),
+    ('getRefsCached', timeGetRefsCached),
+    ('parseBody', timeParseBody),
+    ('checkRefs', timeCheckRefs),
+    ('rewrite', timeRewrite),
+    ('scanNested', timeScanNested),
+    ('scanLong', timeScanLong),
+    ('getDocInfoFromBib', timeGetDocInfoFromBib),
+    ('getDocInfoFromMarc', timeGetDocInfoFromMarc),
+])
+
+maxSizes = { # largest corpus a scenario is run on: getDocInfoFromBib is quadratic (it slices the rest of the file at each
+             # entry) and takes about 7 s for 10000 entries, so 100000 would take over ten minutes
+    'getDocInfoFromBib': 10000,
+}
+
+legacyScenarios = collections.OrderedDict([ # the replaced implementations, quadratic: only run when asked for
+    ('legacyGetRefs', timeLegacyGetRefs),
+    ('legacyScanNested', timeLegacyScanNested),
+    ('legacyScanLong', timeLegacyScanLong),
+])
+
+def runScenario(name, directory, repeat):
+    """ Best of repeat timings of one scenario [s], with the garbage collector off as in timeit """
+    run = scenarios.get(name) or legacyScenarios[name]
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            elapsed = run(directory)
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+_calibrationText = '@ARTICLE{key, TITLE = "{Search for {$\\sqrt{s}$} 13 {TeV}}", YEAR = "2024"}\n' * 200
+_calibrationWords = re.compile(r'\\[A-Za-z]+|[{}]|\w+')
+
+def _calibrationLoop():
+    counts = {}
+    for _ in range(20):
+        for token in _calibrationWords.findall(_calibrationText):
+            counts[token] = counts.get(token, 0) + 1
+        ' '.join(sorted(counts)).split()
+    return counts
+
+def calibrate(repeat=10):
+    """ Best of repeat timings of a fixed workload of the same kind as the scenarios (regex scanning, dict and string
+    operations) [s]. Timings divided by it are roughly independent of the speed of the machine.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _calibrationLoop()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
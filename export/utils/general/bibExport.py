@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+"""Export a bib file (normally CMSPapersBib.bib) as BibTeX and RIS in one pass.
+
+    The bib file is parsed once with bibParse, and each entry is written to both outputs as it is reached.
+    The BibTeX output is a re-rendering (whitespace in values collapsed), so it is only written when asked for,
+    and never over the input.
+    The rendered BibTeX and RIS of every entry are kept in a cache next to the BibTeX output, keyed by
+    a hash of the entry text, so a refresh only parses and renders the entries that changed.
+    Outputs are written to temporary files which replace the old ones only if they differ.
+    """
+
+import os
+import io
+import re
+import sys
+import hashlib
+import pickle
+import filecmp
+
+from bibParse import parseBib, parseFields, splitAuthors
+
+__version__ = "1.1"
+
+_bibFieldOrder = ('COLLABORATION', 'TITLE', 'AUTHOR', 'JOURNAL', 'VOLUME', 'PAGES', 'DOI', 'URL', 'NOTE', 'PUBDATE', 'YEAR', 'EPRINT', 'ARCHIVEPREFIX') # CMSPapersBib layout; other fields follow in their own order
+_bibFieldIndent = {'ARCHIVEPREFIX': '    '} # names longer than the name column, right aligned as in CMSPapersBib
+_risTypes = {'ARTICLE': 'JOUR', 'TECHREPORT': 'RPRT', 'BOOK': 'BOOK', 'INPROCEEDINGS': 'CONF', 'PHDTHESIS': 'THES'} # anything else is GEN
+_keyPrefix = re.compile(r'^CMS-(?:PAPERS|PAS)-') # dropped from the key for the RIS label
+_texTokens = re.compile(r'\\(?:[A-Za-z]+|.)|[{}^_]|\s+|[^\\{}^_\s]+') # control sequences, braces, sub/superscripts, blanks, and runs of anything else
+_texWords = re.compile(r'\\[A-Za-z]+') # control words, compared between the bib and the RIS by checkRis
+
+def renderBib(artType, key, fields):
+    """ BibTeX text of an entry, in the layout of CMSPapersBib.bib
+
+    :param artType: entry type, e.g. ARTICLE
+    :param key: bib key
+    :param fields: entry fields
+    :return: the entry text, ending with a newline
+    """
+    rank = dict((name, i) for i, name in enumerate(_bibFieldOrder))
+    names = sorted(fields.keys(), key=lambda name: rank.get(name, len(_bibFieldOrder))) # stable, so other fields keep their order
+    out = ['@{0}{{{1},\n'.format(artType, key)]
+    for name in names:
+        value = fields[name]
+        value = '{' + value + '}' if '"' in value else '"' + value + '"'
+        out.append('{0}{1:<11} = {2},\n'.format(_bibFieldIndent.get(name, '      '), name, value))
+    out.append('}\n')
+    return ''.join(out)
+
+def _risText(value):
+    """ RIS text of a field value: the protective braces are dropped, whitespace collapsed, and the rest kept verbatim.
+        A group attached to a control sequence, to ^ or _, or following another attached group ({$\\sqrt{s}$},
+        \\frac{a}{b}) is TeX syntax and keeps its braces; any other group ({TeV}, {$...$}) only protects case.
+    """
+    out = []
+    stack = [] # per open group: whether its braces are kept
+    attached = False # whether a group opened here would be an argument
+    for m in _texTokens.finditer(value):
+        t = m.group(0)
+        if t == '{':
+            stack.append(attached)
+            if attached:
+                out.append(t)
+            attached = False
+        elif t == '}':
+            kept = stack.pop() if stack else True
+            if kept:
+                out.append(t)
+            attached = kept
+        elif t[0].isspace():
+            out.append(' ')
+        else:
+            out.append(t)
+            attached = t[0] == '\\' and t not in ('\\{', '\\}') or t in ('^', '_')
+    out.extend('}' for kept in stack if kept)
+    return ' '.join(''.join(out).split())
+
+def renderRis(artType, key, fields):
+    """ RIS record of an entry, with the tags in the order of CMSPapersBib.ris
+
+    :param artType: entry type, e.g. ARTICLE
+    :param key: bib key
+    :param fields: entry fields
+    :return: the record text, ending with a newline
+    """
+    out = [('TY', _risTypes.get(artType, 'GEN'))]
+    for tag, name in (('JO', 'JOURNAL'), ('DO', 'DOI')):
+        if name in fields:
+            out.append((tag, _risText(fields[name])))
+    if 'URL' in fields and not 'DOI' in fields:
+        out.append(('UR', fields['URL']))
+    for tag, name in (('PY', 'YEAR'), ('VL', 'VOLUME')):
+        if name in fields:
+            out.append((tag, _risText(fields[name])))
+    if 'COLLABORATION' in fields:
+        out.append(('AU', _risText(fields['COLLABORATION']) + ' Collaboration,'))
+    elif 'AUTHOR' in fields:
+        out.extend(('AU', _risText(author)) for author in splitAuthors(fields['AUTHOR']) if author != 'others')
+    for tag, name in (('SP', 'PAGES'), ('TI', 'TITLE')):
+        if name in fields:
+            out.append((tag, _risText(fields[name])))
+    out.append(('LB', _keyPrefix.sub('', key)))
+    if 'NOTE' in fields:
+        out.append(('N1', '[' + _risText(fields['NOTE']) + ']'))
+    return ''.join('{0}  - {1}\n'.format(tag, value) for tag, value in out) + 'ER  -\n'
+
+def _readRis(risFile):
+    """ Records of a RIS file, as lists of (tag, value) """
+    records = []
+    record = []
+    with io.open(risFile, 'r', encoding='utf-8') as f:
+        for line in f:
+            tag, sep, value = line.rstrip('\n').partition('  -')
+            if not sep:
+                continue
+            if tag == 'ER':
+                records.append(record)
+                record = []
+            else:
+                record.append((tag, value.strip()))
+    return records
+
+def checkRis(source, risFile=None):
+    """ Check that the RIS titles keep their TeX intact: a control word of a TI which is not in its bib TITLE but
+        extends one used in the bib titles (\\sqrts, \\mathrmp) is an argument whose braces were lost, and the
+        braces of a TI must balance.
+
+    :param source: bib file
+    :param risFile: RIS file to check (default: the RIS rendered from source, not written anywhere)
+    :return: list of (label, message) per problem
+    """
+    with io.open(source, 'r', encoding='utf-8') as f:
+        text = f.read()
+    titles = {}
+    rendered = []
+    for artType, key, fields, start, end in parseBib(text):
+        titles[_keyPrefix.sub('', key)] = fields.get('TITLE', '')
+        if risFile is None:
+            rendered.append([tuple(line.split('  - ', 1)) for line in renderRis(artType, key, fields).splitlines()[:-1]])
+    known = set(word for title in titles.values() for word in _texWords.findall(title))
+    problems = []
+    for record in (rendered if risFile is None else _readRis(risFile)):
+        record = dict(record)
+        label = record.get('LB', '?')
+        title = record.get('TI')
+        if title is None or not label in titles:
+            continue
+        glued = sorted(word for word in set(_texWords.findall(title)) - set(_texWords.findall(titles[label]))
+                       if any(word[:i] in known for i in range(2, len(word))))
+        if glued:
+            problems.append((label, "TI has control words glued to their argument: {0}".format(' '.join(glued))))
+        depth = 0
+        for m in re.finditer(r'\\[{}]|[{}]', title):
+            depth += {'{': 1, '}': -1}.get(m.group(0), 0)
+            if depth < 0:
+                break
+        if depth:
+            problems.append((label, "TI has unbalanced braces"))
+    return problems
+
+class bibExport(object):
+    """Incremental BibTeX and RIS export of a bib file."""
+
+    def __init__(self, bibFile, risFile, cacheFile=None, verbose=0):
+        """
+        :param bibFile: BibTeX output (None: RIS only)
+        :param risFile: RIS output (None: BibTeX only)
+        :param cacheFile: rendered entries from the last export (default: the BibTeX (or RIS) output + '.export'; '' for no cache)
+        :param verbose: verbosity
+        """
+        self._bibFile = bibFile
+        self._risFile = risFile
+        self._cacheFile = (bibFile or risFile) + '.export' if cacheFile is None else cacheFile
+        self._verbosity = verbose
+        self._counts = {'entries': 0, 'rendered': 0}
+
+    def _loadCache(self):
+        if not self._cacheFile or not os.path.exists(self._cacheFile):
+            return {}
+        try:
+            with io.open(self._cacheFile, 'rb') as f:
+                cached = pickle.load(f)
+        except Exception:
+            return {}
+        return cached.get('records', {}) if cached.get('version') == __version__ else {}
+
+    def _saveCache(self, records):
+        if not self._cacheFile:
+            return
+        tmp = self._cacheFile + '.tmp'
+        with io.open(tmp, 'wb') as f:
+            pickle.dump({'version': __version__, 'records': records}, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._cacheFile)
+
+    def export(self, source):
+        """ Write the BibTeX and RIS of every entry of source, reusing the rendering of the entries unchanged since the last export.
+
+        :param source: input bib file (not the BibTeX output)
+        :return: list of the outputs which changed
+        """
+        with io.open(source, 'r', encoding='utf-8') as f:
+            text = f.read()
+        cached = self._loadCache()
+        records = {}
+        seen = set()
+        outputs = [(name, name + '.tmp') for name in (self._bibFile, self._risFile) if name]
+        files = [io.open(tmp, 'w', encoding='utf-8', newline='\n', buffering=1<<16) for name, tmp in outputs]
+        try:
+            first = re.search(r'(?m)^\s*@', text)
+            header = text[:first.start()] if first else text
+            for f in files:
+                f.write(header)
+            for artType, key, body, start, end in parseBib(text, lambda key, text, pos, endpos: (pos, endpos)):
+                if key in seen:
+                    print(">>> Duplicate entry for {0} being discarded".format(key))
+                    continue
+                seen.add(key)
+                digest = hashlib.sha1(text[start:end].encode('utf-8')).digest()
+                rendered = cached.get(digest)
+                if rendered is None:
+                    fields = parseFields(text, *body)
+                    rendered = (renderBib(artType, key, fields), renderRis(artType, key, fields))
+                    self._counts['rendered'] += 1
+                records[digest] = rendered
+                if self._bibFile:
+                    files[0].write(rendered[0])
+                if self._risFile:
+                    files[-1].write(rendered[1])
+            self._counts['entries'] = len(seen)
+        except BaseException:
+            for f in files:
+                f.close()
+            for name, tmp in outputs:
+                os.remove(tmp)
+            raise
+        for f in files:
+            f.close()
+        changed = []
+        for name, tmp in outputs:
+            if os.path.exists(name) and filecmp.cmp(tmp, name, shallow=False):
+                os.remove(tmp)
+            else:
+                os.replace(tmp, name)
+                changed.append(name)
+        self._saveCache(records)
+        if self._verbosity > 0:
+            print("Exported {0} entries ({1} rendered, the others from the cache); changed: {2}".format(self._counts['entries'], self._counts['rendered'], ', '.join(changed) or 'none'))
+        return changed
+
+def main(argv):
+    from optparse import OptionParser
+
+    usage = "Usage: %prog [options] bibfile\n\tWrites the RIS version of bibfile next to it, and the reformatted BibTeX to the --bib file"
+    parser = OptionParser(usage=usage, version=__version__)
+    parser.add_option("-v", "--verbosity", action="count", dest="verbose", default=0,
+                        help="trace script execution; repeated use increases the verbosity more")
+    parser.add_option("--bib", action="store", dest="bib", default=None, help="BibTeX output, which may not be the input bib file [default: none]")
+    parser.add_option("--ris", action="store", dest="ris", default=None, help="RIS output [default: the input with extension .ris]")
+    parser.add_option("--no-cache", action="store_true", dest="noCache", default=False, help="render every entry, without reading or writing the export cache")
+    parser.add_option("--check", action="store_true", dest="check", default=False, help="write nothing; check the TeX in the titles of the RIS rendered from bibfile and of the existing RIS file")
+    (opts, args) = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error("expected one bib file")
+    source = args[0]
+    risFile = opts.ris or os.path.splitext(source)[0] + '.ris'
+    if opts.check:
+        problems = checkRis(source)
+        if os.path.exists(risFile):
+            problems += checkRis(source, risFile)
+        for label, message in problems:
+            print("{0}: {1}".format(label, message))
+        return 1 if problems else 0
+    if opts.bib and os.path.exists(opts.bib) and os.path.samefile(opts.bib, source):
+        parser.error("--bib {0} is the input bib file; the reformatted BibTeX is not a lossless copy, so write it elsewhere".format(opts.bib))
+    exporter = bibExport(opts.bib, risFile, '' if opts.noCache else None, opts.verbose)
+    exporter.export(source)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+
+"""Index of the shipped bib files (CMSPapersBib.bib, pasBib.bib, ...) in an SQLite database.
+
+    Each entry is indexed by key, DOI, eprint, CDS record ID and normalized title, so the canonical key of a paper
+    can be looked up without scanning the bib files. A bib file is only reparsed when its content has changed.
+    cleanRefs --index uses the database to suggest canonical keys for the entries of a paper.
+    """
+
+import os
+import io
+import re
+import sys
+import hashlib
+import sqlite3
+from urllib.request import pathname2url
+
+from bibParse import parseBib, normalizeId, normalizeTitle
+
+_defaultSources = ('CMSPapersBib.bib', 'pasBib.bib', 'pasBib-tech.bib', 'gen.bib', 'higgs.bib')
+_cdsRecord = re.compile(r'cds(?:web)?\.cern\.ch/record/(\d+)')
+_indexFields = ('KEY', 'DOI', 'EPRINT', 'CDSID', 'TITLE') # lookup fields, in the order used by suggest (KEY is not used there)
+_schema = """
+CREATE TABLE IF NOT EXISTS sources (file TEXT PRIMARY KEY, rank INTEGER, size INTEGER, mtime REAL, digest TEXT);
+CREATE TABLE IF NOT EXISTS entries (source TEXT, key TEXT, arttype TEXT, doi TEXT, eprint TEXT, cdsid TEXT, title TEXT);
+CREATE INDEX IF NOT EXISTS entries_key ON entries (key);
+CREATE INDEX IF NOT EXISTS entries_doi ON entries (doi);
+CREATE INDEX IF NOT EXISTS entries_eprint ON entries (eprint);
+CREATE INDEX IF NOT EXISTS entries_cdsid ON entries (cdsid);
+CREATE INDEX IF NOT EXISTS entries_title ON entries (title);
+CREATE INDEX IF NOT EXISTS entries_source ON entries (source);
+"""
+
+def cdsRecord(fields):
+    """ CDS record ID of an entry, from its URL
+
+        :param fields: bib entry fields
+        :return: the record number as a string, or None"""
+    m = _cdsRecord.search(fields.get('URL', '').lower())
+    return m.group(1) if m else None
+
+def indexValues(fields):
+    """ The normalized DOI, EPRINT, CDS record ID and TITLE of an entry, as stored in (and looked up in) the index
+
+        :param fields: bib entry fields
+        :return: dictionary of field: normalized value, for the fields present"""
+    values = {}
+    for field in ('DOI', 'EPRINT'):
+        if field in fields:
+            value = normalizeId(field, fields[field])
+            if value:
+                values[field] = value
+    cdsid = cdsRecord(fields)
+    if cdsid:
+        values['CDSID'] = cdsid
+    if 'TITLE' in fields:
+        value = normalizeTitle(fields['TITLE'])
+        if value:
+            values['TITLE'] = value
+    return values
+
+class bibIndex(object):
+    """SQLite index of bib files: key, DOI, eprint, CDS record ID and normalized title of every entry."""
+
+    def __init__(self, dbFile, verbose=0, readOnly=False):
+        """
+        :param dbFile: SQLite database file (created if needed, unless readOnly)
+        :param verbose: verbosity
+        :param readOnly: open an existing index for lookups only
+        :raise ValueError: if readOnly and dbFile is missing, is not an index, or has no bib files indexed
+        """
+        self._dbFile = dbFile
+        self._verbosity = verbose
+        if not readOnly:
+            self._db = sqlite3.connect(dbFile)
+            self._db.executescript(_schema)
+            return
+        if not os.path.isfile(dbFile):
+            raise ValueError("bibIndex >>> No index database {0}: build it with bibIndex.py".format(dbFile))
+        self._db = sqlite3.connect('file:{0}?mode=ro'.format(pathname2url(os.path.abspath(dbFile))), uri=True)
+        try:
+            nsources = self._db.execute('SELECT COUNT(*) FROM sources').fetchone()[0]
+            self._db.execute('SELECT COUNT(*) FROM entries').fetchone()
+        except sqlite3.DatabaseError as e:
+            self._db.close()
+            raise ValueError("bibIndex >>> {0} is not a bib index database: {1}".format(dbFile, e))
+        if not nsources:
+            self._db.close()
+            raise ValueError("bibIndex >>> No bib files indexed in {0}: build it with bibIndex.py".format(dbFile))
+
+    def close(self):
+        self._db.close()
+
+    def update(self, files, prune=True):
+        """ Bring the index up to date with the bib files: unchanged files (same size and time, or same content) are skipped.
+
+        :param files: bib files, in order of precedence for suggest
+        :param prune: drop the entries of files indexed before but not in files
+        :return: number of files (re)indexed
+        """
+        known = dict((row[0], row[1:]) for row in self._db.execute('SELECT file, rank, size, mtime, digest FROM sources'))
+        files = [os.path.abspath(f) for f in files]
+        nindexed = 0
+        with self._db:
+            for rank, file in enumerate(files):
+                if not os.path.exists(file):
+                    print("bibIndex >>> No bib file {0}".format(file))
+                    continue
+                st = os.stat(file)
+                old = known.get(file)
+                if old and old[1] == st.st_size and old[2] == st.st_mtime:
+                    if old[0] != rank:
+                        self._db.execute('UPDATE sources SET rank=? WHERE file=?', (rank, file))
+                    continue
+                with io.open(file, 'rb') as f:
+                    data = f.read()
+                digest = hashlib.sha256(data).hexdigest()
+                if not (old and old[3] == digest):
+                    self._indexFile(file, data.decode('utf-8', 'replace'))
+                    nindexed += 1
+                self._db.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?)', (file, rank, st.st_size, st.st_mtime, digest))
+            if prune:
+                for file in set(known) - set(files):
+                    if self._verbosity > 0:
+                        print("Dropping {0} from the index".format(file))
+                    self._db.execute('DELETE FROM entries WHERE source=?', (file,))
+                    self._db.execute('DELETE FROM sources WHERE file=?', (file,))
+        return nindexed
+
+    def _indexFile(self, file, text):
+        """ Replace the entries of one bib file in the index """
+        self._db.execute('DELETE FROM entries WHERE source=?', (file,))
+        rows = []
+        for artType, key, fields, start, end in parseBib(text):
+            values = indexValues(fields)
+            rows.append((file, key, artType, values.get('DOI'), values.get('EPRINT'), values.get('CDSID'), values.get('TITLE')))
+        self._db.executemany('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        if self._verbosity > 0:
+            print("Indexed {0} entries from {1}".format(len(rows), file))
+
+    def lookup(self, field, value, normalized=False):
+        """ Entries with the given key, DOI, eprint, CDS record ID or title
+
+        :param field: one of KEY, DOI, EPRINT, CDSID, TITLE
+        :param value: the value to look for
+        :param normalized: value is already in the normalized form of the index
+        :return: list of (key, source file), in order of precedence of the sources
+        """
+        if not field in _indexFields:
+            raise ValueError("bibIndex >>> Cannot look up field {0}".format(field))
+        if not normalized:
+            if field == 'TITLE':
+                value = normalizeTitle(value)
+            elif field in ('DOI', 'EPRINT'):
+                value = normalizeId(field, value)
+        column = 'key' if field == 'KEY' else field.lower()
+        return self._db.execute('SELECT entries.key, entries.source FROM entries JOIN sources ON entries.source = sources.file '
+                                'WHERE entries.{0} = ? ORDER BY sources.rank, entries.rowid'.format(column), (value,)).fetchall()
+
+    def suggest(self, fields):
+        """ The canonical entry for a bib entry: the first indexed entry matching its DOI, eprint, CDS record ID or title, in that order
+
+        :param fields: bib entry fields
+        :return: (key, source file, matching field), or None
+        """
+        values = indexValues(fields)
+        for field in _indexFields[1:]:
+            if field in values:
+                matches = self.lookup(field, values[field], normalized=True)
+                if matches:
+                    return matches[0] + (field,)
+        return None
+
+def main(argv):
+    from optparse import OptionParser
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    usage = "Usage: %prog [options] [bib files]"
+    parser = OptionParser(usage=usage)
+    parser.add_option("-v", "--verbosity", action="count", dest="verbose", default=0,
+                        help="trace script execution; repeated use increases the verbosity more")
+    parser.add_option("-d", "--database", action="store", dest="database", default=os.path.join(here, 'bibIndex.db'),
+                        help="SQLite database file [default: bibIndex.db in the script directory]")
+    parser.add_option("-q", "--query", action="append", dest="query", default=[],
+                        help="look up FIELD:VALUE (FIELD one of key, doi, eprint, cdsid, title) instead of updating the index; may be repeated")
+    (opts, args) = parser.parse_args(argv)
+
+    try:
+        index = bibIndex(opts.database, opts.verbose, readOnly=bool(opts.query))
+    except ValueError as e:
+        print(e)
+        return 1
+    try:
+        if opts.query:
+            for query in opts.query:
+                field, sep, value = query.partition(':')
+                if not sep or not field.upper() in _indexFields:
+                    print("bibIndex >>> Bad query {0}: use FIELD:VALUE".format(query))
+                    continue
+                matches = index.lookup(field.upper(), value)
+                print("{0}: {1}".format(query, ', '.join('{0} ({1})'.format(key, os.path.basename(source)) for key, source in matches) or 'not found'))
+        else:
+            files = args if args else [os.path.join(here, f) for f in _defaultSources]
+            n = index.update(files)
+            print("Reindexed {0} of {1} bib files into {2}".format(n, len(files), opts.database))
+    finally:
+        index.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
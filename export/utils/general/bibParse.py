@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+
+"""Parsing helpers shared by the bib/TeX utilities (cleanRefs, cleanRefs2, pas-bib, build_submission_packages).
+
+    The balanced-delimiter scanner jumps from one (possibly escaped) delimiter to the next with a compiled
+    regex instead of walking the text a character at a time, and works on offsets into the original text
+    rather than on slices of it. parseBib walks the entries of a bib file, and bibFields is a compact store
+    for the fields of a parsed entry. splitAuthors splits an AUTHOR field into its authors. normalizeId and
+    normalizeTitle put identifiers and titles in a canonical form for comparison.
+    """
+
+import re
+import sys
+import itertools
+import functools
+from array import array
+
+_closingDelims = {"{": "}", '"': '"', "<": ">"} # matching closing delims
+_balancedScanners = {"{": re.compile(r'\\[{}]|[{}]'), '"': re.compile(r'\\"|"'), "<": re.compile(r'\\[<>]|[<>]')} # escaped or bare delimiters
+
+def scanBalanced(text, pos, delim, endpos=None, warn=True):
+    """ Extract a delimited section of text[pos:endpos], in place rather than on a copy.
+        Escaped delimiters (\\{, \\}, ...) are skipped over and do not count towards the nesting.
+
+        :param text: full text to search
+        :param pos: index at which to start the search
+        :param delim: delimiter to match. Available opening delimiters are '{', '"', and  '<'. Anything else reads up to the next comma.
+        :param endpos: index at which to stop the search (default: end of text)
+        :param warn: print a message for a missing opening delimiter or an unterminated section
+        :return: [pout, value]: absolute index just past the closing delimiter, and the delimited text (None on error)"""
+    if endpos is None:
+        endpos = len(text)
+    if not(delim in _balancedScanners):
+        pout = text.find(',', pos, endpos)
+        if pout < 0:
+            return [pos, text[pos:endpos-1]] # no comma, so drop the last character
+        return [pout+1, text[pos:pout]]
+    pin = text.find(delim, pos, endpos) + 1
+    if pin == 0:
+        if warn:
+            print('Bad delim')
+        pin = pos
+    close = _closingDelims[delim]
+    scanner = _balancedScanners[delim]
+    nbraces = 1
+    for m in scanner.finditer(text, pin, endpos):
+        d = m.group(0)
+        if d == close:
+            nbraces -= 1
+            if nbraces == 0:
+                pout = m.end(0)
+                return [pout, text[pin:pout-1]]
+        elif d == delim:
+            nbraces += 1
+    if warn:
+        print("extractBalanced >>> Error parsing text: {0}".format(text[pin:pin+min([endpos-pos,15])]))
+    return [pos, None] # probably unmatched } inside TeX comment string
+
+def extractBalanced(text, delim='{', warn=True):
+    """ Extract a delimited section of text, starting at the first opening delimiter.
+
+        :param text: text to search
+        :param delim: delimiter to match. Available opening delimiters are '{', '"', and  '<'. Anything else reads up to the next comma.
+        :param warn: print a message for a missing opening delimiter or an unterminated section
+        :return: [pout, value]: index in text just past the closing delimiter, and the delimited text (None on error)"""
+    return scanBalanced(text, 0, delim, warn=warn)
+
+_fieldLayouts = {} # tuple of field names: (the same tuple, {name: index}), shared by all entries with those fields in that order
+
+def _fieldLayout(names):
+    """ The shared layout for a sequence of field names, interning the names the first time it is seen """
+    names = tuple(names)
+    layout = _fieldLayouts.get(names)
+    if layout is None:
+        names = tuple(sys.intern(name) for name in names)
+        layout = _fieldLayouts[names] = (names, dict((name, i) for i, name in enumerate(names)))
+    return layout
+
+class bibFields(object):
+    """ Ordered fields of one bib entry, with the read and write API of the dict {fieldName: fieldValue} it replaces.
+
+        The field names live in a layout shared with every other entry that has the same fields in the same order.
+        The values are concatenated into one string, with the end of each value held in an array of offsets.
+        Changing a field repacks the entry, so writes are slower than reads.
+        """
+    __slots__ = ('_layout', '_text', '_ends')
+    __hash__ = None
+
+    def __init__(self, fields=()):
+        """
+        :param fields: dict, or sequence of (name, value) pairs; a repeated name replaces the earlier value, in place
+        """
+        if hasattr(fields, 'items'):
+            fields = fields.items()
+        index = {}
+        names = []
+        values = []
+        for name, value in fields:
+            if name in index:
+                values[index[name]] = value
+            else:
+                index[name] = len(names)
+                names.append(name)
+                values.append(value)
+        self._pack(names, values)
+
+    def _pack(self, names, values):
+        self._layout = _fieldLayout(names)
+        self._text = ''.join(values)
+        self._ends = array('I', itertools.accumulate(len(value) for value in values))
+
+    def _value(self, i):
+        return self._text[self._ends[i-1] if i else 0:self._ends[i]]
+
+    def __getitem__(self, name):
+        return self._value(self._layout[1][name])
+
+    def __setitem__(self, name, value):
+        names = list(self._layout[0])
+        values = self.values()
+        if name in self._layout[1]:
+            values[self._layout[1][name]] = value
+        else:
+            names.append(name)
+            values.append(value)
+        self._pack(names, values)
+
+    def __delitem__(self, name):
+        i = self._layout[1][name]
+        names = list(self._layout[0])
+        values = self.values()
+        del names[i], values[i]
+        self._pack(names, values)
+
+    def __contains__(self, name):
+        return name in self._layout[1]
+
+    def __iter__(self):
+        return iter(self._layout[0])
+
+    def __len__(self):
+        return len(self._layout[0])
+
+    def __eq__(self, other):
+        if isinstance(other, bibFields):
+            if self._layout is other._layout:
+                return self._text == other._text and self._ends == other._ends
+            return dict(self.items()) == dict(other.items())
+        if isinstance(other, dict):
+            return dict(self.items()) == other
+        return NotImplemented
+
+    def __repr__(self):
+        return 'bibFields({0!r})'.format(dict(self.items()))
+
+    def __getstate__(self):
+        return (self._layout[0], self._text, self._ends)
+
+    def __setstate__(self, state):
+        names, self._text, self._ends = state
+        self._layout = _fieldLayout(names)
+
+    def get(self, name, default=None):
+        i = self._layout[1].get(name)
+        return default if i is None else self._value(i)
+
+    def keys(self):
+        return self._layout[0]
+
+    def values(self):
+        return [self._value(i) for i in range(len(self._ends))]
+
+    def items(self):
+        return list(zip(self._layout[0], self.values()))
+
+_bibParse = re.compile(r'^\s*@(\S*)\s*\{',re.MULTILINE) # look for an entire bib entry
+_bibHead = re.compile(r'\s*@(\S*)\s*\{') # entry starting right where the previous one ended
+_tagParse = re.compile(r'\s*(\S*)\s*,') # find the bib tag (anchored by match at the start of the body)
+_fieldParse = re.compile(r'\s*(\S*)\s*=\s*(\S)',re.MULTILINE) # field name and opening delimiter of its value
+_trim = re.compile(r'\s{2,}|\n',re.MULTILINE) # what about \r
+
+def parseFields(text, pos=0, endpos=None):
+    """ Extract the fields of a bib entry, with the names in uppercase and runs of whitespace in the values collapsed.
+
+        :param text: the bib body text (or the complete bib text, delimited by pos and endpos)
+        :param pos: index of the start of the fields in text
+        :param endpos: index of the end of the fields in text (default: end of text)
+        :return: bibFields of the entry"""
+    if endpos is None:
+        endpos = len(text)
+    entry = {}
+    m = _fieldParse.search(text, pos, endpos)
+    while m:
+        [pout, value] = scanBalanced(text, m.end(0)-1, m.group(2), endpos)
+        entry[m.group(1).upper()] = _trim.sub(' ',value)
+        m = _fieldParse.search(text, pout, endpos)
+    return bibFields(entry)
+
+def parseBib(text, parseBody=None):
+    """ Generator over the entries of a bib file; @COMMENT and @CONTROL entries are skipped.
+
+        :param text: bib file text
+        :param parseBody: function(tag, text, pos, endpos) returning the fields of the entry held in text[pos:endpos] (default: parseFields)
+        :return: (artType, tag, fields, start, end) per entry, with text[start:end] the entry from its '@' to its closing brace
+        :raise ValueError: for an entry without a tag, or an unterminated entry"""
+    if parseBody is None:
+        parseBody = lambda tag, text, pos, endpos: parseFields(text, pos, endpos)
+    m = _bibHead.match(text, 0) or _bibParse.search(text, 0)
+    while m:
+        artType = sys.intern(m.group(1).upper())
+        [pout, body] = scanBalanced(text, m.end(0)-1, '{', warn=False)
+        if body is None:
+            raise ValueError("WARNING: Unterminated entry starting at offset {0}: {1}".format(m.start(1)-1, ' '.join(text[m.start(1)-1:m.start(1)+24].split())))
+        if (artType != u'COMMENT' and artType !=u'CONTROL'):
+            t = _tagParse.match(text, m.end(0), pout-1)
+            if not t:
+                raise ValueError("WARNING: Could not find a tag in string starting with: {0}".format(' '.join(text[m.start(1)-1:m.start(1)+24].split())))
+            tag = t.group(1)
+            yield (artType, tag, parseBody(tag, text, t.end(0), pout-1), m.start(1)-1, pout)
+        m = _bibHead.match(text, pout) or _bibParse.search(text, pout)
+
+_nonAscii = re.compile(br'^[ \t]*@(\w*)[ \t]*\{\s*([^,\s]*)|([\x80-\xff]+)', re.MULTILINE) # an entry head (type and key), or a run of non-ASCII bytes
+
+def findNonAscii(data):
+    """ Locate every run of non-ASCII bytes in a bib file, in a single pass over its bytes.
+
+        :param data: bib file contents, as bytes
+        :return: list of (byte offset, line, column, bib key, bytes) per run; line and column count from 1, and the key is '' before the first entry"""
+    found = []
+    key = ''
+    line = 1
+    lineStart = 0
+    last = 0
+    for m in _nonAscii.finditer(data):
+        if m.group(3) is None:
+            key = m.group(2).decode('ascii', 'replace')
+            continue
+        start = m.start(3)
+        nl = data.rfind(b'\n', last, start)
+        if nl >= 0:
+            line += data.count(b'\n', last, start)
+            lineStart = nl + 1
+        last = start
+        found.append((start, line, start - lineStart + 1, key, m.group(3)))
+    return found
+
+_authorTokens = re.compile(r'\\[{}]|[{}]|\s+and\s+') # escaped braces, braces, and the separators between authors
+
+@functools.lru_cache(maxsize=8192)
+def splitAuthors(author):
+    """ Split an AUTHOR field at the " and " separators outside braces, so {CMS and TOTEM Collaborations} is a single author.
+        Memoized, as the same author lists recur in many entries.
+
+        :param author: AUTHOR field value
+        :return: tuple of the authors, each with its whitespace collapsed; "and others" gives a final 'others'"""
+    authors = []
+    depth = 0
+    start = 0
+    for m in _authorTokens.finditer(author):
+        t = m.group(0)
+        if t == '{':
+            depth += 1
+        elif t == '}':
+            depth = max(0, depth - 1)
+        elif depth == 0 and t[0] != '\\':
+            authors.append(' '.join(author[start:m.start(0)].split()))
+            start = m.end(0)
+    last = ' '.join(author[start:].split())
+    if last or authors:
+        authors.append(last)
+    return tuple(authors)
+
+_idPrefixes = {'DOI': re.compile(r'^\s*(?:https?://(?:dx\.)?doi\.org/|doi:\s*)', re.IGNORECASE),
+               'EPRINT': re.compile(r'^\s*(?:arxiv:\s*)', re.IGNORECASE),
+               'URL': re.compile(r'^\s*(?:https?://)?(?:www\.)?', re.IGNORECASE)}
+_eprintVersion = re.compile(r'v\d+$')
+
+def normalizeId(field, value):
+    """ Normalize a DOI, EPRINT or URL value for comparison: strip resolver prefixes, versions, and case.
+
+        :param field: DOI, EPRINT or URL (anything else is just stripped and lowercased)
+        :param value: field value
+        :return: the normalized value ('' if nothing is left)"""
+    value = value.strip().strip('{}').strip()
+    if field in _idPrefixes:
+        value = _idPrefixes[field].sub('', value)
+    value = value.lower()
+    if field == 'EPRINT':
+        value = _eprintVersion.sub('', value)
+    elif field == 'URL':
+        value = value.replace('cdsweb.cern.ch/', 'cds.cern.ch/').rstrip('/')
+    return value
+
+_texMarkup = re.compile(r'\\[A-Za-z]+|[{}$^_\\~]') # TeX commands and special characters, dropped from titles
+_titleWords = re.compile(r'[a-z0-9]+')
+
+def normalizeTitle(title):
+    """ Normalize a title for comparison: TeX markup, case and punctuation dropped, words separated by single spaces.
+
+        :param title: title field value
+        :return: the normalized title"""
+    return ' '.join(_titleWords.findall(_texMarkup.sub(' ', title).lower()))
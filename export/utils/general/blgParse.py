@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+"""Parser for BibTeX log (.blg) files.
+
+    The log is read line by line, and each warning and error becomes a blgRecord with its type, bib key, field and
+    source line. Messages without a key of their own (bad syntax, undefined strings) get the key of the bib entry
+    at their line. cleanRefs.printLog merges the records into its diagnostics.
+    """
+
+import io
+import os
+import re
+import sys
+import bisect
+import collections
+
+blgRecord = collections.namedtuple('blgRecord', ['severity', 'kind', 'key', 'field', 'file', 'line', 'text']) # line is 0 if the log gives none
+
+_lineRef = re.compile(r'^(.*?)-{2,3}line (\d+) of file (.+?)\s*$') # error text---line N of file F, or a bare --line N of file F after a warning
+_context = re.compile(r'^ : ') # the source lines quoted after an error
+_skipping = re.compile(r"^I'm skipping whatever remains of this (?:entry|command)")
+_summary = re.compile(r'^\((?:There (?:were|was) \d+ (?:warnings?|error messages?)|That was a fatal error)\)')
+_contextHead = re.compile(r'^ : @\s*\w*\s*[{(]\s*([^,\s]+)') # ' : @ARTICLE{key' after a repeated entry
+_warnings = ( # (kind, pattern); the groups key and field are used when present
+    ('missing-entry', re.compile(r'^I didn\'t find a database entry for "(?P<key>[^"]*)"')),
+    ('empty-field', re.compile(r'^empty (?P<field>\S+) in (?P<key>\S+)$')),
+    ('extra-field', re.compile(r'^I\'m ignoring (?P<key>\S+)\'s extra "(?P<field>[^"]*)" field')),
+    ('undefined-type', re.compile(r'^entry type for "(?P<key>[^"]*)" isn\'t style-file defined')),
+    ('undefined-string', re.compile(r'^string name "[^"]*" is undefined')),
+    ('style', re.compile(r'^.* in (?P<key>\S+)$')), # other style-file warnings: "can't use both author and editor fields in key", ...
+)
+_errors = (
+    ('repeated-entry', re.compile(r'^Repeated entry')),
+    ('missing-file', re.compile(r'^I couldn\'t open')),
+    ('syntax', re.compile(r'')),
+)
+
+def _classify(patterns, text):
+    for kind, pattern in patterns:
+        m = pattern.match(text)
+        if m:
+            groups = m.groupdict()
+            return kind, groups.get('key') or '', (groups.get('field') or '').upper()
+    return 'other', '', ''
+
+def parseBlg(lines):
+    """ Extract the warnings and errors of a BibTeX log, as they are read.
+
+        :param lines: iterable of log lines (e.g. an open .blg file)
+        :return: generator of blgRecord; key and field are '' when the message names none"""
+    pending = None # record waiting for its --line reference or quoted context
+    for line in lines:
+        line = line.rstrip('\n')
+        if line.startswith('Warning--'):
+            if pending:
+                yield pending
+            text = line[9:]
+            kind, key, field = _classify(_warnings, text)
+            pending = blgRecord('Warning', kind, key, field, '', 0, text)
+            continue
+        m = _lineRef.match(line)
+        if m:
+            text, number, file = m.group(1).strip(), int(m.group(2)), m.group(3)
+            if pending and (not text or text == 'while executing') and not pending.line:
+                pending = pending._replace(file=file, line=number)
+                continue
+            if pending:
+                yield pending
+            kind, key, field = _classify(_errors, text)
+            pending = blgRecord('Error', kind, key, field, file, number, text)
+            continue
+        if pending and _context.match(line):
+            m = _contextHead.match(line)
+            if m and not pending.key:
+                pending = pending._replace(key=m.group(1))
+            continue
+        if _skipping.match(line) or _summary.match(line):
+            continue
+        if pending:
+            yield pending
+            pending = None
+    if pending:
+        yield pending
+
+class entryLines(object):
+    """Bib key of the entry at each line of a bib file."""
+
+    _head = re.compile(r'^[ \t]*@(\w*)[ \t]*[{(]\s*([^,\s]*)', re.MULTILINE)
+
+    def __init__(self, text):
+        """
+        :param text: bib file text
+        """
+        self._lines = []
+        self._keys = []
+        line = 1
+        last = 0
+        for m in self._head.finditer(text):
+            line += text.count('\n', last, m.start())
+            last = m.start()
+            if m.group(1).upper() in ('COMMENT', 'CONTROL', 'STRING', 'PREAMBLE'):
+                continue
+            self._lines.append(line)
+            self._keys.append(m.group(2))
+
+    def key(self, line):
+        """ Key of the entry containing a line (counted from 1), '' before the first entry """
+        i = bisect.bisect_right(self._lines, line)
+        return self._keys[i-1] if i else ''
+
+def main(argv):
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="Usage: %prog [options] blgfile\n\tLists the warnings and errors of a BibTeX log")
+    parser.add_option("-b", "--bib", action="store", dest="bib", default=None, help="bib file, to find the entry of messages given by line [default: none]")
+    (opts, args) = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error("expected one blg file")
+    lines = None
+    if opts.bib:
+        with io.open(opts.bib, 'r', encoding='utf-8', errors='replace') as f:
+            lines = entryLines(f.read())
+    with io.open(args[0], 'r', errors='replace') as f:
+        for record in parseBlg(f):
+            key = record.key
+            if not key and lines and record.line and os.path.basename(record.file) == os.path.basename(opts.bib):
+                key = lines.key(record.line)
+            where = " (line {0} of {1})".format(record.line, record.file) if record.line else ''
+            print("{0} {1} {2}{3}: {4}{5}".format(record.severity, record.kind, key, '.'+record.field if record.field else '', record.text, where))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -17,6 +17,8 @@ import logging
 import time
 from collections import namedtuple
 
+from bibParse import extractBalanced
+
 ### Fill in the necessary command options with the correct values in the configuration file (see command line options for current name of file) or supply via the command line ###
 
 """
@@ -53,25 +55,7 @@ def extract_balanced(text: str, delim: str ='{')-> list:
         :param delim: the delimiter to use. Default '{'
         :return [pout, delimited text]: [location in the search body past the matched delimiter, the delimited text (None, if not found)]
         """
-    delims: dict = {"{":"}", '"':'"', "<":">"} # matching closing delims
-    pin: int = text.find(delim) + 1
-    nbraces: int = 1
-    pout: int = pin
-    while nbraces > 0:
-        if pout > len(text): 
-            return [0, None] # probably unmatched } inside TeX comment string
-        if text[pout:pout + 2] == '\\' + delim: # look for escaped delim
-            pout += 2
-        else:
-            if text[pout:pout + 2] == '\\' + delims[delim]:
-                pout += 2
-            else:
-                if text[pout:pout + 1] == delims[delim]:
-                    nbraces -= 1
-                elif text[pout:pout + 1] == delim:
-                    nbraces += 1
-                pout += 1
-    return [pout, text[pin:pout - 1]]
+    return extractBalanced(text, delim, warn=False)
 
 def extract_tex_field(field: str, text:str) -> str:
     """
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""Check the streaming CDS MARCXML reader of pas-bib against the DOM reader it replaced, on saved result pages.
+
+    Each page is read twice by DocList: with marcRecords and marcFields, as pas-bib does, and with the whole page
+    parsed by xml.dom.minidom and the subfields looked up by the original getDatafieldValue / getDatafieldValueList.
+    The total number of results and the documents found (tag, title, date, CDS ID, and the journal information
+    of papers) must be the same. Without arguments, the pages in fixtures/ are checked.
+    """
+
+import io
+import os
+import re
+import sys
+import contextlib
+import importlib.util
+from xml.dom import Node
+from xml.dom.minidom import parse
+
+_here = os.path.dirname(os.path.abspath(__file__))
+_fixtures = (('papers', os.path.join(_here, 'fixtures', 'cds-papers.xml')), ('notes', os.path.join(_here, 'fixtures', 'cds-pas.xml')))
+
+def _pasBib():
+    """ The pas-bib module (which cannot be imported by name) """
+    if not 'pasbib' in sys.modules:
+        spec = importlib.util.spec_from_file_location('pasbib', os.path.join(_here, 'pas-bib.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules['pasbib'] = module
+    return sys.modules['pasbib']
+
+def _domDocList(noteType):
+    """ A DocList reading DOM <record> elements with the original subfield lookups """
+    class domDocList(_pasBib().DocList):
+        def getDatafieldValue(self, record, xmltag, subfield):
+            if xmltag == "001": # the original read the record ID from the control field itself
+                for control in record.getElementsByTagName("controlfield"):
+                    if (control.getAttribute("tag") == "001"):
+                        text = control.firstChild
+                        return text.data if text else ''
+                return ''
+            data = record.getElementsByTagName("datafield")
+            for datum in data:
+                if (datum.getAttribute("tag") == xmltag):
+                    subdata = datum.getElementsByTagName("subfield")
+                    for subdatum in subdata:
+                        if (subdatum.getAttribute("code")==subfield) :
+                            text = subdatum.firstChild
+                            if (not text):
+                                return ('')
+                            else:
+                                val = text.data
+                            return (val)
+            return ('')
+
+        def getDatafieldValueList(self, record, xmltag, subfield):
+            data = record.getElementsByTagName("datafield")
+            val = []
+            for datum in data:
+                if (datum.getAttribute("tag") == xmltag):
+                    subdata = datum.getElementsByTagName("subfield")
+                    for subdatum in subdata:
+                        if (subdatum.getAttribute("code")==subfield) :
+                            text = subdatum.firstChild
+                            if text:
+                                val.append(text.data)
+            if val:
+                return (val)
+            else:
+                return ('')
+    return domDocList(0, None, noteType, False)
+
+def readStreaming(page, noteType):
+    """ :return: (total number of results, documents) read as pas-bib does """
+    pasbib = _pasBib()
+    docs = pasbib.DocList(0, None, noteType, False)
+    records = pasbib.marcRecords(page)
+    docs.getDocInfoFromMarc(records)
+    return records.total, docs._bib
+
+def readDom(page, noteType):
+    """ :return: (total number of results, documents) read from the DOM of the whole page """
+    dom = parse(page)
+    comment = dom.firstChild
+    if comment.nodeType != Node.COMMENT_NODE:
+        raise _pasBib().DocListException ( "Did not get total record count as XML comment" )
+    total = int(re.match(r'[^\d]+(\d+)\s*$', comment.data).group(1))
+    docs = _domDocList(noteType)
+    docs.getDocInfoFromFields(dom.getElementsByTagName("record"))
+    return total, docs._bib
+
+def checkPage(page, noteType):
+    """ Compare the streaming and the DOM readings of a page
+
+    :param page: MARCXML file
+    :param noteType: papers or notes
+    :return: list of differences (empty if the readings agree)
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        streamed = readStreaming(page, noteType)
+        expected = readDom(page, noteType)
+    problems = []
+    if streamed[0] != expected[0]:
+        problems.append("total {0}, DOM {1}".format(streamed[0], expected[0]))
+    for doc in sorted(set(streamed[1]) | set(expected[1])):
+        if streamed[1].get(doc) != expected[1].get(doc):
+            problems.append("{0}: {1}, DOM {2}".format(doc, streamed[1].get(doc), expected[1].get(doc)))
+    if not expected[1]:
+        problems.append("no documents found")
+    return problems
+
+def main(argv):
+    from optparse import OptionParser
+
+    usage = "Usage: %prog [options] [page.xml ...]\n\tCompares the streaming and DOM readings of saved CDS MARCXML pages [default: the pages in fixtures/]"
+    parser = OptionParser(usage=usage)
+    parser.add_option("-t", "--type", action="store", dest="type", default="papers", choices=("papers","notes"),
+                        help="note type of the pages given: papers [default], or notes (PAS)")
+    (opts, args) = parser.parse_args(argv)
+    pages = [(opts.type, page) for page in args] if args else _fixtures
+    failed = 0
+    for noteType, page in pages:
+        problems = checkPage(page, noteType)
+        print("{0}: {1}".format(page, "differs" if problems else "same documents"))
+        for problem in problems:
+            print("    " + problem)
+        failed += bool(problems)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
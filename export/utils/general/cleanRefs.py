@@ -17,6 +17,18 @@ import io
 import string
 import subprocess
 import collections
+import hashlib
+import pickle
+import json
+import time
+import zlib
+import filecmp
+import locale
+import contextlib
+
+from bibParse import scanBalanced, parseBib, parseFields, findNonAscii, splitAuthors, normalizeId, normalizeTitle
+from bibIndex import bibIndex
+from blgParse import parseBlg, entryLines
 
 
     
@@ -39,185 +51,499 @@ def f5(seq, idfun=None):
        result.append(item)
     return result
 
-def extractBalanced(text, delim):
-    """ Extract a delimited section of text: 
-        Does not check for escaped delimeters. 
-
-        :param text: text to search
-        :param delim: delimiter to match. Available opening delimiters are '{', '"', and  '<'."""
-    delims = {"{":"}", '"':'"', "<":">"} # matching closing delims
-    if not(delim in delims.keys()):
-        pout = text.find(',')+1
-        pin = 0
-    else:
-        pin = text.find(delim) + 1
-        if pin == 0: 
-            print('Bad delim')
-        nbraces = 1
-        pout = pin
-        while nbraces > 0:
-            if pout > len(text): 
-                print("extractBalanced >>> Error parsing text: {0}".format(text[pin:pin+min([len(text),15])]))
-                return [0, None] # probably unmatched } inside TeX comment string
-            if text[pout:pout+2] == '\\'+delim: # look for escaped delim
-                pout += 2
-            else:
-                if text[pout:pout+2] == '\\'+delims[delim]:
-                    pout += 2
-                else:
-                    if text[pout:pout+1] == delims[delim]:
-                        nbraces -= 1
-                    elif text[pout:pout+1] == delim:
-                        nbraces += 1
-                    pout += 1
-    return [pout, text[pin:pout-1]]
+_shingleSize = 3 # words per shingle
+_minHashRows = 4 # signature values per band
+_minHashMasks = [zlib.crc32(str(i).encode('ascii')) for i in range(32)] # one MinHash "permutation" per mask
+
+def titleShingles(title):
+    """ Hash a title into its set of overlapping word shingles, after dropping TeX markup and case.
+
+        :param title: title field value
+        :return: set of shingle hashes (a single shingle for titles shorter than the shingle size)"""
+    words = normalizeTitle(title).split()
+    if not words:
+        return set()
+    n = max(1, len(words) - _shingleSize + 1)
+    return set(zlib.crc32(' '.join(words[i:i+_shingleSize]).encode('utf-8')) for i in range(n))
+
+diagnostic = collections.namedtuple('diagnostic', ['key', 'field', 'severity', 'rule', 'text']) # one finding; key lists all the bib keys involved, comma separated
+_cacheFormat = 3 # layout of the cache files (together with __version__)
+_codeDigest = None # hash of the source of the checking code, computed on first use by _checkCodeDigest
+
+def _checkCodeDigest():
+    """ Hash of the source files the per-entry checks are made of (this script and bibParse), so the stored diagnostics
+    are not reused after a change to the checking code which leaves __version__ and the rules untouched """
+    global _codeDigest
+    if _codeDigest is None:
+        import bibParse
+        h = hashlib.sha256()
+        for module in (__file__, bibParse.__file__):
+            with io.open(os.path.splitext(module)[0] + '.py', 'rb') as f:
+                h.update(f.read())
+        _codeDigest = h.hexdigest()
+    return _codeDigest
 
 class cleanError(Exception):
     """Base class for exceptions in this module.
     """
     pass
 
+class ruleEngine:
+    """Field rules (field, compiled re, message, severity, id), loaded from a JSON data file.
+
+    The rules are grouped by field, and the patterns for each field are combined into a single compiled scanner, so
+    an entry costs one search per field present. Only when the scanner matches are that field's rules tested
+    individually to find which ones fired. The time spent in each scanner and rule is accumulated for printTiming.
+    """
+
+    _inlineFlags = re.compile(r'^\(\?([aiLmsux]+)\)') # leading global flags, e.g. (?i), which must be scoped when combined
+
+    def __init__(self, rulesFile=None):
+        """
+        :param rulesFile: JSON list of {"field", "pattern", "message", "severity", optional "id"} (default: cleanRefs-rules.json next to this script).
+                          Rules without an id are named FIELD.n, numbering the rules for each field from 1.
+        """
+        if rulesFile is None:
+            rulesFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cleanRefs-rules.json')
+        self.rulesFile = rulesFile
+        with io.open(rulesFile,'rb') as f:
+            text = f.read()
+        self.digest = hashlib.sha256(text).hexdigest() # identifies the rule set for stored diagnostics
+        try:
+            ruleList = json.loads(text.decode('utf-8'))
+        except ValueError as e:
+            raise cleanError("Could not read rules file {0}: {1}".format(rulesFile, e))
+        self._rules = []
+        nfield = collections.Counter()
+        for rule in ruleList:
+            try:
+                field = rule['field'].upper()
+                nfield[field] += 1
+                self._rules.append((field, re.compile(rule['pattern']), rule['message'], rule.get('severity','Error'), rule.get('id', '{0}.{1}'.format(field, nfield[field]))))
+            except (KeyError, re.error) as e:
+                raise cleanError("Bad rule {0} in {1}: {2}".format(rule, rulesFile, e))
+        self._fields = collections.OrderedDict() # field: (combined scanner, [rule indices])
+        for i, rule in enumerate(self._rules):
+            self._fields.setdefault(rule[0], (None, []))[1].append(i)
+        for field, (scanner, indices) in self._fields.items():
+            self._fields[field] = (re.compile('|'.join(self._scoped(self._rules[i][1].pattern) for i in indices)), indices)
+        self._ruleTime = [0.0] * len(self._rules)
+        self._fieldTime = dict.fromkeys(self._fields, 0.0)
+
+    def _scoped(self, pattern):
+        """ Wrap a pattern as a group that can be one alternative of a combined pattern, turning leading flags (?i) into (?i:...) """
+        m = self._inlineFlags.match(pattern)
+        if m:
+            return '(?{0}:{1})'.format(m.group(1), pattern[m.end(0):])
+        return '(?:{0})'.format(pattern)
+
+    def check(self, fields):
+        """ Apply the rules to the fields of one entry.
+
+        :param fields: dictionary of fieldName: fieldValue
+        :return: list of the rules (field, compiled re, message, severity, id) which matched, in rule order
+        """
+        hits = []
+        for field, value in fields.items():
+            if not field in self._fields:
+                continue
+            scanner, indices = self._fields[field]
+            t0 = time.perf_counter()
+            m = scanner.search(value)
+            t1 = time.perf_counter()
+            self._fieldTime[field] += t1 - t0
+            if m:
+                for i in indices:
+                    if self._rules[i][1].search(value):
+                        hits.append(i)
+                    t2 = time.perf_counter()
+                    self._ruleTime[i] += t2 - t1
+                    t1 = t2
+        return [self._rules[i] for i in sorted(hits)]
+
+    def takeTiming(self):
+        """ Return the accumulated timing (per rule, per field) and reset it """
+        timing = (self._ruleTime, self._fieldTime)
+        self._ruleTime = [0.0] * len(self._rules)
+        self._fieldTime = dict.fromkeys(self._fields, 0.0)
+        return timing
+
+    def addTiming(self, timing):
+        """ Add timing returned by takeTiming (e.g., from a worker process) """
+        ruleTime, fieldTime = timing
+        for i, t in enumerate(ruleTime):
+            self._ruleTime[i] += t
+        for field, t in fieldTime.items():
+            self._fieldTime[field] += t
+
+    def printTiming(self):
+        """ print out the time spent in each field scanner and in each rule """
+
+        print("\n>>> Rule timing [ms]\n")
+        for field, (scanner, indices) in self._fields.items():
+            print("{0:<14} {1:8.3f}".format(field, 1000*self._fieldTime[field]))
+            for i in indices:
+                print("    {0:8.3f}  {1}".format(1000*self._ruleTime[i], self._rules[i][1].pattern))
+
+class requiredRefs:
+    """References which must be cited, loaded from a JSON data file. Each requirement is one of
+
+        {"doi": DOI, "msg": message}: an entry with this DOI (compared after normalizeId) must be cited
+        {"url": fragment, "msg": message}: a cited entry must have a URL containing this string (e.g., a CDS record number)
+        {"key": bib key, "doiPattern": re, "name": name, "msg": message}: the bib file must have an entry with this key
+            (any case), whose DOI, if doiPattern is given, must match it
+
+    All the requirements are checked in one pass over the cited entries: DOIs by dictionary lookup, and URL fragments
+    with a single combined pattern, so the cost hardly grows with the number of requirements.
+    """
+
+    def __init__(self, requiredFile=None):
+        """
+        :param requiredFile: JSON list of requirements (default: cleanRefs-required.json next to this script)
+        """
+        if requiredFile is None:
+            requiredFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cleanRefs-required.json')
+        with io.open(requiredFile,'r',encoding='utf-8') as f:
+            try:
+                self._required = json.load(f)
+            except ValueError as e:
+                raise cleanError("Could not read required references file {0}: {1}".format(requiredFile, e))
+        self._dois = {} # normalized DOI: [requirement indices]
+        self._urls = {} # URL fragment: [requirement indices]
+        self._keys = {} # uppercase bib key: [requirement indices]
+        for i, req in enumerate(self._required):
+            if not 'msg' in req:
+                raise cleanError("Required reference {0} in {1} has no msg".format(req, requiredFile))
+            if 'doi' in req:
+                self._dois.setdefault(normalizeId('DOI', req['doi']), []).append(i)
+            elif 'url' in req:
+                self._urls.setdefault(req['url'], []).append(i)
+            elif 'key' in req:
+                self._keys.setdefault(req['key'].upper(), []).append(i)
+            else:
+                raise cleanError("Required reference {0} in {1} needs a doi, url or key".format(req, requiredFile))
+        # longest fragments first, in a lookahead so that overlapping fragments are all seen; shorter fragments
+        # starting at the same place as a longer one are found through _contained
+        fragments = sorted(self._urls, key=len, reverse=True)
+        self._urlMatcher = re.compile('(?=({0}))'.format('|'.join(re.escape(u) for u in fragments))) if fragments else None
+        self._contained = dict((u, [v for v in fragments if v in u]) for u in fragments)
+
+    def check(self, checkItems, cited):
+        """ Look for the required references.
+
+        :param checkItems: bib entries in the usual format
+        :param cited: set of the cited bib keys
+        :return: list of (bib key or '', field or '', message as a tuple of print arguments) for missing or malformed references, in requirement order
+        """
+        found = set()
+        for key in cited:
+            if not key in checkItems:
+                continue
+            fields = checkItems[key][1]
+            if 'DOI' in fields and self._dois:
+                found.update(self._dois.get(normalizeId('DOI', fields['DOI']), ()))
+            if 'URL' in fields and self._urlMatcher:
+                for m in self._urlMatcher.finditer(fields['URL']):
+                    for u in self._contained[m.group(1)]:
+                        found.update(self._urls[u])
+        keys = {}
+        if self._keys:
+            for key in checkItems:
+                keys.setdefault(key.upper(), key)
+        messages = []
+        for i, req in enumerate(self._required):
+            if 'key' in req:
+                key = keys.get(req['key'].upper())
+                name = req.get('name', req['key'])
+                if key is None:
+                    messages.append(('', '', (req['msg'],)))
+                elif 'doiPattern' in req:
+                    if not 'DOI' in checkItems[key][1]:
+                        messages.append((key, 'DOI', ('>> Required DOI missing for {0} record'.format(name),)))
+                    elif not re.fullmatch(req['doiPattern'], checkItems[key][1]['DOI']):
+                        messages.append((key, 'DOI', ('>> Illegal {0} DOI: '.format(name), checkItems[key][1]['DOI'])))
+            elif not i in found:
+                messages.append(('', 'DOI' if 'doi' in req else 'URL', (req['msg'],)))
+        return messages
+
+_shared = {} # (class, file): instance, so the rules, required references and index are loaded once per process
+_parsedBibs = None # in batch mode, content hash of a bib file: (bib, spans, notes), so a bib shared by several documents is parsed once
+
+def _readIndex(indexFile):
+    """ The bibIndex in indexFile, opened read-only: a missing or empty index is an error rather than an index that finds nothing """
+    try:
+        return bibIndex(indexFile, readOnly=True)
+    except ValueError as e:
+        raise cleanError(str(e))
+
+def _sharedInstance(cls, file):
+    """ The instance of cls (ruleEngine, requiredRefs, _readIndex) made from file, created on first use """
+    if not (cls, file) in _shared:
+        _shared[(cls, file)] = cls(file)
+    return _shared[(cls, file)]
+
+_checker = None # cleanRefs instance used for checks in a worker process
+
+def _initCheckWorker(rulesFile):
+    """ Set up a worker process for cleanRefs.checkEntries """
+    global _checker
+    _checker = cleanRefs('', '', 0, True, cache=False, rulesFile=rulesFile)
+
+def _checkChunk(chunk):
+    """ Check a list of (key, citation) in a worker process
+
+    :return: (dictionary of key: diagnostics, rule timing for the chunk)
+    """
+    results = dict((key, _checker.checkEntry(key, citation)) for key, citation in chunk)
+    return results, _checker._ruleEngine.takeTiming()
+
 class cleanRefs:
 
-    def __init__(self, tag, baseDir, verbose, arxiv):
+    def __init__(self, tag, baseDir, verbose, arxiv, cache=True, rulesFile=None, jobs=1, requiredFile=None, indexFile=None):
         """
         :param tag: document tag
         :param baseDir: directory containing the log files
         :param verbose: turn up logging level
         :param arxiv: remove arXiv info if doi present
+        :param cache: keep the parsed bib file in baseDir/cleanRefs.cache, and reuse it while the bib file is unchanged.
+                      Also keep the diagnostics of each entry in baseDir/cleanRefs.checks, and recheck only new or changed entries.
+        :param rulesFile: JSON file of field rules (default: cleanRefs-rules.json next to this script)
+        :param jobs: number of worker processes for the per-entry checks
+        :param requiredFile: JSON file of required references (default: cleanRefs-required.json next to this script)
+        :param indexFile: SQLite index of the shipped bib files (see bibIndex.py), used to suggest canonical keys (default: none)
         """
         self._tag = tag
         self._refs = [] # references from paper: bibkey
+        self._bibcite = {} # bibkey: label (reference number) from the aux file
+        self._diagnostics = [] # everything reported, for the JSON report
+        self._timing = collections.OrderedDict() # phase: (wall, cpu) seconds
+        self._counts = collections.OrderedDict() # citations, entries parsed, checked, rechecked
         self._verbosity = verbose
         self._arxiv = arxiv
-        self._bib = {} #dictionary (keyed on bibkey in bib file (same as used in _refs)) which holds the citation tuple (artType, {fieldName:fieldValue}), key is 
-        self._rules =[ ('VOLUME',re.compile(r'[A-G]\s*\d'),'Volume with serial number','Error'),
-                       ('VOLUME',re.compile(r'\\bf'), r'Volume with \bf','Error'), # change to be any control sequence
-                       ('VOLUME',re.compile('CMS'), 'PAS as article? Please use TECHREPORT','Error'),
-                       ('AUTHOR',re.compile('~'), 'Found author string with explicit spacing...normally not good!','Warning'),
-                       ('AUTHOR',re.compile(r'[A-Z]\.[A-Z]'),'Author with adjacent initials','Error'),
-                       ('AUTHOR',re.compile(r'et al\.'), 'Author with explicit et al','Error'),
-                       ('AUTHOR',re.compile(r'\\etal'), 'Author with explicit etal','Error'),
-                       ('AUTHOR',re.compile(r'Adolphi'), 'Adolphi: this may be an error in attribution for the CMS detector paper. Please check','Warning!'),
-                       ('AUTHOR',re.compile(r'(?<!{)\\["`\'~=cuvHaoO]'), r'Special characters must be protected with {}, e.g. \"o -> {\"o}', 'Error'),
-                       ('JOURNAL',re.compile('CMS'), 'PAS as article? Please use TECHREPORT','Error'),
-                       ('JOURNAL',re.compile(r'[A-z]\.[A-z].'), 'Missing spaces in journal name','Error'),
-                       ('JOURNAL',re.compile('~'), 'Found ~ in a journal name--don\'t override BibTeX','Error'),
-                       ('ISSUE',re.compile('.*'), 'Don\'t normally use the ISSUE field','Warning'),
-                       ('EPRINT',re.compile('(?<!/)[0-9]{7}'), 'Old style arXiv ref requires the archive class (see http://arxiv.org/help/arxiv_identifier)','Error'),
-                       ('EPRINT',re.compile(r'1101\.0536'), r"Check you've followed the guidelines at https://twiki.cern.ch/twiki/bin/view/CMS/Internal/PubGuidelines for citing PDFs, including specific sets",'Warning'),
-                       ('EPRINT',re.compile(r'1101\.0538'), r"Check you've followed the guidelines at https://twiki.cern.ch/twiki/bin/view/CMS/Internal/PubGuidelines for citing PDFs, including specific sets",'Warning'),
-                       ('TITLE',re.compile('(?i)MadGraph.*v4'), 'MadGraph v5 references are preferred over v4 (unless v4 was what was actually used)','Warning'),                       
-                       ('TITLE',re.compile('(?i)MadGraph.*5'), 'Consider using doi:10.1007/JHEP07(2014)079, MadGraph5_aMC@NLO?','Warning'),                       
-                       ('TITLE',re.compile('POWHEG'), 'Is POWHEG (BOX) correctly referenced? See http://powhegbox.mib.infn.it','Warning'),                       
-                       ('DOI',re.compile(r'10.1088/1126-6708/2002/06/029|10.1088/1126-6708/2003/08/007|10.1088/1126-6708/2006/03/092|10.1088/1126-6708/2008/07/029|10.1007/JHEP01\(2011\)053'), 'MC@NLO citation found. Did you get them all? See http://www.hep.phy.cam.ac.uk/theory/webber/MCatNLO/ near the bottom','Warning'),
-                       ('DOI',re.compile('10.1007/JHEP05(2014)146|10.1007/JHEP09(2013)029'), 'Soft drop or modified mass drop tagger found. If you are using soft drop with beta=0, please also cite the MMDT', 'Warning'),
-                       ('DOI',re.compile('10.1088/1126-6708/2008/04/063|10.1140/epjc/s10052-012-1896-2'), 'You are using anti-kt or fastjet. Did you cite both properly?', 'Warning'),
-                       ('DOI',re.compile('doi|DOI'), 'Do not include dx.doi.org','Error'),
-                       ('DOI',re.compile(','), 'Only one doi in the DOI field','Error'),
-                       ('DOI',re.compile(' '), 'No spaces in the DOI field','Error'),
-                       ('COLLABORATION',re.compile(r'Collaboration'), r'Should not normally use Collaboration: already in the format','Error'), 
-                       ('LANGUAGE',re.compile('.*'),'Language entry requires loading the babel package, which is not used','Error for APS'),
-                       ('PAGES',  re.compile('-'), 'Range in page field: we only use first page','Warning') ] # rules for checking format: field, compiled re, message. (Add severity?)
+        self._jobs = jobs if jobs else 1
+        self._spans = {} # bibkey: (start, end) of the entry text in the bib file
+        self._auxFiles = [] # aux files read by getRefList (the main one and those from \@input)
+        self._checkStore = None # per-entry diagnostics of the checks file, kept in memory once loaded
+        self._bib = {} #dictionary (keyed on bibkey in bib file (same as used in _refs)) which holds the citation tuple (artType, bibFields {fieldName:fieldValue}), key is 
+        self._ruleEngine = _sharedInstance(ruleEngine, rulesFile) # rules for checking format of particular fields
+        self._required = _sharedInstance(requiredRefs, requiredFile) # references which must be cited
+        self._index = _sharedInstance(_readIndex, indexFile) if indexFile else None # canonical entries of the shipped bib files
         self._blankCheck = re.compile(r'^\s+$')
-        # field ordering not yet implemented (if ever)
+        self._auxCitation = re.compile(r'\\citation\{(.*)\}\s*$')
+        self._noCollabCheck = re.compile('Collaboration') # to check for a Collaboration as author: not _generally_ okay for papers
+        self._jhepVolumeCheck = re.compile('^[0-9]{2}$')
+        self._specialCharCheck = re.compile(r'(?<!{)\\["`\'~=cuvHaoO]') # TeX accent not protected by braces
+        # field ordering for rewrite: fields not listed keep their order, after the listed ones
         self._fieldOrder = ('AUTHOR','COLLABORATION','TITLE','DOI','JOURNAL','VOLUME','TYPE','NUMBER','YEAR','PAGES','NOTE','URL','EPRINT','ARCHIVEPREFIX') #SLACCITATION always last
+        self._fieldRank = dict((field, i) for i, field in enumerate(self._fieldOrder))
+        self._fieldRank['SLACCITATION'] = len(self._fieldOrder) + 1
         # self._baseDir = r'C:\Users\George Alverson\Documents\CMS\tdr2\utils\trunk\tmp\\'
         self._baseDir = baseDir
+        self._cacheFile = os.path.join(baseDir, 'cleanRefs.cache') if cache else None
+        self._checksFile = os.path.join(baseDir, 'cleanRefs.checks') if cache else None
         self._sissaJournals =  tuple(['JHEP', 'J. High Energy Phys.', 'J. High Energy Physics', 'JINST', 'J. Instrum.', 'J. Instrumentation'])  # not including JSTAT or JCAP
 
 
         
     def getRefList(self):
         r"""Open the aux file and extract the \citation lines, adding the citations contained to an ordered list, which should match the bibtex reference order.
+           Sub-aux files from \include (\@input{...}) are read where they appear, and the \bibcite labels are kept in self._bibcite.
            """
         #\citation{Dawson:1983fw,Beenakker:1996ch,Plehn:2005cq,Beenakker:2009ha}
-
-        # Use \bibcite instead? What about multi-refs?
         #\bibcite{Beenakker:2009ha}{{10}{}{{}}{{}}}
-        badrefs = ['REVTEX41Control', 'apsrev41Control','REVTEX42Control', 'apsrev42Control']
+        #\@input{chapter1.aux}
+        refs = collections.OrderedDict() # ordered set of citations
+        self._bibcite = collections.OrderedDict()
+        seen = set()
+        self._readAux(os.path.join(self._baseDir,self._tag + '_temp.aux'), refs, seen)
+        self._auxFiles = sorted(seen)
+        self._refs = list(refs)
+        self._counts['citations'] = len(self._refs)
+        if self._verbosity > 1:
+            print("Found {0} citations and {1} bibcite labels in the aux file(s).".format(len(self._refs),len(self._bibcite)))
 
-        file =  os.path.join(self._baseDir,self._tag + '_temp.aux')
-        f = io.open(file,'r')
-        refs = []
-        for line in f:
-            if line.startswith('\\citation'):
-                newrefs = line[10:len(line)-2].split(',')
-                #tested = newrefs in badrefs
-                if not (newrefs[0] in badrefs):
-                    refs.extend(newrefs)
-                #print(refs)
-        self._refs = f5(refs)
-        f.close()
+    def _readAux(self, file, refs, seen):
+        """ Stream one aux file into refs and self._bibcite, following \@input into nested aux files.
+
+        :param file: aux file path
+        :param refs: ordered dictionary of citations found so far (used as an ordered set)
+        :param seen: set of aux files already opened, to guard against loops
+        """
+        badrefs = ('REVTEX41Control', 'apsrev41Control','REVTEX42Control', 'apsrev42Control')
+        seen.add(os.path.normpath(file))
+        with io.open(file,'r') as f:
+            for line in f:
+                if line.startswith('\\citation'):
+                    m = self._auxCitation.match(line)
+                    if m:
+                        newrefs = m.group(1).split(',')
+                        if not (newrefs[0] in badrefs):
+                            for ref in newrefs:
+                                refs.setdefault(ref, None)
+                elif line.startswith('\\bibcite'):
+                    [pout, key] = scanBalanced(line, 8, '{')
+                    if key is not None:
+                        [pout, label] = scanBalanced(line, pout, '{')
+                        if label is not None and label.startswith('{'): # natbib/revtex: {{number}{year}{{author}}{{}}}
+                            label = scanBalanced(label, 0, '{')[1]
+                        self._bibcite.setdefault(key, label)
+                elif line.startswith('\\@input'):
+                    [pout, subfile] = scanBalanced(line, 7, '{')
+                    if subfile:
+                        subfile = os.path.join(self._baseDir, subfile)
+                        if os.path.normpath(subfile) in seen:
+                            continue
+                        if os.path.exists(subfile):
+                            self._readAux(subfile, refs, seen)
+                        elif self._verbosity > 0:
+                            print("Missing aux file {0} (\\@input from {1})".format(subfile, file))
 
     def getRefs(self):
         """Open the bibfile and scan for "@artType{citation,", where citation matches one we are looking for. Extract the fields
            """
         file = os.path.join(self._baseDir,'auto_generated.bib')
-        bibparse = re.compile(r'^\s*@(\S*)\s*\{',re.MULTILINE) # look for an entire bib entry
-        tagparse = re.compile(r'^\s*(\S*)\s*,',re.MULTILINE) # find the bib tag
-        f = io.open(file,'r')
+        digest = None
+        self._bib = {}
+        self._spans = {}
+        with io.open(file,'rb') as f:
+            data = f.read()
+        if self._cacheFile or _parsedBibs is not None:
+            digest = hashlib.sha256(data).hexdigest()
+        if digest and _parsedBibs is not None and digest in _parsedBibs:
+            self._bib, self._spans, notes = _parsedBibs[digest]
+            for key, msg in notes:
+                self._report(diagnostic(key, '', 'Warning', 'parse', msg))
+            self._counts['parsed'] = len(self._bib)
+            if self._verbosity > 1:
+                print("Using the parse of {0} shared with an earlier document of the batch".format(file))
+            return
+        if self._cacheFile:
+            notes = self._loadBibCache(digest)
+            if notes is not None:
+                if _parsedBibs is not None:
+                    _parsedBibs[digest] = (self._bib, self._spans, notes)
+                self._counts['parsed'] = len(self._bib)
+                if self._verbosity > 1:
+                    print("Using cached parse of {0} from {1}".format(file, self._cacheFile))
+                    print("Found {0} entries in the bib file. There were {1} used in the aux file.".format(len(self._bib),len(self._refs)))
+                return
+        notes = [] # messages from parsing, replayed when the parse is taken from the cache
+        def note(msg, key=''):
+            self._report(diagnostic(key, '', 'Warning', 'parse', msg))
+            notes.append((key, msg))
+        bibs = self._readBib(file, note, data)
         try:
-            bibs = f.read()
-        except UnicodeDecodeError:
-            print('>>Unicode detected. {0} contains Unicode characters (typically quote marks or ligatures from cut and paste from Word). These are not allowed with the standard BibTex (requires BibTeX8).'.format(file))
-            f.close()
-            f = io.open(file,'rb')
-            text = f.read()
-            # check for Unicode characters
-            p8 = re.compile(b"[\x80-\xFF]",re.DOTALL)
-            pm = p8.findall(text)
-            for cand in pm:
-                index = text.find(cand)
-                print("...Byte {0}: {1}".format(index,text[index:index+25]))
-            f.close()
-            print('Continuing using Unicode...')
-            f = io.open(file,'r',encoding="UTF-8")
-            bibs = f.read()
-        f.close()
-        p = 0
-        m = bibparse.search(bibs[p:])
-        while m:
-            artType = m.group(1).upper()
-            [pout, body] = extractBalanced(bibs[p+m.end(0)-1:],'{')
-            if (artType != u'COMMENT' and artType !=u'CONTROL'):
-                t = tagparse.match(body)
-                if (t):
-                    tag = t.group(1)
-                    items = self.parseBody(tag, body[t.end(0):])
-                    if tag in self._bib.keys():
-                        print(">>> Duplicate entry for {0} being discarded".format(tag))
-                    else:
-                        self._bib[tag] = (artType, items)
+            for artType, tag, items, start, end in parseBib(bibs, self.parseBody):
+                if tag in self._bib.keys():
+                    note(">>> Duplicate entry for {0} being discarded".format(tag), tag)
                 else:
-                    raise cleanError("WARNING: Could not find a tag in string starting with: {0}".format(body.strip()[0:min([len(body.strip()), 25])])) 
-            p = p + m.end(0) -1 + pout
-            m = bibparse.search(bibs[p:])
+                    self._bib[tag] = (artType, items)
+                    self._spans[tag] = (start, end)
+        except ValueError as e:
+            raise cleanError(str(e))
+        if self._cacheFile:
+            self._saveBibCache(digest, notes)
+        if _parsedBibs is not None:
+            _parsedBibs[digest] = (self._bib, self._spans, notes)
+        self._counts['parsed'] = len(self._bib)
         if self._verbosity > 1:
             print("Found {0} entries in the bib file. There were {1} used in the aux file.".format(len(self._bib),len(self._refs)))
             
 
 
 
-    def parseBody(self, tag, body):
+    def _readBib(self, file, note=None, data=None):
+        """ Read the bib file text, falling back to UTF-8 (with a report of the non-ASCII bytes) if it does not decode.
+        The file is read once, as bytes, and decoded in memory.
+
+        :param file: bib file path
+        :param note: function(message, key='') called with each message about the decoding, with the bib key of each
+                     non-ASCII run (None: the messages are dropped)
+        :param data: contents of the file, if already read
+        :return: the text
+        """
+        if data is None:
+            with io.open(file,'rb') as f:
+                data = f.read()
+        if note is None:
+            note = lambda msg, key='': None
+        try:
+            bibs = data.decode(locale.getpreferredencoding(False))
+        except UnicodeDecodeError:
+            note('>>Unicode detected. {0} contains Unicode characters (typically quote marks or ligatures from cut and paste from Word). These are not allowed with the standard BibTex (requires BibTeX8).'.format(file))
+            for offset, line, column, key, run in findNonAscii(data):
+                note("...Byte {0} (line {1}, column {2}, entry {3}): {4}".format(offset, line, column, key, data[offset:offset+25]), key)
+            note('Continuing using Unicode...')
+            bibs = data.decode('UTF-8')
+        return bibs.replace('\r\n', '\n').replace('\r', '\n') # as reading in text mode
+
+    def _loadCache(self, cacheFile):
+        """ Load a pickled cache file written by _saveCache.
+
+        :param cacheFile: path of the cache file
+        :return: the cached dictionary, or None if missing, unreadable, or from another version of this script
+        """
+        try:
+            with io.open(cacheFile,'rb') as f:
+                cached = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, IndexError):
+            return None
+        if not isinstance(cached, dict) or cached.get('version') != (__version__, _cacheFormat):
+            return None
+        return cached
+
+    def _saveCache(self, cacheFile, cached):
+        """ Pickle a dictionary to a cache file. The cache is written to a temporary file and renamed, so an interrupted run leaves no partial cache.
+
+        :param cacheFile: path of the cache file
+        :param cached: dictionary to save (the script version is added)
+        """
+        cached['version'] = (__version__, _cacheFormat)
+        tmpFile = cacheFile + '.tmp'
+        try:
+            with io.open(tmpFile,'wb') as f:
+                pickle.dump(cached, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpFile, cacheFile)
+        except (IOError, OSError) as e:
+            if self._verbosity > 0:
+                print("Could not write the cache file {0}: {1}".format(cacheFile, e))
+
+    def _loadBibCache(self, digest):
+        """ Load the parsed bib file from the cache, replaying the messages from the original parse.
+
+        :param digest: content hash of the current bib file
+        :return: the (bib key, message) of the original parse if the cache matched the bib file, None otherwise
+        """
+        cached = self._loadCache(self._cacheFile)
+        if not cached or cached.get('digest') != digest:
+            return None
+        self._bib = cached['bib']
+        self._spans = cached['spans']
+        for key, msg in cached['notes']:
+            self._report(diagnostic(key, '', 'Warning', 'parse', msg))
+        return cached['notes']
+
+    def _saveBibCache(self, digest, notes):
+        """ Save the parsed bib file to the cache.
+
+        :param digest: content hash of the parsed bib file
+        :param notes: (bib key, message) printed while parsing
+        """
+        self._saveCache(self._cacheFile, {'digest': digest, 'bib': self._bib, 'spans': self._spans, 'notes': notes})
+
+    def _entryDigest(self, key, citation):
+        """ Content hash of a bib entry, including the field order (which sets the order of the diagnostics) """
+        return hashlib.sha1(repr((key, citation[0], list(citation[1].items()))).encode('utf-8')).hexdigest()
+
+    def parseBody(self, tag, body, pos=0, endpos=None):
         """extract the tag and the fields from a citation
         
            :param tag: the document tag, e.g. XXX-08-000
-           :param body: the bib body text"""
-
-        # need to protect against "=" inside a URL.
-        fieldparse = re.compile(r'\s*(\S*)\s*=\s*(\S)',re.MULTILINE)
-        trim = re.compile(r'\s{2,}|\n',re.MULTILINE) # what about \r
-        p = 0
-        m = fieldparse.search(body[p:])
-        entry = {}
-        while m:
-            field = m.group(1).upper()
-            [pout, value] = extractBalanced(body[p+m.end(0)-1:],m.group(2))
-            value = trim.sub(' ',value)
-            entry[field] = value
-            p = p + m.end(0) -1 + pout
-            m = fieldparse.search(body[p:])
+           :param body: the bib body text (or the complete bib text, delimited by pos and endpos)
+           :param pos: index of the start of the fields in body
+           :param endpos: index of the end of the fields in body (default: end of body)"""
+
+        entry = parseFields(body, pos, endpos)
 
         if self._verbosity > 2:
             for key in entry.keys():
@@ -226,215 +552,348 @@ class cleanRefs:
         return entry
 
     def checkForDuplicates(self, checkItems, checkTag):
-        """ duplicate entry check (uses doi as unique marker)
-        :param checkItems:
-        :param checkTag:
+        """ duplicate entry check (uses doi as unique marker). Values are compared after normalizeId, so that
+        e.g. DOIs differing only in case or a doi.org prefix count as duplicates.
+
+        :param checkItems: bib entries in the usual format
+        :param checkTag: field to check: DOI, EPRINT or URL
         """
-        # python 2.7 and later only
-        chklist = [v[checkTag] for (v,j) in ((vv[1],i) for i, vv in checkItems.items()) if checkTag in v and j in self._refs]
-        if (len(chklist) > len(set(chklist))):
-            print('Have duplicate used ',checkTag,'s',sep="")
-            print([v for v, vv in collections.Counter(chklist).items() if vv > 1])
-        else:
-            print('No duplicate ',checkTag,'s used.',sep="")
-        c = dict()
-        for k,v in self._bib.items():
-            if (checkTag in v[1].keys()):
-                t = v[1][checkTag]
+        used = set(self._refs)
+        c = collections.OrderedDict() # normalized value: [raw value of first entry, keys...]
+        for k,v in checkItems.items():
+            if (checkTag in v[1]):
+                t = normalizeId(checkTag, v[1][checkTag])
+                if not t:
+                    continue
                 if t in c:
                     c[t].append(k)
                 else:
-                    c[t] = [k,]
+                    c[t] = [v[1][checkTag], k]
+        chklist = [v for v in c.values() if sum(1 for k in v[1:] if k in used) > 1]
+        if chklist:
+            print('Have duplicate used ',checkTag,'s',sep="")
+            print([v[0] for v in chklist])
+            for v in chklist:
+                keys = [k for k in v[1:] if k in used]
+                self._report(diagnostic(','.join(keys), checkTag, 'Warning', 'duplicate-used', 'Duplicate {0} {1} used by {2}'.format(checkTag, v[0], ', '.join(keys))), False)
+        else:
+            print('No duplicate ',checkTag,'s used.',sep="")
+        if not checkItems is self._bib:
+            c = collections.OrderedDict()
+            for k,v in self._bib.items():
+                if (checkTag in v[1]):
+                    t = normalizeId(checkTag, v[1][checkTag])
+                    if t:
+                        c.setdefault(t, [v[1][checkTag]]).append(k)
         print('All duplicate ',checkTag,'s',' found in the bibfile...',sep="")
         dupes = False
-        for k,v in c.items():
-            if len(v)>1:
-                print("\t",k,": ",v)
+        for v in c.values():
+            if len(v)>2:
+                print("\t",v[0],": ",v[1:])
+                self._report(diagnostic(','.join(v[1:]), checkTag, 'Warning', 'duplicate', 'Duplicate {0} {1} in {2}'.format(checkTag, v[0], ', '.join(v[1:]))), False)
                 dupes = True
         if not dupes:
             print('\t...none')
 
-    def checkForHEPData(self, checkItems):
-        """ Should have a HEPData reference
-        :param checkItems:
-        """
+    def checkForSimilarTitles(self, checkItems, threshold=0.9):
+        """ near-duplicate title check: titles are compared as sets of hashed word shingles (see titleShingles).
+        Candidate pairs are found by MinHash banding, so the cost grows with the number of entries, not pairs of entries,
+        and are then confirmed by the Jaccard similarity of their shingle sets.
+        Only the titles of cited entries are compared, unless the verbosity is above 1, when the similar titles of the
+        whole bib file are listed as well.
 
-        if not 'HEPDATA' in [i.upper() for i in checkItems.keys()]:
-            print("No HEPdata entry found. Looked for key 'HEPData'.\n")
-            return False
+        :param checkItems: bib entries in the usual format
+        :param threshold: minimum Jaccard similarity of the shingle sets to report a pair
+        """
+        used = set(self._refs)
+        allTitles = self._verbosity > 1
+        shingles = collections.OrderedDict()
+        for k,v in checkItems.items():
+            if (allTitles or k in used) and 'TITLE' in v[1]:
+                sh = titleShingles(v[1]['TITLE'])
+                if sh:
+                    shingles[k] = sh
+        buckets = {}
+        for k, sh in shingles.items():
+            signature = [min(h ^ mask for h in sh) for mask in _minHashMasks]
+            for band in range(0, len(signature), _minHashRows):
+                buckets.setdefault((band, tuple(signature[band:band+_minHashRows])), []).append(k)
+        pairs = set()
+        for keys in buckets.values():
+            for i in range(len(keys)):
+                for j in range(i+1, len(keys)):
+                    pairs.add((keys[i], keys[j]))
+        order = dict((k, i) for i, k in enumerate(shingles))
+        similar = []
+        for a, b in sorted(pairs, key=lambda z: (order[z[0]], order[z[1]])):
+            sa, sb = shingles[a], shingles[b]
+            jaccard = len(sa & sb) / float(len(sa | sb))
+            if jaccard >= threshold:
+                similar.append((a, b, jaccard))
+        usedSimilar = [z for z in similar if z[0] in used and z[1] in used]
+        if usedSimilar:
+            print('Have similar used TITLEs')
+            for a, b, jaccard in usedSimilar:
+                print("\t{0} ~ {1} ({2:.2f}): {3}".format(a, b, jaccard, checkItems[a][1]['TITLE']))
+                self._report(diagnostic(a+','+b, 'TITLE', 'Warning', 'similar-title-used', 'Similar titles used ({0:.2f}): {1}'.format(jaccard, checkItems[a][1]['TITLE'])), False)
         else:
-            listItems = list(checkItems.keys())
-            _ = [i.upper() for i in listItems]
-            index = _.index('HEPDATA')
-            try:
-                doi = checkItems[listItems[index]][1]['DOI']
-                m = re.fullmatch(r'10\.17182/hepdata\.[0-9]+',doi)
-                if not m:
-                    print('>> Illegal HEPData DOI: ', doi)
-                return m
-            except KeyError:
-                print('>> Required DOI missing for HEPData record')
-                return False
-
-
-
-
-
-
-    def checkReqRef(self, checkItems, msg, doi=None, url=None):
-        """ Check to make sure that the required references are included.
-            
-            Examples are:
-            CMS trigger system paper (10.1088/1748-0221/12/01/P01020) [for all Run 2 papers (and following)...for now just check all papers]
-            CMS lumi paper/PASs
-             
-        :param checkItems: list of bib entries in the usual format
-        :param msg: message to print out for missing reference
-        :param doi: required DOI if checking by DOI
-        :param url: required URL if checking by URL. Only looks for presence of string, not complete match, so allows check by CDS ID.
-        :return: True if ref found, False otherwise. Msg printed if False.
+            print('No similar TITLEs used.')
+        if allTitles:
+            print('All similar TITLEs found in the bibfile...')
+            for a, b, jaccard in similar:
+                print("\t{0} ~ {1} ({2:.2f})".format(a, b, jaccard))
+                self._report(diagnostic(a+','+b, 'TITLE', 'Warning', 'similar-title', 'Similar titles ({0:.2f})'.format(jaccard)), False)
+            if not similar:
+                print('\t...none')
+
+    def checkCanonical(self, checkItems):
+        """ Suggest the canonical key (from the bib index) for used entries which match an indexed entry under another key.
+
+        :param checkItems: bib entries in the usual format
+        :return: dictionary of key: (canonical key, source file, matching field)
         """
+        suggestions = collections.OrderedDict()
+        for key in f5(self._refs):
+            if key in checkItems:
+                match = self._index.suggest(checkItems[key][1])
+                if match and match[0] != key:
+                    suggestions[key] = match
+        if suggestions:
+            print('Entries with a canonical key in the bib index')
+            for key, (canonical, source, field) in suggestions.items():
+                print("\t{0} -> {1} ({2}, same {3})".format(key, canonical, os.path.basename(source), field))
+                self._report(diagnostic(key, field, 'Info', 'canonical-key', '{0}: same {1} as {2} in {3}'.format(key, field, canonical, os.path.basename(source))), False)
+        else:
+            print('No entries with another canonical key in the bib index.')
+        return suggestions
 
-        check = True
-
-        if doi:
-            chklist = [v['DOI'] for (v,j) in ((vv[1],i) for i, vv in checkItems.items()) if 'DOI' in v and j in self._refs]
-            if not doi in chklist:
-                print(msg)
-                check = False
-
-        if url:
-            chklist = [url in v['URL'] for (v,j) in ((vv[1],i) for i, vv in checkItems.items()) if 'URL' in v and j in self._refs]
-            if not True in chklist:
-                print(msg) 
-                check = False
-
-        return check
+    def checkRequired(self, checkItems):
+        """ Check to make sure that the required references (see requiredRefs) are included. Prints the message for each one missing.
 
+        :param checkItems: bib entries in the usual format
+        :return: True if all were found, False otherwise
+        """
+        missing = self._required.check(checkItems, set(self._refs))
+        for key, field, msg in missing:
+            print(*msg)
+            self._report(diagnostic(key, field, 'Error', 'required', ' '.join(msg)), False)
+        return not missing
+
+    def checkEntry(self, key, citation):
+        """Check a single bib entry against the field rules and the ad hoc checks
+
+        :param key: bib key of the entry
+        :param citation: the citation tuple (artType, {fieldName:fieldValue})
+        :return: list of diagnostics, in the order they are printed
+        """
+        out = []
+        artType, fields = citation
+        authors = splitAuthors(fields['AUTHOR']) if 'AUTHOR' in fields else ()
+        def add(field, severity, rule, text):
+            out.append(diagnostic(key, field, severity, rule, text))
+        #
+        # rule-based checks on particular fields
+        #
+        for rule in self._ruleEngine.check(fields):
+            add(rule[0], rule[3], rule[4], "{0}:\t {1} {3}: {2}.".format(key, rule[0], rule[2], rule[3]))
+        # unprotected special characters in the author list
+        unprotected = [author for author in authors if self._specialCharCheck.search(author)]
+        if unprotected:
+            add('AUTHOR', 'Error', 'special-character', '{0}:\t AUTHOR Error: Special characters must be protected with {{}}, e.g. \\"o -> {{\\"o}}: {1}.'.format(key, '; '.join(unprotected)))
+        #
+        # ad hoc checks
+        #
+        if artType=='TECHREPORT':
+            # Some techreports have DOIs, so it's OK for them to not have a URL in that case
+            if not 'URL' in fields.keys() and not 'DOI' in fields.keys():
+                add('URL', 'Error', 'techreport-url', '{0}:\t Missing URL for Techreport '.format(key))
+        if artType=='ARTICLE':
+            if not 'AUTHOR' in fields.keys():
+                add('AUTHOR', 'Error', 'missing-field', '{0}:\t Missing AUTHOR '.format(key))
+            elif any(self._noCollabCheck.search(author) for author in authors):
+                add('AUTHOR', 'Warning', 'collaboration-author', "{0}:\t {1} listed as author. Please check this is correct.".format(key, fields['AUTHOR']))
+            if not 'DOI' in fields.keys():
+                add('DOI', 'Error', 'missing-field', '{0}:\t Missing DOI '.format(key))
+            if not 'EPRINT' in fields.keys():
+                add('EPRINT', 'Error', 'missing-field', '{0}:\t Missing EPRINT '.format(key))
+            if not 'JOURNAL' in fields.keys():
+                add('JOURNAL', 'Error', 'missing-field', '{0}:\t Missing JOURNAL. Reformat as UNPUBLISHED?'.format(key))
+            else:
+            ## check for wrong number of digits in JHEP volume: must be two
+                if (fields['JOURNAL']==u'JHEP' or fields['JOURNAL']==u'J. High Energy Phys.') and not self._jhepVolumeCheck.match(fields['VOLUME']):
+                    add('VOLUME', 'Error', 'jhep-volume', '{0}:\t JHEP volume number given as {1}: should always be exactly two digits (0 left padded).'.format(key,fields['VOLUME']))
+        # number of authors check
+        if 'AUTHOR' in fields.keys():
+            etal = authors[-1:] == ('others',)
+            nauthors = len(authors)
+            if etal:
+                nauthors = nauthors - 1
+            collab = 'COLLABORATION' in fields.keys()
+            # here's the actual test 
+            if (nauthors > 1) and etal and collab:
+                add('AUTHOR', 'Warning', 'author-count', '{0}:\t Author count. More authors than necessary for a paper with a collaboration. List only the first plus "and others".'.format(key))
+            if (nauthors > 1 and nauthors < 15) and etal and not(collab):
+                add('AUTHOR', 'Warning', 'author-count', '{0}:\t Author count. Incomplete author list. Include all authors for lists as long as 15'.format(key))
+            if (nauthors > 15) and not(collab):
+                add('AUTHOR', 'Warning', 'author-count', '{0}:\t Author count. More authors than necessary. Include only the first author plus "and others" for lists longer than 15.'.format(key))
+            if (nauthors==1) and etal and not(collab):
+                add('AUTHOR', 'Warning', 'author-count', '{0}:\t Author count query. Are there really more than 15 authors for this reference?'.format(key))
+            # diagnostic
+            # add('AUTHOR', 'Info', 'author-count', '{0}:\t Number of authors {1} '.format(key, nauthors))
+
+        # check for both url and doi
+        if 'DOI' in fields.keys() and 'URL' in fields.keys():
+            add('URL', 'Warning', 'doi-and-url', '{0}:\t Both DOI and URL. DOI only is preferred.'.format(key))
+
+        # empty/blank field check
+        for item in fields.items():
+            if not item[1]:
+                add(item[0], 'Warning', 'empty-field', '{1}: Empty value for field {0}'.format(item[0],key))
+            m = self._blankCheck.search(item[1])
+            if m:
+                add(item[0], 'Warning', 'blank-field', '{1}: Blank value for field {0}'.format(item[0],key))
+        return out
+
+    def checkEntries(self, keys):
+        """Run checkEntry on the given bib keys, in worker processes if self._jobs > 1.
+        With the cache on, entries unchanged since the last run (same content hash, same rules and same checking code) reuse their stored diagnostics.
+
+        :param keys: list of bib keys present in self._bib
+        :return: dictionary of key: list of diagnostics
+        """
+        results = {}
+        stored = {}
+        digests = {}
+        if self._checksFile:
+            if self._checkStore is None:
+                cached = self._loadCache(self._checksFile)
+                valid = cached and cached.get('rules') == self._ruleEngine.digest and cached.get('code') == _checkCodeDigest()
+                self._checkStore = cached['entries'] if valid else {}
+            stored = self._checkStore
+            for key in keys:
+                digests[key] = self._entryDigest(key, self._bib[key])
+                if key in stored and stored[key][0] == digests[key]:
+                    results[key] = [diagnostic(*d) for d in stored[key][1]]
+        todo = [key for key in keys if not key in results]
+        self._counts['checked'] = len(keys)
+        self._counts['rechecked'] = len(todo)
+        if self._verbosity > 1 and self._checksFile:
+            print("Rechecking {0} new or changed entries out of {1}".format(len(todo), len(keys)))
+        if self._jobs <= 1 or len(todo) < 2*self._jobs:
+            for key in todo:
+                results[key] = self.checkEntry(key, self._bib[key])
+        else:
+            import multiprocessing
+            chunkSize = max(1, len(todo) // (4*self._jobs))
+            chunks = [[(key, self._bib[key]) for key in todo[i:i+chunkSize]] for i in range(0, len(todo), chunkSize)]
+            pool = multiprocessing.Pool(self._jobs, _initCheckWorker, (self._ruleEngine.rulesFile,))
+            try:
+                for chunkResults, timing in pool.imap(_checkChunk, chunks):
+                    results.update(chunkResults)
+                    self._ruleEngine.addTiming(timing)
+            finally:
+                pool.close()
+                pool.join()
+        if self._checksFile and todo:
+            entries = dict((key, v) for key, v in stored.items() if key in self._bib) # drop entries no longer in the bib file
+            for key in todo:
+                entries[key] = (digests[key], [tuple(d) for d in results[key]])
+            self._checkStore = entries
+            self._saveCache(self._checksFile, {'rules': self._ruleEngine.digest, 'code': _checkCodeDigest(), 'entries': entries})
+        return results
 
     def checkRefs(self):
         """Correlate citations against bib file and check for common errors"""
 
         print("\n>>> Checking references against CMS rules\n")
-        no_collab_rule = re.compile('Collaboration') # to check for a Collaboration as author: not _generally_ okay for papers
 
+        checks = self.checkEntries(f5([key for key in self._refs if key in self._bib]))
         for key in self._refs:
             if not key in self._bib:
                 if key != 'REVTEX42Control' and key != 'apsrev42Control': # filter out fake APS references
-                    print("Missing bib entry for citation {0}. May be an upper/lower case problem (ignorable)".format(key))
+                    self._report(diagnostic(key, '', 'Error', 'missing-entry', "Missing bib entry for citation {0}. May be an upper/lower case problem (ignorable)".format(key)))
             else:
-                #
-                # rule-based checks on particular fields
-                #
-                for rule in self._rules:
-                    fieldName = rule[0]
-                    if fieldName in self._bib[key][1].keys():
-                        m = rule[1].search(self._bib[key][1][fieldName])
-                        if m:
-                            print("{0}:\t {1} {3}: {2}.".format(key, rule[0], rule[2], rule[3]))
-                #
-                # ad hoc checks
-                #
-                if self._bib[key][0]=='TECHREPORT':
-                    # Some techreports have DOIs, so it's OK for them to not have a URL in that case
-                    if not 'URL' in self._bib[key][1].keys() and not 'DOI' in self._bib[key][1].keys():
-                        print('{0}:\t Missing URL for Techreport '.format(key))
-                if self._bib[key][0]=='ARTICLE':
-                    if not 'AUTHOR' in self._bib[key][1].keys():
-                        print('{0}:\t Missing AUTHOR '.format(key))
-                    else:
-                        m = no_collab_rule.search(self._bib[key][1]['AUTHOR'])
-                        if m:
-                            print("{0}:\t {1} listed as author. Please check this is correct.".format(key, self._bib[key][1]['AUTHOR']))                                           
-                    if not 'DOI' in self._bib[key][1].keys():
-                        print('{0}:\t Missing DOI '.format(key))
-                    if not 'EPRINT' in self._bib[key][1].keys():
-                        print('{0}:\t Missing EPRINT '.format(key))
-                    if not 'JOURNAL' in self._bib[key][1].keys():
-                        print('{0}:\t Missing JOURNAL. Reformat as UNPUBLISHED?'.format(key))
-                    else:
-                    ## check for wrong number of digits in JHEP volume: must be two
-                        if (self._bib[key][1]['JOURNAL']==u'JHEP' or self._bib[key][1]['JOURNAL']==u'J. High Energy Phys.') and not re.match('^[0-9]{2}$',self._bib[key][1]['VOLUME']):
-                            print('{0}:\t JHEP volume number given as {1}: should always be exactly two digits (0 left padded).'.format(key,self._bib[key][1]['VOLUME']))
-                # number of authors check
-                if 'AUTHOR' in self._bib[key][1].keys():
-                    etal = re.search(' and others', self._bib[key][1]['AUTHOR']) 
-                    authors_list = re.findall(" and ", self._bib[key][1]['AUTHOR'])
-                    #print('{0}'.format(self._bib[key][1]['AUTHOR']))
-                    nauthors = len(authors_list) + 1
-                    if etal:
-                        nauthors = nauthors - 1
-                    collab = 'COLLABORATION' in self._bib[key][1].keys()
-                    # here's the actual test 
-                    if (nauthors > 1) and etal and collab:
-                        print('{0}:\t Author count. More authors than necessary for a paper with a collaboration. List only the first plus "and others".'.format(key))
-                    if (nauthors > 1 and nauthors < 15) and etal and not(collab):
-                        print('{0}:\t Author count. Incomplete author list. Include all authors for lists as long as 15'.format(key))
-                    if (nauthors > 15) and not(collab):
-                        print('{0}:\t Author count. More authors than necessary. Include only the first author plus "and others" for lists longer than 15.'.format(key))
-                    if (nauthors==1) and etal and not(collab):
-                        print('{0}:\t Author count query. Are there really more than 15 authors for this reference?'.format(key))
-                    # diagnostic
-                    # print('{0}:\t Number of authors {1} '.format(key, nauthors))
-
-                # check for both url and doi
-                if 'DOI' in self._bib[key][1].keys() and 'URL' in self._bib[key][1].keys():
-                    print('{0}:\t Both DOI and URL. DOI only is preferred.'.format(key))
-                
-                # empty/blank field check
-                for item in self._bib[key][1].items():
-                    if not item[1]:
-                        print('{1}: Empty value for field {0}'.format(item[0],key))
-                    m = self._blankCheck.search(item[1])
-                    if m:
-                        print('{1}: Blank value for field {0}'.format(item[0],key))                        
-                #print(self.printCite(key))
+                for diag in checks[key]:
+                    self._report(diag)
         print(">   Checking references against general tests   <")
-        self.checkReqRef(self._bib, doi='10.1088/1748-0221/12/01/P01020', msg='>>Run 1 trigger citation, TRG-12-001, http://dx.doi.org/10.1088/1748-0221/12/01/P01020 was not cited. Should be included for both Run 1 and Run 2.')
-        self.checkReqRef(self._bib, doi='10.1140/epjc/s10052-021-09538-2', msg='>>Luminosity reference (LUM-17-003) missing.')
-        self.checkReqRef(self._bib, url='2621960', msg='>LUM-17-004 reference missing')
-        self.checkReqRef(self._bib, url='2676164', msg='>LUM-18-002 reference missing')
-        self.checkForHEPData(self._bib)
+        self.checkRequired(self._bib)
         self.checkForDuplicates(self._bib,'DOI')
         self.checkForDuplicates(self._bib,'EPRINT')
+        self.checkForDuplicates(self._bib,'URL')
+        self.checkForSimilarTitles(self._bib)
+        if self._index:
+            self.checkCanonical(self._bib)
+        if self._verbosity > 1:
+            self._ruleEngine.printTiming()
+
 
 
 
 
+    def rewrite(self, changedOnly=False):
+        """Write out a new bib file. Default for now is just to reset the collab field.
 
-    def rewrite(self):
-        """Write out a new bib file. Default for now is just to reset the collab field"""
+        The entries are streamed through a buffered writer into a temporary file, which then replaces auto_generated.bib,
+        so an interrupted run leaves the original intact. If the new file is identical to the old, the old is left untouched.
+
+        :param changedOnly: copy the entries that fixCite leaves unchanged verbatim from the original file, instead of reformatting them
+        """
 
         if self._verbosity > 2:
             print("\n>>>rewrite: Rewriting a new bib file\n")
         outfile = os.path.join(self._baseDir,'auto_generated.bib') # overwrite original
-        f = io.open(outfile,'w')
-
-
-        for key in self._refs:
-            if key in self._bib:
-                if ('COLLABORATION' in self._bib[key][1].keys() and self._bib[key][1]['COLLABORATION'] in ['CMS', 'ATLAS', 'LHCb', 'ALICE', '{CMS}', '{ATLAS}', '{LHCb}', '{ALICE}']):
-
-                    self._bib[key][1]['AUTHOR'] = '{'+(self._bib[key][1]['COLLABORATION']).strip('{}')+' Collaboration}'
-                    del self._bib[key][1]['COLLABORATION']
-                if ('COLLABORATION' in self._bib[key][1].keys() and self._bib[key][1]['COLLABORATION'] in ['CMS-TOTEM', '{CMS-TOTEM}']):
-                    self._bib[key][1]['AUTHOR'] = '{CMS-TOTEM Collaboration}'
-                    del self._bib[key][1]['COLLABORATION']                    
-            # option to filter out arXiv info if published article (PRC) and rewrite SISSA info
-                if (not self._arxiv):
-                    if ('EPRINT' in self._bib[key][1] and 'DOI' in self._bib[key][1]):
-                        del self._bib[key][1]['EPRINT']
-                    if ('JOURNAL' in self._bib[key][1].keys() and self._bib[key][1]['JOURNAL'] in self._sissaJournals):
-                        self.sissaFix(key)
-                    if ('HEPDATA' == key.upper()):
-                        # this corrects for APS bib file. Will drop DOI link unless TITLE is present
-                        if ('HOWPUBLISHED' in self._bib[key][1]):
-                            self._bib[key][1]['TITLE'] = self._bib[key][1]['HOWPUBLISHED']
-                            del self._bib[key][1]['HOWPUBLISHED'] 
-                f.write(self.printCite(key))
-            else:
-                print("\n> Skipping citation {0}".format(key))
-        f.close()
+        source = self._readBib(outfile) if changedOnly else None
+        tmpfile = outfile + '.tmp'
+        nchanged = 0
+        try:
+            with io.open(tmpfile,'w',buffering=1<<16) as f:
+                for key in self._refs:
+                    if key in self._bib:
+                        before = (self._bib[key][0], dict(self._bib[key][1]))
+                        self.fixCite(key)
+                        if changedOnly and key in self._spans and before == self._bib[key]:
+                            start, end = self._spans[key]
+                            f.write(source[start:end])
+                            f.write('\n')
+                        else:
+                            f.write(self.printCite(key))
+                            nchanged += 1
+                    else:
+                        self._report(diagnostic(key, '', 'Warning', 'skipped', "\n> Skipping citation {0}".format(key)))
+        except BaseException:
+            with contextlib.suppress(OSError): # not there if io.open failed; the original error is the one to report
+                os.remove(tmpfile)
+            raise
+        if os.path.exists(outfile) and filecmp.cmp(tmpfile, outfile, shallow=False):
+            os.remove(tmpfile)
+            if self._verbosity > 1:
+                print("Bib file {0} unchanged: not rewritten".format(outfile))
+        else:
+            os.replace(tmpfile, outfile)
+            if self._verbosity > 1:
+                print("Rewrote {0}: {1} entries reformatted".format(outfile, nchanged))
+
+    def fixCite(self, key):
+        """Apply the rewrite rules to one entry: collaboration as author, and (without arXiv) no EPRINT with a DOI, SISSA journals and HEPData"""
+
+        if ('COLLABORATION' in self._bib[key][1].keys() and self._bib[key][1]['COLLABORATION'] in ['CMS', 'ATLAS', 'LHCb', 'ALICE', '{CMS}', '{ATLAS}', '{LHCb}', '{ALICE}']):
+
+            self._bib[key][1]['AUTHOR'] = '{'+(self._bib[key][1]['COLLABORATION']).strip('{}')+' Collaboration}'
+            del self._bib[key][1]['COLLABORATION']
+        if ('COLLABORATION' in self._bib[key][1].keys() and self._bib[key][1]['COLLABORATION'] in ['CMS-TOTEM', '{CMS-TOTEM}']):
+            self._bib[key][1]['AUTHOR'] = '{CMS-TOTEM Collaboration}'
+            del self._bib[key][1]['COLLABORATION']                    
+    # option to filter out arXiv info if published article (PRC) and rewrite SISSA info
+        if (not self._arxiv):
+            if ('EPRINT' in self._bib[key][1] and 'DOI' in self._bib[key][1]):
+                del self._bib[key][1]['EPRINT']
+            if ('JOURNAL' in self._bib[key][1].keys() and self._bib[key][1]['JOURNAL'] in self._sissaJournals):
+                self.sissaFix(key)
+            if ('HEPDATA' == key.upper()):
+                # this corrects for APS bib file. Will drop DOI link unless TITLE is present
+                if ('HOWPUBLISHED' in self._bib[key][1]):
+                    self._bib[key][1]['TITLE'] = self._bib[key][1]['HOWPUBLISHED']
+                    del self._bib[key][1]['HOWPUBLISHED'] 
 
     def sissaFix(self, key):
         # APS formats the year as the volume and the volume as the number. adjust ours here
@@ -456,31 +915,229 @@ class cleanRefs:
 
 
     def printCite(self, key):
-        """Print out a complete bibtex entry"""
-        t = ["\t"+zi[0]+"=\t\""+zi[1]+"\",\n" for zi in self._bib[key][1].items()]
+        """Print out a complete bibtex entry, with the fields in self._fieldOrder"""
+        fields = self._bib[key][1]
+        names = sorted(fields, key=lambda name: self._fieldRank.get(name, len(self._fieldOrder))) # stable, so unlisted fields keep their order
+        t = ["\t"+name+"=\t\""+fields[name]+"\",\n" for name in names]
         tt = "".join(t)
         return '@{0}'.format(self._bib[key][0])+'{'+'{0},\n'.format(key)+tt+'}\n'
 
-    def printLog(self):
-        """ print out the BibTeX log file """
+    def _report(self, diag, show=True):
+        """ Record a diagnostic for the JSON report
 
-        print("\n>>> Dumping BibTeX log file\n")
-        file =  os.path.join(self._baseDir,self._tag + '_temp.blg')
-        f = io.open(file,'r')
-        patFlip = re.compile("You've used [0-9]+ entries")
-        patFlop = re.compile(r"\(There were [0-9]+ warnings\)")
-        flipFlop = True
-        for line in f:
-            if (flipFlop):
-                flipFlop = not patFlip.match(line)
-            else:
-                flipFlop = patFlop.match(line)
-            if (flipFlop):
-                print(line,end=""), 
- 
+        :param diag: the diagnostic
+        :param show: also print its text (False if the caller prints its own format)
+        """
+        self._diagnostics.append(diag)
+        if show:
+            print(diag.text)
+
+    def runPhase(self, phase, *args):
+        """ Run one of the processing methods (getRefList, getRefs, checkRefs, printLog, rewrite), timing it for the JSON report
 
+        :param phase: method name
+        :param args: arguments for the method
+        """
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        result = getattr(self, phase)(*args)
+        self._timing[phase] = (time.perf_counter() - wall, time.process_time() - cpu)
+        return result
 
+    def writeReport(self, file):
+        """ Write the diagnostics, phase timing and entry counts as JSON
 
+        :param file: output file name
+        """
+        report = collections.OrderedDict()
+        report['tag'] = self._tag
+        report['version'] = __version__
+        report['timing'] = collections.OrderedDict((phase, {'wall': wall, 'cpu': cpu}) for phase, (wall, cpu) in self._timing.items())
+        report['counts'] = self._counts
+        report['diagnostics'] = [d._asdict() for d in self._diagnostics]
+        with io.open(file,'w',encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+            f.write('\n')
+
+    def _watchStamps(self):
+        """ (mtime, size) of each input of the stages, None for a missing file: {'aux': [...], 'bib': ..., 'blg': ...} """
+        def stamp(file):
+            try:
+                st = os.stat(file)
+            except OSError:
+                return None
+            return (st.st_mtime_ns, st.st_size)
+        auxFiles = self._auxFiles or [os.path.join(self._baseDir,self._tag + '_temp.aux')]
+        return {'aux': [(file, stamp(file)) for file in auxFiles],
+                'bib': stamp(os.path.join(self._baseDir,'auto_generated.bib')),
+                'blg': stamp(os.path.join(self._baseDir,self._tag + '_temp.blg'))}
+
+    def watch(self, interval=0.05, report=None):
+        """ Keep running, and rerun the stages whose input files change: getRefList and checkRefs for the aux files,
+        getRefs and checkRefs for auto_generated.bib, printLog for the BibTeX log. The parsed bib file, the rules and the
+        per-entry diagnostics stay in memory, so only new or changed entries are checked again. Stops on Ctrl-C.
+
+        :param interval: polling interval [s]; a file is read once it is unchanged for one interval, so that it is not read while being written
+        :param report: JSON report file, rewritten after each rerun
+        """
+        print("\n>>> Watching {0} for changes (Ctrl-C to stop)".format(self._baseDir))
+        stamps = self._watchStamps()
+        try:
+            while True:
+                time.sleep(interval)
+                current = self._watchStamps()
+                if current == stamps:
+                    continue
+                time.sleep(interval)
+                settled = self._watchStamps()
+                if settled != current:
+                    continue # still being written
+                changed = [stage for stage in ('aux', 'bib', 'blg') if settled[stage] != stamps[stage]]
+                stamps = settled
+                start = time.perf_counter()
+                print("\n>>> {0}: changed {1}".format(time.strftime('%H:%M:%S'), ', '.join(changed)))
+                self._diagnostics = []
+                try:
+                    if 'aux' in changed:
+                        self.runPhase('getRefList')
+                    if 'bib' in changed:
+                        self.runPhase('getRefs')
+                    if 'aux' in changed or 'bib' in changed:
+                        self.runPhase('checkRefs')
+                    if 'blg' in changed and settled['blg'] is not None:
+                        self.runPhase('printLog')
+                except (IOError, OSError, cleanError) as e:
+                    print(">>> Error: {0}".format(e)) # e.g. a missing or truncated file: wait for the next change
+                stamps = self._watchStamps() # getRefList may have found other aux files
+                if report:
+                    self.writeReport(report)
+                print(">>> Done in {0:.0f} ms".format(1000*(time.perf_counter() - start)))
+        except KeyboardInterrupt:
+            print("\n>>> Stopped watching")
+
+    def printLog(self):
+        """ Report the warnings and errors of the BibTeX log as diagnostics, errors first and by bib key, without duplicates.
+        Messages given by line number are attributed to the bib entry at that line, and citations already reported
+        as missing by checkRefs are not reported again. """
+
+        print("\n>>> BibTeX log messages\n")
+        file =  os.path.join(self._baseDir,self._tag + '_temp.blg')
+        bibFile = os.path.join(self._baseDir,'auto_generated.bib')
+        known = set((d.key, d.field, d.rule) for d in self._diagnostics)
+        found = collections.OrderedDict()
+        lines = None # bib key at each line of the bib file, read if needed
+        with io.open(file,'r',errors='replace') as f:
+            for record in parseBlg(f):
+                key = record.key
+                if not key and record.line and os.path.basename(record.file) == os.path.basename(bibFile) and os.path.exists(bibFile):
+                    if lines is None:
+                        lines = entryLines(self._readBib(bibFile))
+                    key = lines.key(record.line)
+                rule = record.kind if record.kind == 'missing-entry' else 'bibtex-' + record.kind
+                if (key, record.field, rule) in known:
+                    continue
+                where = ' (line {0} of {1})'.format(record.line, record.file) if record.line else ''
+                text = '{0}:\t {1}BibTeX {2}: {3}{4}'.format(key, record.field + ' ' if record.field else '', record.severity, record.text, where)
+                found.setdefault((record.severity, key, record.field, rule, record.text), diagnostic(key, record.field, record.severity, rule, text))
+        severityRank = {'Error': 0, 'Warning': 1}
+        diags = sorted(found.values(), key=lambda d: (severityRank.get(d.severity, 2), d.key, d.field))
+        for diag in diags:
+            self._report(diag)
+        self._counts['bibtex'] = len(diags)
+        print(">   {0} BibTeX errors, {1} warnings".format(sum(d.severity == 'Error' for d in diags), sum(d.severity == 'Warning' for d in diags)))
+
+
+def readBatchList(file, defaultBase):
+    """ Read the documents of a batch: one per line, as "tag [baseDir]"; blank lines and lines starting with # are skipped
+
+    :param file: list file
+    :param defaultBase: base directory of the documents listed without one
+    :return: list of (tag, baseDir)
+    """
+    docs = []
+    with io.open(file,'r') as f:
+        for line in f:
+            words = line.split(None, 1)
+            if not words or words[0].startswith('#'):
+                continue
+            docs.append((words[0], words[1].strip() if len(words) > 1 else defaultBase))
+    return docs
+
+def _initBatchWorker():
+    """ Set up a worker process for runBatch """
+    global _parsedBibs
+    _parsedBibs = {}
+
+def runDocument(work):
+    """ Check one document of a batch, writing its JSON report to baseDir/<tag>_cleanRefs.json
+
+    :param work: (tag, baseDir, dictionary of cleanRefs keyword arguments)
+    :return: (summary dictionary, printed output)
+    """
+    tag, baseDir, options = work
+    summary = collections.OrderedDict([('tag', tag), ('base', baseDir)])
+    out = io.StringIO()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(out):
+            refs = cleanRefs(tag, baseDir, **options)
+            refs.runPhase('getRefList')
+            refs.runPhase('getRefs')
+            refs.runPhase('checkRefs')
+            if os.path.exists(os.path.join(baseDir, tag + '_temp.blg')):
+                refs.runPhase('printLog')
+        summary['report'] = os.path.join(baseDir, tag + '_cleanRefs.json')
+        refs.writeReport(summary['report'])
+        summary['status'] = 'ok'
+        summary['counts'] = refs._counts
+        summary['severities'] = collections.Counter(d.severity for d in refs._diagnostics)
+    except Exception as e: # one broken document must not stop the batch
+        summary['status'] = 'failed: {0}'.format(e) if isinstance(e, (IOError, OSError, cleanError)) else 'failed: {0}: {1}'.format(type(e).__name__, e)
+    summary['time'] = time.perf_counter() - start
+    return summary, out.getvalue()
+
+def runBatch(docs, options, jobs=1, summaryFile=None, verbose=0):
+    """ Check several documents in one process, or in jobs worker processes, each loading the rules once
+    and parsing a bib file shared by several documents once. Prints one line per document and writes the summary.
+
+    :param docs: list of (tag, baseDir)
+    :param options: dictionary of cleanRefs keyword arguments (verbose, arxiv, cache, rulesFile, requiredFile, indexFile)
+    :param jobs: number of documents checked in parallel
+    :param summaryFile: JSON file for the summary of all the documents (default: none)
+    :param verbose: print the output of each document
+    :return: list of summary dictionaries, in the order of docs
+    """
+    work = [(tag, baseDir, options) for tag, baseDir in docs]
+    summaries = []
+    start = time.perf_counter()
+    pool = None
+    if jobs > 1 and len(work) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(min(jobs, len(work)), _initBatchWorker)
+        results = pool.imap(runDocument, work)
+    else:
+        _initBatchWorker()
+        results = map(runDocument, work)
+    print("{0:<16} {1:>9} {2:>7} {3:>8} {4:>8}  {5}".format('tag', 'citations', 'errors', 'warnings', 'time [s]', 'status'))
+    try:
+        for summary, output in results:
+            if verbose:
+                print(output, end='')
+            summaries.append(summary)
+            severities = summary.get('severities', {})
+            print("{0:<16} {1:>9} {2:>7} {3:>8} {4:>8.2f}  {5}".format(summary['tag'], summary.get('counts', {}).get('citations', ''),
+                  severities.get('Error', ''), severities.get('Warning', ''), summary['time'], summary['status']))
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    failed = sum(1 for summary in summaries if summary['status'] != 'ok')
+    print("Checked {0} documents in {1:.2f} s{2}".format(len(summaries), time.perf_counter() - start, ", {0} failed".format(failed) if failed else ''))
+    if summaryFile:
+        with io.open(summaryFile,'w',encoding='utf-8') as f:
+            json.dump({'version': __version__, 'documents': summaries}, f, indent=1)
+            f.write('\n')
+    return summaries
 
 def main(argv):
     from optparse import OptionParser
@@ -498,12 +1155,30 @@ def main(argv):
                         help="trace script execution; repeated use increases the verbosity more")
     parser.add_option("-b",  "--base", action="store", dest="base", help="base of build area", default=r"D:\tdr2\utils\trunk\tmp")
     parser.add_option("-r", "--rewrite", action="store_true", dest="rewrite", default=False, help="rewrites the bib file and overwrites in base directory")
+    parser.add_option("--changed-only", action="store_true", dest="changedOnly", default=False, help="with --rewrite, copy entries which need no changes verbatim instead of reformatting them")
     parser.add_option("--no-arxiv", action="store_false", dest="arxiv", default=True, help="removes arxiv info when doi is supplied; also replaces JINST by J. Instrum.")
+    parser.add_option("--rules", action="store", dest="rules", default=None, help="JSON file of field rules [default: cleanRefs-rules.json in the script directory]")
+    parser.add_option("--required", action="store", dest="required", default=None, help="JSON file of required references [default: cleanRefs-required.json in the script directory]")
+    parser.add_option("-j", "--jobs", action="store", type="int", dest="jobs", default=1, help="number of worker processes for checking the entries [default: 1]")
+    parser.add_option("--report", action="store", dest="report", default=None, help="write the diagnostics, timing and counts as JSON to this file")
+    parser.add_option("--no-cache", action="store_false", dest="cache", default=True, help="always reparse the bib file instead of using the parse cached in the base directory")
+    parser.add_option("--index", action="store", dest="index", default=None, help="SQLite index of the shipped bib files (built by bibIndex.py), to suggest canonical keys")
+    parser.add_option("--batch", action="store", dest="batch", default=None,
+                        help="check the documents listed in this file, one \"tag [baseDir]\" per line, with -j documents in parallel; --report is then the summary of all the documents, and each document's report is written to baseDir/<tag>_cleanRefs.json")
+    parser.add_option("--watch", action="store_true", dest="watch", default=False, help="keep running, and recheck when the aux, bib or blg file changes (not with --rewrite)")
     global opts
     (opts, args) = parser.parse_args()
+    if opts.watch and opts.rewrite:
+        parser.error("--watch cannot be combined with --rewrite, which changes the watched bib file")
+    if opts.batch and (opts.rewrite or opts.watch):
+        parser.error("--batch cannot be combined with --rewrite or --watch")
     if opts.verbose:
         print("\tVerbosity = {0}".format(opts.verbose))
         print(opts)
+    if opts.batch:
+        options = {'verbose': opts.verbose, 'arxiv': opts.arxiv, 'cache': opts.cache, 'rulesFile': opts.rules, 'requiredFile': opts.required, 'indexFile': opts.index}
+        summaries = runBatch(readBatchList(opts.batch, opts.base), options, opts.jobs, opts.report, opts.verbose)
+        return 1 if any(summary['status'] != 'ok' for summary in summaries) else 0
     tag = ""
     if len(args) > 0:
         tag = args[len(args)-1]
@@ -514,15 +1189,19 @@ def main(argv):
         
    
  
-    myRefs = cleanRefs(tag, opts.base, opts.verbose, opts.arxiv)
-    myRefs.getRefList()
-    myRefs.getRefs()
-    myRefs.checkRefs()
-    myRefs.printLog()
+    myRefs = cleanRefs(tag, opts.base, opts.verbose, opts.arxiv, opts.cache, opts.rules, opts.jobs, opts.required, opts.index)
+    myRefs.runPhase('getRefList')
+    myRefs.runPhase('getRefs')
+    myRefs.runPhase('checkRefs')
+    myRefs.runPhase('printLog')
 
     if (opts.rewrite):
-        myRefs.rewrite()
+        myRefs.runPhase('rewrite', opts.changedOnly)
+    if (opts.report):
+        myRefs.writeReport(opts.report)
+    if (opts.watch):
+        myRefs.watch(report=opts.report)
 
 if __name__ == "__main__":
-    main(sys.argv[1:])
+    sys.exit(main(sys.argv[1:]))
    
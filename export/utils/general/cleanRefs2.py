@@ -16,6 +16,8 @@ import subprocess
 import collections
 from pathlib import Path
 
+from bibParse import scanBalanced
+
 
     
 
@@ -37,39 +39,6 @@ def f5(seq, idfun=None):
        result.append(item)
     return result
 
-def extractBalanced(text, delim):
-    """ Extract a delimited section of text: 
-        Does not check for escaped delimeters. 
-
-        :param text: text to search
-        :param delim: delimiter to match. Available opening delimiters are '{', '"', and  '<'."""
-    delims = {"{":"}", '"':'"', "<":">"} # matching closing delims
-    if not(delim in delims.keys()):
-        pout = text.find(',')+1
-        pin = 0
-    else:
-        pin = text.find(delim) + 1
-        if pin == 0: 
-            print('Bad delim')
-        nbraces = 1
-        pout = pin
-        while nbraces > 0:
-            if pout > len(text): 
-                print("extractBalanced >>> Error parsing text: {0}".format(text[pin:pin+min([len(text),15])]))
-                return [0, None] # probably unmatched } inside TeX comment string
-            if text[pout:pout+2] == '\\'+delim: # look for escaped delim
-                pout += 2
-            else:
-                if text[pout:pout+2] == '\\'+delims[delim]:
-                    pout += 2
-                else:
-                    if text[pout:pout+1] == delims[delim]:
-                        nbraces -= 1
-                    elif text[pout:pout+1] == delim:
-                        nbraces += 1
-                    pout += 1
-    return [pout, text[pin:pout-1]]
-
 class cleanError(Exception):
     """Base class for exceptions in this module.
     """
@@ -153,7 +122,8 @@ class cleanRefs:
            """
 
         bibparse = re.compile(r'^\s*@(\S*)\s*\{',re.MULTILINE) # look for an entire bib entry
-        tagparse = re.compile(r'^\s*(\S*)\s*,',re.MULTILINE) # find the bib tag
+        bibhead = re.compile(r'\s*@(\S*)\s*\{') # entry starting right where the previous one ended
+        tagparse = re.compile(r'\s*(\S*)\s*,') # find the bib tag (anchored by match at the start of the body)
         with open(self._baseDir / 'auto_generated.bib', encoding='utf-8') as f:
             bibs = f.read()
             # check for Unicode characters
@@ -165,48 +135,52 @@ class cleanRefs:
                     index = bibs.find(cand)
                     print("...Byte {0}: {1}".format(index,bibs[index:index+25]))
         p = 0
-        m = bibparse.search(bibs[p:])
+        m = bibhead.match(bibs, p) or bibparse.search(bibs, p)
         while m:
             artType = m.group(1).upper()
-            [pout, body] = extractBalanced(bibs[p+m.end(0)-1:],'{')
+            [pout, body] = scanBalanced(bibs, m.end(0)-1, '{')
             if (artType != u'COMMENT' and artType !=u'CONTROL'):
-                t = tagparse.match(body)
+                t = tagparse.match(bibs, m.end(0), pout-1)
                 if (t):
                     tag = t.group(1)
-                    items = self.parseBody(tag, body[t.end(0):])
+                    items = self.parseBody(tag, bibs, t.end(0), pout-1)
                     if tag in self._bib.keys():
                         print(">>> Duplicate entry for {0} being discarded".format(tag))
                     else:
                         self._bib[tag] = (artType, items)
                 else:
                     raise cleanError("WARNING: Could not find a tag in string starting with: {0}".format(body.strip()[0:min([len(body.strip()), 25])])) 
-            p = p + m.end(0) -1 + pout
-            m = bibparse.search(bibs[p:])
+            p = pout
+            m = bibhead.match(bibs, p) or bibparse.search(bibs, p)
         if self._verbosity > 1:
             print("Found {0} entries in the bib file. There were {1} used in the aux file.".format(len(self._bib),len(self._refs)))
             
 
 
 
-    def parseBody(self, tag, body):
+    def parseBody(self, tag, body, pos=0, endpos=None):
         """extract the tag and the fields from a citation
         
            :param tag: the document tag, e.g. XXX-08-000
-           :param body: the bib body text"""
+           :param body: the bib body text (or the complete bib text, delimited by pos and endpos)
+           :param pos: index of the start of the fields in body
+           :param endpos: index of the end of the fields in body (default: end of body)"""
 
         # need to protect against "=" inside a URL.
         fieldparse = re.compile(r'\s*(\S*)\s*=\s*(\S)',re.MULTILINE)
         trim = re.compile(r'\s{2,}|\n',re.MULTILINE) # what about \r
-        p = 0
-        m = fieldparse.search(body[p:])
+        if endpos is None:
+            endpos = len(body)
+        p = pos
+        m = fieldparse.search(body, p, endpos)
         entry = {}
         while m:
             field = m.group(1).upper()
-            [pout, value] = extractBalanced(body[p+m.end(0)-1:],m.group(2))
+            [pout, value] = scanBalanced(body, m.end(0)-1, m.group(2), endpos)
             value = trim.sub(' ',value)
             entry[field] = value
-            p = p + m.end(0) -1 + pout
-            m = fieldparse.search(body[p:])
+            p = pout
+            m = fieldparse.search(body, p, endpos)
 
         if self._verbosity > 2:
             for key in entry.keys():
@@ -12,34 +12,17 @@ __version__ = "$Revision: 44192 $"
 
 import re
 import shutil
-import ldap3
 import socket
 import os
 import shelve
-from xml.dom import Node
-
-def extractBalanced(text, delim):
-    """ Extract a delimited section of text: available opening delimiters are '{', '"', and  '<' """
-    delims = {"{":"}", '"':'"', "<":">"} # matching closing delims
-    pin = text.find(delim) + 1
-    nbraces = 1;
-    pout = pin
-    while nbraces > 0:
-        if pout > len(text): 
-            print("extractBalanced >>> Error parsing text")
-            return [0, None] # probably unmatched } inside TeX comment string
-        if text[pout:pout+2] == '\\'+delim: # look for escaped delim
-            pout += 2
-        else:
-            if text[pout:pout+2] == '\\'+delims[delim]:
-                pout += 2
-            else:
-                if text[pout:pout+1] == delims[delim]:
-                    nbraces -= 1
-                elif text[pout:pout+1] == delim:
-                    nbraces += 1
-                pout += 1
-    return [pout, text[pin:pout-1]]
+import io
+import pickle
+import collections
+import hashlib
+import threading
+import xml.etree.ElementTree as ElementTree
+
+from bibParse import extractBalanced, parseBib
 
 class DocListException(Exception):
     """Base class for exceptions in this module."""
@@ -67,11 +50,129 @@ class DocListError(DocListException):
         return repr(self.value)
         
         
+def _localName(tag):
+    """ Element tag without its namespace: {http://www.loc.gov/MARC21/slim}record -> record """
+    return tag.rpartition('}')[2]
+
+class marcRecords:
+    """The <record> elements of a CDS MARCXML result page, parsed incrementally as the page is read.
+
+    Each record is yielded as soon as its end tag is reached, and cleared (with everything before it) once the caller
+    has processed it, so the parsed records do not accumulate. The total number of results, which CDS gives in a
+    comment before the records, is in self.total. getDocInfoFromCDS downloads each page whole and parses it from
+    memory, so there the memory is bounded per page (self._pageSize records) rather than streamed from the network.
+    See checkMarc.py for a check of the records read against the DOM reader this replaced.
+    """
+
+    def __init__(self, source):
+        """
+        :param source: file name or binary file object (e.g. an HTTP response) with the MARCXML
+        """
+        self._source = source
+        self.total = None # total number of results of the search, from the leading comment
+        self.count = 0 # records read so far
+
+    def __iter__(self):
+        root = None
+        for event, elem in ElementTree.iterparse(self._source, events=('start', 'end', 'comment')):
+            if event == 'comment':
+                if self.total is None and root is None:
+                    # expect: " Search-Engine-Total-Number-Of-Results: 149"
+                    mtotal = re.match(r'[^\d]+(\d+)\s*$', elem.text or '')
+                    if (not mtotal):
+                        raise DocListException ( "Did not get total record count as XML comment: %s" % elem.text )
+                    self.total = int(mtotal.group(1))
+            elif event == 'start':
+                if root is None:
+                    root = elem
+            elif _localName(elem.tag) == 'record':
+                if self.total is None:
+                    raise DocListException ( "Did not get total record count as XML comment" )
+                self.count += 1
+                yield elem
+                root.clear() # drops the processed records
+        if self.total is None:
+            raise DocListException ( "Did not get total record count as XML comment" )
+
+def marcFields(record):
+    """ Index a MARCXML record in one pass over its fields.
+
+    :param record: <record> element
+    :return: dictionary of (tag, subfield code): list of values in record order, e.g. ('773', 'a'): [DOI];
+             control fields are under (tag, ''), e.g. ('001', ''): [CDS record ID]. Empty values are kept as ''.
+    """
+    fields = {}
+    for datum in record:
+        kind = datum.tag
+        if kind.endswith("datafield"): # with or without the namespace
+            xmltag = datum.get("tag")
+            for subdatum in datum:
+                key = (xmltag, subdatum.get("code"))
+                values = fields.get(key)
+                if values is None:
+                    fields[key] = [subdatum.text or '']
+                else:
+                    values.append(subdatum.text or '')
+        elif kind.endswith("controlfield"):
+            fields.setdefault((datum.get("tag"), ''), []).append(datum.text or '')
+    return fields
+
+_cdsUrl = "http://cdsweb.cern.ch" # default CDS server
+_cdsCacheFormat = 2 # layout of the CDS record cache
+_cdsTags = ('001', '037', '088', '245', '269', '773') # MARC tags read by getDocInfoFromFields, the only ones cached
+
+def cdsSession(retries):
+    """ HTTP session for the CDS requests of one thread: keeps its connection open for reuse, and retries failed requests
+    (connection errors and 429/5xx responses) with exponential backoff.
+
+    :param retries: number of retries of a request
+    :return: requests.Session
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("GET",))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+class cdsSessions:
+    """ One cdsSession per thread, as a requests.Session is not safe to share between threads; closed together """
+
+    def __init__(self, retries):
+        self._retries = retries
+        self._local = threading.local()
+        self._sessions = []
+
+    def session(self):
+        """ :return: the session of the calling thread, opened on its first request """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = cdsSession(self._retries)
+            self._sessions.append(session)
+        return session
+
+    def close(self):
+        for session in self._sessions:
+            session.close()
+
+def _docOrder(doc):
+    """ Sort key of a document tag XXX-YY-NNN: (year, group, number), then the tag itself for other forms """
+    m = _docParse.match(doc)
+    return (m.group(2), m.group(1), m.group(3), doc) if m else ('', '', '', doc)
+
+_docParse = re.compile(r'([A-Za-z0-9]{3})-(\d{2})-(\d{3})$')
+_tagParse = re.compile(r'(?:CMS-){0,1}([A-Za-z]{3})-(\d{2})-(\d{3})') # parse XXX-YY-NNN
+_pageKey = re.compile(r'&d[t1]=[^&]*') # modified-since query (dt, d1), left out of the key of a page's validators
+_dateParse = re.compile(r'(\d{4})|.*(\d{4})') # either YYYYMMDD or YYYY-MM-DD, but only need year. Also 'DD Mmm YYYY'
 
 class DocList:
     """This class is for creating a BibTeX file from the CDS database. """
     
-    def __init__(self, verbosity, remoteUser, noteType, overwrite):
+    def __init__(self, verbosity, remoteUser, noteType, overwrite, cdsUrl=None, jobs=4, cdsCache=True, fullSync=False):
         #self._bib = shelve.open('pas-bib-shelf',writeback=True) # basic information on documents
         self._bib = dict()
         self._dlist = dict() # list of all documents of current type in repository (svn)
@@ -86,6 +187,13 @@ class DocList:
             self._bibFilename = "CMSPapersBib.bib"
         else:
             self._bibFilename ="pasBib.bib"
+        self._cdsUrl = (cdsUrl or _cdsUrl).rstrip('/') # CDS server, e.g. a local copy for testing
+        self._jobs = max(1, jobs) # result pages fetched concurrently
+        self._pageSize = 100 # records per result page requested
+        self._retries = 3 # retries of a failed page request
+        self._timeout = 60 # seconds, for each page request
+        self._cdsCacheFile = self._bibFilename + ".cds" if cdsCache else None # CDS records from the last sync
+        self._fullSync = fullSync # refetch all the records instead of those modified since the last sync
 
         
     def close(self):
@@ -143,136 +251,261 @@ class DocList:
                 if (self._verbosity > 4): print("Done with importing bib entries")
         f.close()        
             
-    def getDatafieldValue(self, record, xmltag, subfield):
-        """ Parse a CDS XML record and extract subfield values."""
+    def getDatafieldValue(self, fields, xmltag, subfield):
+        """ Extract the first value of a subfield from a CDS XML record indexed by marcFields."""
 
         if (self._verbosity > 3): print("+> getDatafieldValue")
-        data = record.getElementsByTagName("datafield")
-        for datum in data:
-            if (datum.getAttribute("tag") == xmltag):
-                subdata = datum.getElementsByTagName("subfield")
-                for subdatum in subdata:
-                    if (subdatum.getAttribute("code")==subfield) :
-                        text = subdatum.firstChild
-                        if (not text):
-                            return ('')
-                        else:
-                            val = text.data
-                        return (val)
-        return ('')
+        val = fields.get((xmltag, subfield))
+        return val[0] if val else ''
     
-    def getDatafieldValueList(self, record, xmltag, subfield):
-        """ Parse a CDS XML record and extract a list of values for the subfield."""
+    def getDatafieldValueList(self, fields, xmltag, subfield):
+        """ Extract the list of non-empty values for the subfield from a CDS XML record indexed by marcFields."""
 
         if (self._verbosity > 3): print("+> getDatafieldValueList")
-        data = record.getElementsByTagName("datafield")
-        val = []
-        for datum in data:
-            if (datum.getAttribute("tag") == xmltag):
-                subdata = datum.getElementsByTagName("subfield")
-                for subdatum in subdata:
-                    if (subdatum.getAttribute("code")==subfield) :
-                        text = subdatum.firstChild
-                        if text:
-                            val.append(text.data)
+        val = [v for v in fields.get((xmltag, subfield), ()) if v]
         if val:
             return (val)
         else:
             return ('')
 
     def getDocInfoFromCDS(self, tag):
-        """ Get the list of PASs/Papers from CDS and parse. If tag is present, only do tag."""
-        from urllib3 import urlopen
-        from xml.dom.minidom import parse
+        """ Get the list of PASs/Papers from CDS and parse. If tag is present, only do tag.
 
-        if (self._verbosity > 2): print("+> getDocInfoFromCDS")
-        tagparse = re.compile('(?:CMS-){0,1}([A-Za-z]{3})-(\d{2})-(\d{3})') # parse XXX-YY-NNN
-        dateparse = re.compile('(\d{4})|.*(\d{4})') # either YYYYMMDD or YYYY-MM-DD, but only need year. Also 'DD Mmm YYYY'
+        The records are kept in a local cache (self._cdsCacheFile), with a hash of each. Once the cache holds the
+        collection, a refresh only asks CDS for the records modified since the last sync (one day of margin), and sends
+        the ETag / Last-Modified of each page fetched by the last sync, so unchanged pages are not downloaded again.
+        The first result page gives the total number of records (kept in the cache, for when that page is unchanged);
+        every other page is then requested, whether or not the first one changed, concurrently
+        (self._jobs at a time, each worker thread with its own HTTP session, which keeps its connection and retries) and merged in order as they arrive.
+        The documents are then taken from all the cached records, most recent first.
+        Records deleted from CDS stay in the cache until a full refresh (self._fullSync).
+        """
+        import datetime
 
-        url = "http://cdsweb.cern.ch/search?cc=CMS+Physics+Analysis+Summaries&of=xm"
+        if (self._verbosity > 2): print("+> getDocInfoFromCDS")
+        url = self._cdsUrl + "/search?cc=CMS+Physics+Analysis+Summaries&of=xm"
         if self._noteType == "papers":
-                    url = "http://cdsweb.cern.ch/search?cc=CMS%20Papers&of=xm"
+                    url = self._cdsUrl + "/search?cc=CMS%20Papers&of=xm"
         if (tag):
-            m = tagparse.match(tag)
+            m = _tagParse.match(tag)
             if ( not m):
                 raise DocListException ( "Note tag %s is not of the form XXX-YY-NNN" % tag )
             url = url+"&p=037__a:CMS-PAS-"+m.group(1)+"-"+m.group(2)+"-"+m.group(3)
+        url += "&rg={0}".format(self._pageSize)
+
+        cacheFile = self._cdsCacheFile if not tag else None # a single document is not worth caching
+        cache = self._loadCDSCache(cacheFile, url) if cacheFile and not self._fullSync else None
+        if not cache:
+            cache = {'url': url, 'synced': None, 'records': {}, 'validators': {}, 'firstPage': None}
+        started = datetime.datetime.utcnow()
+        query = url
+        if cache['synced']:
+            query += "&dt=m&d1={0}".format((cache['synced'] - datetime.timedelta(days=1)).strftime("%Y-%m-%d")) # modified since
+            if (self._verbosity > 0): print("Fetching the records modified since ", cache['synced'].strftime("%Y-%m-%d %H:%M UTC"))
+        sessions = cdsSessions(self._retries)
+        try:
+            changed = self._fetchCDSRecords(sessions, query, cache)
+        finally:
+            sessions.close()
+        cache['synced'] = started
+        if cacheFile:
+            self._saveCDSCache(cacheFile, cache)
+        if (self._verbosity > 0): print("CDS records: ", len(cache['records']), " cached, ", changed, " new or changed")
+        ordered = sorted(cache['records'].items(), key=lambda item: int(item[0]) if item[0].isdigit() else 0, reverse=True)
+        self.getDocInfoFromFields(fields for cdsID, (digest, fields) in ordered)
+
+    def _fetchCDSRecords(self, sessions, url, cache):
+        """ Fetch all the pages of a CDS search into the cache, skipping the parsing of those unchanged since the last sync.
+
+        The validators of the pages requested replace those of the last sync in the cache, so they do not accumulate.
+        They are merged here, in the calling thread, as the pages are taken in order from the workers.
+
+        :return: number of new or changed records
+        """
+        import concurrent.futures
+
+        validators = {} # validators of the pages of this sync
+        key, validator, content = self._fetchPage(sessions, url, cache['validators'])
+        if content is None and not cache.get('firstPage'):
+            key, validator, content = self._fetchPage(sessions, url, {}) # unchanged, but its record counts are unknown
+        if validator:
+            validators[key] = validator
+        if content is None:
+            if (self._verbosity > 0): print("First page unchanged since the last sync")
+            changed = 0
+            count, total = cache['firstPage']
+        else:
+            records = marcRecords(io.BytesIO(content))
+            changed = self._storeRecords(records, cache['records'])
+            if (self._verbosity > 0): print("Retrieved ", records.count, "records of ", records.total)
+            count, total = cache['firstPage'] = (records.count, records.total)
+        if count:
+            # jrec counts from 1; the page size is the number of records CDS actually returned
+            pages = ["{0}&jrec={1}".format(url, jrec) for jrec in range(count + 1, total + 1, count)]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self._jobs) as pool:
+                pending = collections.deque()
+                for page in pages:
+                    pending.append(pool.submit(self._fetchPage, sessions, page, cache['validators']))
+                    if len(pending) >= 2*self._jobs: # bound the pages held in memory
+                        changed += self._addCDSPage(pending.popleft().result(), cache['records'], validators)
+                while pending:
+                    changed += self._addCDSPage(pending.popleft().result(), cache['records'], validators)
+        cache['validators'] = validators
+        return changed
 
-        xobj = urlopen(url)
-        dom = parse(xobj)
-        commentnode = dom.firstChild
-        if (commentnode.nodeType != Node.COMMENT_NODE):
-            raise  DocListException ( "Did not get total record count as XML comment" )
-            # expect: " Search-Engine-Total-Number-Of-Results: 149"
-        mtotal = re.match(r'[^\d]+(\d+)\s*$',commentnode.data)
-        if (not mtotal):
-            raise  DocListException ( "Did not get total record count as XML comment: %s" % commentnode.data )
-        totalrecs = int(mtotal.group(1))
-        records = dom.getElementsByTagName("record")
-        processed = 0
-        while ( processed < totalrecs ):
-            if (opts.verbose): print("Retrieved ", records.length, "records")
-            for record in records:
-                controls =  record.getElementsByTagName("controlfield")
-                for control in controls:
-                    if (control.getAttribute("tag") == "001"):
-                        text = control.firstChild
-                        if (not text): raise DocListBadXML
-                        cdsID = text.data
+    def _fetchPage(self, sessions, url, validators):
+        """ One page of CDS search results (the session retries failed requests)
+
+        Validators are keyed by the page URL without the modified-since query (dt, d1), whose date changes from one sync to the
+        next; the server compares them with the page it would send, so a page of an earlier query still validates.
+
+        :param sessions: cdsSessions, of which the calling thread's session is used
+        :param validators: dictionary of page key: (ETag, Last-Modified) of the pages fetched by the last sync (only read)
+        :return: (page key, (ETag, Last-Modified) of the page or None if the server sent neither, the page as bytes (read whole,
+                 then parsed from memory by marcRecords) or None if it is unchanged since it was last fetched)
+        """
+        import requests
+
+        if (self._verbosity > 2): print("+> fetching ", url)
+        key = _pageKey.sub('', url)
+        headers = {}
+        etag, modified = validators.get(key, (None, None))
+        if etag:
+            headers['If-None-Match'] = etag
+        if modified:
+            headers['If-Modified-Since'] = modified
+        try:
+            response = sessions.session().get(url, headers=headers, timeout=self._timeout)
+            if response.status_code == 304:
+                return (key, (etag, modified), None)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise DocListError ( "Could not fetch %s: %s" % (url, e) )
+        validator = (response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return (key, validator if any(validator) else None, response.content)
+
+    def _addCDSPage(self, page, store, validators):
+        """ Store the records of a page returned by _fetchPage, and its validators
+
+        :return: number of new or changed records
+        """
+        key, validator, content = page
+        if validator:
+            validators[key] = validator
+        if content is None:
+            return 0
+        records = marcRecords(io.BytesIO(content))
+        changed = self._storeRecords(records, store)
+        if (self._verbosity > 0): print("Retrieved ", records.count, "records")
+        return changed
+
+    def _storeRecords(self, records, store):
+        """ Keep the fields of each record used by getDocInfoFromFields, with their hash, by CDS record ID
+
+        :param records: iterable of <record> elements
+        :param store: dictionary of cdsID: (hash, {(tag, subfield code): values}), updated
+        :return: number of new or changed records
+        """
+        changed = 0
+        for record in records:
+            fields = dict(item for item in marcFields(record).items() if item[0][0] in _cdsTags)
+            cdsID = self.getDatafieldValue(fields,"001","")
+            if (not cdsID): raise DocListBadXML
+            digest = hashlib.sha1(repr(sorted(fields.items())).encode('utf-8')).hexdigest()
+            if store.get(cdsID, (None,))[0] != digest:
+                store[cdsID] = (digest, fields)
+                changed += 1
+        return changed
+
+    def _loadCDSCache(self, cacheFile, url):
+        """ Load the CDS record cache written by _saveCDSCache
+
+        :param cacheFile: cache file
+        :param url: search URL the cache must be for
+        :return: the cache dictionary, or None if missing, unreadable, or for another search
+        """
+        try:
+            with io.open(cacheFile,'rb') as f:
+                cache = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, IndexError):
+            return None
+        if not isinstance(cache, dict) or cache.get('version') != _cdsCacheFormat or cache.get('url') != url:
+            return None
+        return cache
+
+    def _saveCDSCache(self, cacheFile, cache):
+        """ Pickle the CDS record cache, through a temporary file so an interrupted run leaves the old cache """
+        cache['version'] = _cdsCacheFormat
+        tmpFile = cacheFile + '.tmp'
+        try:
+            with io.open(tmpFile,'wb') as f:
+                pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpFile, cacheFile)
+        except (IOError, OSError) as e:
+            if self._verbosity > 0:
+                print("Could not write the CDS cache file {0}: {1}".format(cacheFile, e))
+
+    def getDocInfoFromMarc(self, records):
+        """ Add the documents of a series of CDS MARCXML records (e.g. a marcRecords page) to the bib information.
+
+        :param records: iterable of <record> elements
+        """
+        self.getDocInfoFromFields(marcFields(record) for record in records)
+
+    def getDocInfoFromFields(self, records):
+        """ Add the documents of a series of CDS records indexed by marcFields to the bib information.
+
+        :param records: iterable of dictionaries of (tag, subfield code): values
+        """
+        for fields in records:
+            cdsID = self.getDatafieldValue(fields,"001","")
+            if (not cdsID): raise DocListBadXML
+            cdsTag = None
+            if self._noteType == "papers":
+                cdsTagList = self.getDatafieldValueList(fields,"088","a") # example: CMS-PAS-EXO-10-005 or CERN-PH-EP-...
+                for t in cdsTagList:
+                    m = _tagParse.search(t)
+                    if m:
+                        cdsTag = m.group(1)+'-'+m.group(2)+'-'+m.group(3)
                         break
-                if (not cdsID): raise DocListBadXML
-                cdsTag = None
-                if self._noteType == "papers":
-                    cdsTagList = self.getDatafieldValueList(record,"088","a") # example: CMS-PAS-EXO-10-005 or CERN-PH-EP-...
-                    for t in cdsTagList:
-                        m = tagparse.search(t)
-                        if m:
-                            cdsTag = m.group(1)+'-'+m.group(2)+'-'+m.group(3)
-                            break
-                else:
-                    cdsTag = self.getDatafieldValue(record,"037","a") # example: CMS-PAS-EXO-10-005
-                    m = tagparse.search(cdsTag)
-                    if (not m):
-                        raise DocListError ( "Note tag returned from CDS %s is not of the form XXX-YY-NNN" % tag )
-                if cdsTag:
-                    cdsTitle = self.getDatafieldValue(record,"245","a")
-                    cdsDate = self.getDatafieldValue(record,"269","c")
-                    if self._noteType == "papers": 
-                        cdsJournal = self.getDatafieldValue(record,"773","p")
-                        cdsDoi = self.getDatafieldValue(record,"773","a")
-                        cdsVolume = self.getDatafieldValue(record,"773","v")
-                        cdsYear = self.getDatafieldValue(record,"773","y")
-                        cdsPages = self.getDatafieldValue(record,"773","c")
-                        cdsArXiv = self.getDatafieldValue(record,"037","a")
-                    if (not cdsTitle): 
-                        cdsTitle="++> FIX ME: Title not found! <++"
-                    if (not cdsDoi):
-                        if (self._verbosity > 0) : print(" >> CDS Paper missing doi entry (will skip as unpublished). Tag: ",cdsTag)
-                    else:                    
-                        if (self._verbosity > 1) : 
-                            try:
-                                print(" >> CDS Info-->Tag: ",cdsTag, "cdsId: ", cdsID, "cdsTitle: ",cdsTitle)
-                            except UnicodeEncodeError:
-                                print(" >> CDS Info-->Tag: ",cdsTag, "cdsId: ", cdsID, "cdsTitle: -- contains unprintable unicode chars -- ")
-                            
-                        tag = m.group(1)+"-"+m.group(2)+"-"+m.group(3)
-                        tag = tag.encode('latin-1') # necessary for pre python 3 shelve
-                        n = dateparse.match(cdsDate)
-                        if (not n):
-                            cdsDate = "20"+m.group(2) # rough guess at year if not properly placed in CDS record 
-                        else:
-                            cdsDate = max(n.groups()) # can be in either 1st or 2nd group
-                        bibentry = { "tag": cdsTag, "cdsTitle": cdsTitle, "cdsID": cdsID, "cdsDate": cdsDate}
-                        if self._noteType == "papers":
-                            bibentry.update({"cdsJournal": cdsJournal, "cdsDoi": cdsDoi, "cdsVolume": cdsVolume, "cdsYear": cdsYear, "cdsPages": cdsPages, "cdsArXiv": cdsArXiv})
-                        if (not tag in self._bib) or self._overwrite:
-                            if (self._verbosity > 1) : print(" >> New/overwritten entry: ", tag)
-                            self._bib[tag] = bibentry
-            processed += records.length
-            if ( processed < totalrecs ):   # should think of some way to avoid checking twice
-                xobj = urlopen(url+"&jrec={0}".format(processed))
-                dom = parse(xobj)
-                records = dom.getElementsByTagName("record")
+            else:
+                cdsTag = self.getDatafieldValue(fields,"037","a") # example: CMS-PAS-EXO-10-005
+                m = _tagParse.search(cdsTag)
+                if (not m):
+                    raise DocListError ( "Note tag returned from CDS %s is not of the form XXX-YY-NNN" % cdsTag )
+            if cdsTag:
+                cdsTitle = self.getDatafieldValue(fields,"245","a")
+                cdsDate = self.getDatafieldValue(fields,"269","c")
+                if self._noteType == "papers": 
+                    cdsJournal = self.getDatafieldValue(fields,"773","p")
+                    cdsDoi = self.getDatafieldValue(fields,"773","a")
+                    cdsVolume = self.getDatafieldValue(fields,"773","v")
+                    cdsYear = self.getDatafieldValue(fields,"773","y")
+                    cdsPages = self.getDatafieldValue(fields,"773","c")
+                    cdsArXiv = self.getDatafieldValue(fields,"037","a")
+                if (not cdsTitle): 
+                    cdsTitle="++> FIX ME: Title not found! <++"
+                if (self._noteType == "papers" and not cdsDoi):
+                    if (self._verbosity > 0) : print(" >> CDS Paper missing doi entry (will skip as unpublished). Tag: ",cdsTag)
+                else:                    
+                    if (self._verbosity > 1) : 
+                        try:
+                            print(" >> CDS Info-->Tag: ",cdsTag, "cdsId: ", cdsID, "cdsTitle: ",cdsTitle)
+                        except UnicodeEncodeError:
+                            print(" >> CDS Info-->Tag: ",cdsTag, "cdsId: ", cdsID, "cdsTitle: -- contains unprintable unicode chars -- ")
+                        
+                    tag = m.group(1)+"-"+m.group(2)+"-"+m.group(3)
+                    n = _dateParse.match(cdsDate)
+                    if (not n):
+                        cdsDate = "20"+m.group(2) # rough guess at year if not properly placed in CDS record 
+                    else:
+                        cdsDate = n.group(1) or n.group(2) # can be in either 1st or 2nd group
+                    bibentry = { "tag": cdsTag, "cdsTitle": cdsTitle, "cdsID": cdsID, "cdsDate": cdsDate}
+                    if self._noteType == "papers":
+                        bibentry.update({"cdsJournal": cdsJournal, "cdsDoi": cdsDoi, "cdsVolume": cdsVolume, "cdsYear": cdsYear, "cdsPages": cdsPages, "cdsArXiv": cdsArXiv})
+                    if (not tag in self._bib) or self._overwrite:
+                        if (self._verbosity > 1) : print(" >> New/overwritten entry: ", tag)
+                        self._bib[tag] = bibentry
 
     def titleFromSVNtoBib(self, tag):
         """ Extract the title directly from the svn repository"""
@@ -342,41 +575,78 @@ class DocList:
             
      
             
-    def generateBib(self):
-    
-        from datetime import datetime 
-        
-        f = open(self._bibFilename,"w") # wipes out old version
-        f.write("BibFile generated by pas-bib version {0}, ".format(version)+datetime.utcnow().strftime("%Y-%m-%d %H:%m UTC")+"\n")
+    def bibEntry(self, doc):
+        """ BibTeX entry of a document, from the CDS (and svn) information
+
+        :param doc: document tag, XXX-YY-NNN
+        :return: the entry text, or None for a paper not yet published (no DOI)
+        """
+        vals = self._bib[doc]
+        if (self._noteType == "papers" and not "cdsDoi" in vals):  # test missing cdsDoi to tag unpublished papers
+            return None
+        keybase = "CMS-PAPERS-" if self._noteType == "papers" else "CMS-PAS-"
+        if "svnTitle" in vals :
+            title = re.sub(r"\\\\"," ",vals["svnTitle"]) # remove TeX line breaks
+        else:
+            title = vals["cdsTitle"]
+        lines = ['@ARTICLE{'+keybase+'{0},'.format(doc),
+                 '      AUTHOR      = "{CMS Collaboration}",',
+                 '      COLLABORATION = {CMS},',
+                 '      TITLE       = "{0}",'.format(title)]
         if self._noteType == "papers":
-            keybase = "CMS-PAPERS-"
+            lines += ['      JOURNAL     = "{0}",'.format(vals["cdsJournal"]),
+                      '      VOLUME      = "{0}",'.format(vals["cdsVolume"]),
+                      '      DOI         = "{0}",'.format(vals["cdsDoi"])]
         else:
-            keybase = "CMS-PAS-"
-        for doc in sorted(self._bib, key=lambda z: z[4:6]+z[0:2]+z[7:10], reverse=True ): # sort descending by (year, group, number)
-            vals = self._bib[doc]
-            if (self._noteType != "papers" or "cdsDoi" in vals):  # test missing cdsDoi to tag unpublished papers
-                entry  = '@ARTICLE{'+keybase+'{0},\n'.format(doc)
-                entry += '      AUTHOR      = "{CMS Collaboration}",\n'
-                entry += '      COLLABORATION = {CMS},\n'
-                if "svnTitle" in vals :
-                    stripped = re.sub(r"\\\\"," ",vals["svnTitle"]) # remove TeX line breaks
-                    entry += '      TITLE       = "{0}",\n'.format(stripped)
-                else:
-                    entry += '      TITLE       = "{0}",\n'.format(vals["cdsTitle"])
-                if self._noteType == "papers":
-                    entry += '      JOURNAL     = "{0}",\n'.format(vals["cdsJournal"])
-                    entry += '      VOLUME      = "{0}",\n'.format(vals["cdsVolume"])
-                    entry += '      DOI         = "{0}",\n'.format(vals["cdsDoi"])          
-                    entry += '      YEAR        = "{0}"\n'.format(vals["cdsDate"][0:4]) # no comma for last entry  
-                else:
-                    entry += '      URL         = "http://cdsweb.cern.ch/record/{0}",\n'.format(vals["cdsID"])
-                    entry += '      JOURNAL     = "CMS Physics Analysis Summary",\n'
-                    #entry += '      VOLUME      = "\href{http://cdsweb.cern.ch/record/'+'{0}'.format(vals["cdsID"])+'}{'+'CMS-PAS-{0}'.format(doc)+'}",\n'
-                    entry += '      VOLUME      =  "CMS-PAS-{0}",\n'.format(doc)
-                    entry += '      YEAR        = "{0}"\n'.format(vals["cdsDate"][0:4]) # no comma for last entry
-                entry += '}\n'
-                f.write(entry)
-        f.close()
+            lines += ['      URL         = "http://cdsweb.cern.ch/record/{0}",'.format(vals["cdsID"]),
+                      '      JOURNAL     = "CMS Physics Analysis Summary",',
+                      '      VOLUME      =  "CMS-PAS-{0}",'.format(doc)]
+        lines += ['      YEAR        = "{0}"'.format(vals["cdsDate"][0:4]), # no comma for last entry
+                  '}', '']
+        return '\n'.join(lines)
+
+    def generateBib(self):
+        """ Write the bib file, merged with the existing one: entries are sorted descending by (year, group, number),
+        entries whose document is unchanged keep their text, and entries of the existing file which cannot be generated
+        again (e.g. from documents no longer returned by CDS) are kept as they are. If no entry changed, the file is left
+        untouched (with its header date and modification time); otherwise it is written to a temporary file which
+        replaces the old one.
+        """
+        from datetime import datetime 
+
+        old = {} # doc: entry text of the existing file
+        if os.path.exists(self._bibFilename):
+            with io.open(self._bibFilename,"r",encoding="utf-8") as f:
+                text = f.read()
+            try:
+                for artType, key, fields, start, end in parseBib(text):
+                    old.setdefault(key[-10:], text[start:end] + '\n') # uses last 10 chars, as getDocInfoFromBib
+            except ValueError as e:
+                raise DocListError ( "Could not parse %s: %s" % (self._bibFilename, e) )
+        entries = []
+        counts = collections.Counter()
+        for doc in sorted(set(self._bib) | set(old), key=_docOrder, reverse=True ): # sort descending by (year, group, number)
+            entry = self.bibEntry(doc) if doc in self._bib else None
+            if entry is None:
+                entry = old[doc] if doc in old else None
+                counts['kept'] += entry is not None
+            elif not doc in old:
+                counts['new'] += 1
+            elif entry != old[doc]:
+                counts['changed'] += 1
+            if entry is not None:
+                entries.append(entry)
+        body = ''.join(entries)
+        if old and text.partition('\n')[2] == body: # same entries after the header line
+            if (self._verbosity > 0): print("Bib file %s unchanged: not rewritten" % self._bibFilename)
+            return
+        tmpFile = self._bibFilename + ".tmp"
+        with io.open(tmpFile,"w",encoding="utf-8") as f:
+            f.write("BibFile generated by pas-bib version {0}, ".format(version)+datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")+"\n")
+            f.write(body)
+        os.replace(tmpFile, self._bibFilename)
+        if (self._verbosity > 0):
+            print("Wrote %s: %d entries, %d new, %d changed, %d kept from the old file" % (self._bibFilename, len(entries), counts['new'], counts['changed'], counts['kept']))
             
                         
          
@@ -398,6 +668,14 @@ def main(argv):
                         help="note type: notes (PAS) [default], or papers")
     parser.add_option("-o","--overwrite", action="store_false", dest="overwrite",
                         help="normally existing bib entries are not overwritten with CDS or svn information")
+    parser.add_option("--cds-url", action="store", dest="cdsUrl", default=_cdsUrl,
+                        help="CDS server to query [default: %default]")
+    parser.add_option("-j", "--jobs", action="store", type="int", dest="jobs", default=4,
+                        help="number of CDS result pages fetched concurrently [default: %default]")
+    parser.add_option("--full", action="store_true", dest="full", default=False,
+                        help="refetch all the CDS records, instead of those modified since the last run")
+    parser.add_option("--no-cds-cache", action="store_false", dest="cdsCache", default=True,
+                        help="do not keep the CDS records (in the bib file name + .cds) for the next run")
     global opts
     (opts, args) = parser.parse_args()
     if opts.verbose:
@@ -406,7 +684,7 @@ def main(argv):
     if len(args) > 0:
         tag = args[len(args)-1]
         
-    pas = DocList(opts.verbose, opts.remoteUser, opts.type, opts.overwrite)
+    pas = DocList(opts.verbose, opts.remoteUser, opts.type, opts.overwrite, opts.cdsUrl, opts.jobs, opts.cdsCache, opts.full)
     pas.getDocInfoFromBib()
     pas.getDocInfoFromCDS(tag)
     if opts.svn:
@@ -0,0 +1,6 @@
+"""Make the utilities in export/utils/general importable by the tests."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
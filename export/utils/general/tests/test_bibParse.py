@@ -0,0 +1,22 @@
+"""Tests of the bib entry parser on malformed bib files."""
+
+import pytest
+
+from bibParse import parseBib
+
+_good = '@ARTICLE{good,\n  TITLE = {A {nested} title},\n  YEAR = "2020"\n}\n'
+
+def test_entries():
+    entries = list(parseBib(_good + _good.replace('good', 'other')))
+    assert [(artType, key) for artType, key, fields, start, end in entries] == [('ARTICLE', 'good'), ('ARTICLE', 'other')]
+    assert entries[0][2]['TITLE'] == 'A {nested} title'
+
+def test_unterminated_entry():
+    text = _good + '@ARTICLE{broken,\n  TITLE = {Never closed}\n'
+    with pytest.raises(ValueError, match=r'Unterminated entry starting at offset {0}: @ARTICLE\{{broken'.format(len(_good))):
+        list(parseBib(text))
+
+def test_missing_tag():
+    text = _good + '@ARTICLE{  = {No key},\n}\n'
+    with pytest.raises(ValueError, match=r"Could not find a tag in string starting with: @ARTICLE\{ = \{No key"):
+        list(parseBib(text))
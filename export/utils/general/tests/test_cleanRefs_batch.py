@@ -0,0 +1,44 @@
+"""Tests of cleanRefs --batch: a document with a broken bib file fails alone, and the others are still checked."""
+
+import io
+import os
+import json
+
+import pytest
+
+import cleanRefs
+from bench.corpus import makeCorpus, tag
+
+_options = {'verbose': 0, 'arxiv': True, 'cache': False, 'rulesFile': None, 'requiredFile': None, 'indexFile': None}
+
+def _corpus(directory, broken=None):
+    makeCorpus(str(directory), 50)
+    if broken:
+        with io.open(os.path.join(str(directory), 'auto_generated.bib'), 'a', encoding='utf-8') as f:
+            f.write(broken)
+    return (tag, str(directory))
+
+@pytest.mark.parametrize('broken', ['@ARTICLE{broken,\n  TITLE = {Never closed}\n', '@ARTICLE{  = {No key},\n}\n'])
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_broken_document(tmp_path, broken, jobs):
+    docs = [_corpus(tmp_path / 'first'), _corpus(tmp_path / 'broken', broken), _corpus(tmp_path / 'last')]
+    summaryFile = str(tmp_path / 'summary.json')
+    summaries = cleanRefs.runBatch(docs, _options, jobs, summaryFile)
+    assert [summary['status'] for summary in summaries][::2] == ['ok', 'ok']
+    assert summaries[1]['status'].startswith('failed: ')
+    for summary in summaries[::2]:
+        assert os.path.exists(summary['report'])
+    with io.open(summaryFile, 'r', encoding='utf-8') as f:
+        written = json.load(f)['documents']
+    assert [summary['base'] for summary in written] == [base for t, base in docs]
+
+def test_unexpected_error(tmp_path, monkeypatch):
+    docs = [_corpus(tmp_path / 'first'), _corpus(tmp_path / 'crash'), _corpus(tmp_path / 'last')]
+    checkRefs = cleanRefs.cleanRefs.checkRefs
+    def crash(self):
+        if self._baseDir == docs[1][1]:
+            raise RuntimeError('checker bug')
+        return checkRefs(self)
+    monkeypatch.setattr(cleanRefs.cleanRefs, 'checkRefs', crash)
+    summaries = cleanRefs.runBatch(docs, _options, 1)
+    assert [summary['status'] for summary in summaries] == ['ok', 'failed: RuntimeError: checker bug', 'ok']
@@ -0,0 +1,28 @@
+"""Tests of the similar-title check: only cited entries are compared, unless the verbosity is above 1."""
+
+import io
+import contextlib
+
+import pytest
+
+import cleanRefs
+
+_title = 'Search for heavy neutral resonances decaying to pairs of top quarks in proton-proton collisions at 13 TeV'
+_bib = {
+    'citedA': ('ARTICLE', {'TITLE': _title}),
+    'citedB': ('ARTICLE', {'TITLE': _title + '.'}),
+    'otherA': ('ARTICLE', {'TITLE': 'Measurement of the differential cross section of diboson production with the CMS detector'}),
+    'otherB': ('ARTICLE', {'TITLE': 'Measurement of the differential cross section of diboson production with the {CMS} detector'}),
+    'single': ('ARTICLE', {'TITLE': 'Observation of a new boson at a mass of 125 GeV'}),
+}
+
+@pytest.mark.parametrize('verbose, rules', [(0, ['similar-title-used']), (2, ['similar-title-used', 'similar-title', 'similar-title'])])
+def test_similar_titles(tmp_path, verbose, rules):
+    refs = cleanRefs.cleanRefs('BENCH', str(tmp_path), verbose, True, cache=False)
+    refs._refs = ['citedA', 'single', 'citedB']
+    with contextlib.redirect_stdout(io.StringIO()):
+        refs.checkForSimilarTitles(_bib)
+    assert [diag.rule for diag in refs._diagnostics] == rules
+    assert refs._diagnostics[0].key == 'citedA,citedB'
+    if verbose > 1:
+        assert [diag.key for diag in refs._diagnostics[1:]] == ['citedA,citedB', 'otherA,otherB']
@@ -0,0 +1,160 @@
+""" getDocInfoFromCDS against a local HTTP stand-in for the CDS search """
+
+import os
+import datetime
+import sys
+import pickle
+import threading
+import importlib.util
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+pytest.importorskip('requests')
+
+_here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _pasBib():
+    if not 'pasbib' in sys.modules:
+        spec = importlib.util.spec_from_file_location('pasbib', os.path.join(_here, 'pas-bib.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules['pasbib'] = module
+    return sys.modules['pasbib']
+
+def _record(cdsID, title):
+    number = cdsID % 1000
+    return '''<record>
+  <controlfield tag="001">{0}</controlfield>
+  <datafield tag="037" ind1=" " ind2=" "><subfield code="a">arXiv:2101.{0:05d}</subfield></datafield>
+  <datafield tag="088" ind1=" " ind2=" "><subfield code="a">CMS-TST-21-{1:03d}</subfield></datafield>
+  <datafield tag="245" ind1=" " ind2=" "><subfield code="a">{2}</subfield></datafield>
+  <datafield tag="269" ind1=" " ind2=" "><subfield code="c">2021-03-01</subfield></datafield>
+  <datafield tag="773" ind1=" " ind2=" "><subfield code="a">10.1000/tst.{0}</subfield><subfield code="p">JHEP</subfield><subfield code="v">03</subfield><subfield code="y">2021</subfield><subfield code="c">{0}</subfield></datafield>
+</record>
+'''.format(cdsID, number, title)
+
+class _CDS(BaseHTTPRequestHandler):
+    """ CDS search: rg and jrec page the records, most recent first; dt=m with d1 keeps those modified since d1 (YYYY-MM-DD).
+        Pages carry an ETag, and a matching If-None-Match gets 304. self.server.failures maps jrec to the statuses
+        to answer before the page itself. """
+
+    def do_GET(self):
+        server = self.server
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        with server.lock:
+            server.requests.append(query)
+            failures = server.failures.get(int(query.get('jrec', ['1'])[0]))
+            status = failures.pop(0) if failures else None
+        if status:
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        since = query.get('d1', [''])[0] if query.get('dt') == ['m'] else ''
+        records = [record for record in server.records if record[2] >= since]
+        size = int(query.get('rg', ['10'])[0])
+        first = int(query.get('jrec', ['1'])[0]) - 1
+        page = ('<?xml version="1.0" encoding="UTF-8"?>\n<!-- Search-Engine-Total-Number-Of-Results: {0} -->\n'
+                '<collection xmlns="http://www.loc.gov/MARC21/slim">\n{1}</collection>\n').format(
+                len(records), ''.join(_record(cdsID, title) for cdsID, title, modified in records[first:first+size])).encode('utf-8')
+        etag = '"{0:x}"'.format(hash(page) & 0xffffffff)
+        if self.headers.get('If-None-Match') == etag:
+            with server.lock:
+                server.notModified += 1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(page)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(page)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def cds():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _CDS)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.failures = {}
+    server.notModified = 0
+    server.records = [(2000 + n, 'Paper {0}'.format(n), '2021-01-01') for n in range(45, 0, -1)] # (CDS ID, title, modified)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def _docs(cds, jobs=3):
+    docs = _pasBib().DocList(0, None, 'papers', False, cdsUrl='http://127.0.0.1:{0}'.format(cds.server_address[1]), jobs=jobs)
+    docs._pageSize = 10
+    docs._retries = 2
+    return docs
+
+def _pages(requests):
+    return sorted(int(query.get('jrec', ['1'])[0]) for query in requests)
+
+def test_paging(cds, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    docs = _docs(cds)
+    docs.getDocInfoFromCDS(None)
+    assert _pages(cds.requests) == [1, 11, 21, 31, 41]
+    assert all(query['rg'] == ['10'] for query in cds.requests)
+    assert len(docs._bib) == 45
+    assert docs._bib['TST-21-007']['cdsTitle'] == 'Paper 7'
+    with open('CMSPapersBib.bib.cds', 'rb') as f:
+        cache = pickle.load(f)
+    assert len(cache['records']) == 45
+    assert sorted(int(urllib.parse.parse_qs(key).get('jrec', ['1'])[0]) for key in cache['validators']) == [1, 11, 21, 31, 41]
+
+def test_retries(cds, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cds.failures = {1: [503], 21: [503, 502]}
+    docs = _docs(cds)
+    docs.getDocInfoFromCDS(None)
+    assert _pages(cds.requests) == [1, 1, 11, 21, 21, 21, 31, 41]
+    assert len(docs._bib) == 45
+
+def test_failed_page(cds, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cds.failures = {31: [500] * 3}
+    docs = _docs(cds)
+    with pytest.raises(_pasBib().DocListError, match='jrec=31'):
+        docs.getDocInfoFromCDS(None)
+    assert _pages(cds.requests).count(31) == 3
+    assert not os.path.exists('CMSPapersBib.bib.cds')
+
+def test_modified_since(cds, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _docs(cds).getDocInfoFromCDS(None)
+    today = datetime.datetime.utcnow().strftime("%Y-%m-%d")
+    with cds.lock:
+        cds.records = [(2046, 'Paper 46', today)] + [(cdsID, 'Revised ' + title if cdsID > 2034 else title, today if cdsID > 2034 else modified)
+                                                      for cdsID, title, modified in cds.records]
+        cds.requests = []
+    docs = _docs(cds)
+    docs.getDocInfoFromCDS(None)
+    assert _pages(cds.requests) == [1, 11]
+    assert all(query['dt'] == ['m'] and query['d1'] for query in cds.requests)
+    assert len(docs._bib) == 46
+    assert docs._bib['TST-21-046']['cdsTitle'] == 'Paper 46'
+    assert docs._bib['TST-21-040']['cdsTitle'] == 'Revised Paper 40'
+    assert docs._bib['TST-21-007']['cdsTitle'] == 'Paper 7'
+
+def test_nothing_changed(cds, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _docs(cds).getDocInfoFromCDS(None)
+    for notModified in (0, 1): # the second refresh sends the validators of the first, and gets 304
+        with cds.lock:
+            cds.requests = []
+        docs = _docs(cds)
+        docs.getDocInfoFromCDS(None)
+        assert len(cds.requests) == 1 and cds.requests[0]['dt'] == ['m']
+        assert cds.notModified == notModified
+        assert len(docs._bib) == 45